@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from copral import metricas_sql
+
+        # métricas de SQL bruto (SQL_METRICAS=True) também nas conexões do Django
+        connection_created.connect(metricas_sql.instalar, dispatch_uid='copral_metricas_sql')
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import painel, relatorio, atualizarDados, ordemServicoList, ordemServicoCreate, ordemServicoUpdate, ordemServicoDelete, relatorio_movimento, home, cartao_visita
+from .views import painel, relatorio, atualizarDados, ordemServicoList, ordemServicoCreate, ordemServicoUpdate, ordemServicoDelete, relatorio_movimento, home, cartao_visita, sql_metricas
 
 app_name = 'app'
 
@@ -17,4 +17,5 @@ urlpatterns = [
     path('ordem_servico/atualiza_os/<int:id>', ordemServicoUpdate, name="os_update"),
     path('ordem_servico/deleta_os/<int:id>', ordemServicoDelete, name="os_delete"),
     path('rh/cartao-visita/', cartao_visita.as_view(), name='cartao_visita'),
+    path('sql/metricas/', sql_metricas, name='sql_metricas'),
 ]
\ No newline at end of file
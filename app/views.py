@@ -9,6 +9,8 @@ import qrcode
 import io
 from .forms import CamposForm, OrdemServicoForm
 from copral import connectionFactory as cf
+from copral import imagens
+from copral import metricas_sql
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .processamento  import inserir_dados, processar, deletar_dados, id_carro
@@ -17,7 +19,6 @@ from .models import OrdemServico
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.views.generic import ListView, TemplateView
 from .analitico import procedure, tempEventos
-from PIL import Image
 from django.db.models import Count, Q
 from trucks.models import TrucksPosicaoCarroApi, TrucksVeiculos, TrucksImportadosExcel
 from django.utils import timezone
@@ -27,6 +28,7 @@ import os
 from django.conf import settings
 from datetime import datetime
 import logging
+from trucks.consultas import ConsultaJornada, consulta_distintos
 
 @login_required
 def home(request):
@@ -103,34 +105,17 @@ class cartao_visita(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
             qr.make(fit=True)
             img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
 
-            # Abrir e redimensionar a logo
-            logo = Image.open("staticfiles/img/logo.png")  # caminho da logo
+            # Logo já redimensionada e sobre fundo branco (pré-processada uma vez por processo)
             qr_width, qr_height = img.size
             logo_size = int(qr_width * 0.2)  # máximo 30% do QR
-            
-            # Certificar que a logo está em modo RGBA para preservar transparência
-            if logo.mode != "RGBA":
-                logo = logo.convert("RGBA")
-            
-            # Redimensionar mantendo a proporção
-            logo = logo.resize((logo_size, logo_size), Image.LANCZOS)
+            logo = imagens.logo_qr(logo_size)
 
-            # Criar um fundo branco (escolha uma das opções abaixo)
-            
-            # OPÇÃO 1: Fundo branco simples (quadrado)
-            background = Image.new("RGBA", (logo_size, logo_size), (255, 255, 255, 255))
-            
             # Calcular posição central
             pos = ((qr_width - logo_size) // 2, (qr_height - logo_size) // 2)
 
-            # Converter QR para RGBA para suportar transparência
+            # Converter QR para RGBA para suportar transparência e colar a logo
             img = img.convert("RGBA")
-            
-            # Primeiro, colar o fundo branco
-            img.paste(background, pos, background)
-            
-            # Depois, colar a logo por cima
-            img.paste(logo, pos, logo)
+            img.paste(logo, pos)
 
             # Salvar em memória
             buf = io.BytesIO()
@@ -162,60 +147,6 @@ def painel(request):
     return render(request, 'app/painel.html')
 
 
-def procHoras(tabela):
-    global paradoLigado
-
-    paradoLigado = 0
-    veiMovimento = 0
-    tempoNoturno = 0
-    horarioAlmoco = 0
-    extraNoturno = 0
-    tempoEspera = 0
-    tempoJornada = 0
-    extrasDiurnas = 0
-    tempoDescaso = 0
-
-    for i in tabela:
-        tempoJornada = tempoJornada + int(convertSegundo(i[8]))
-        paradoLigado = paradoLigado + int(convertSegundo(i[9]))
-        veiMovimento = veiMovimento + int(convertSegundo(i[10]))
-        horarioAlmoco = horarioAlmoco + int(convertSegundo(i[11]))
-        tempoEspera = tempoEspera + int(convertSegundo(i[12]))
-        tempoDescaso = tempoDescaso + int(convertSegundo(i[13]))
-        tempoNoturno = tempoNoturno + int(convertSegundo(i[16]))
-        extrasDiurnas = extrasDiurnas + int(convertSegundo(i[17]))
-        extraNoturno = extraNoturno + int(convertSegundo(i[18]))
-    listFormatada = horasFormatada(
-        [tempoJornada, paradoLigado, veiMovimento, horarioAlmoco, tempoEspera, tempoDescaso, tempoNoturno,
-         extrasDiurnas, extraNoturno])
-
-    return listFormatada
-
-
-def convertSegundo(str):
-    print('erro aqui \n', str)
-    str2 = str
-    if str == None:
-        str2 = '00:00:00'
-    horasSegundos = int(str2[0:2]) * 3600
-    minutosSegundos = int(str2[3:5]) * 60
-    segundos = int(str2[6:9])
-
-    total = horasSegundos + minutosSegundos + segundos
-    return total
-
-
-def horasFormatada(*args):
-    list = []
-    for i in range(9):
-        horas = str(int(args[0][i] / 3600))
-        minutos = ('0' + str(int((args[0][i] / 60) % 60)))[-2:3]
-        segundos = ('0' + str((args[0][i] % 3600) % 60))[-2:3]
-        tempo = f"{horas}:{minutos}:{segundos}"
-        list.append(tempo)
-        i = i + 1
-    return list
-
 @login_required
 def relatorio(request):
     template_name = 'app/relatorio.html'
@@ -242,14 +173,16 @@ def relatorio(request):
         processar(placa=placa_carro, dt_inicial=periodo_inicial, dt_final=periodo_final)
         p = id_carro(placa=placa_carro)
         
-        query_resumos_diarios = f"select data, placa, horaAlmoco, tempoEspera, tempoDescanso from ResumoDiario where placa = '{placa_carro}' and data >= '{periodo_inicial}' and data <= '{periodo_final}'"
-        dados_resumos_diarios = cf.getAll(query_resumos_diarios)
-        query_pe = f"""
-                    SELECT * from processamentoEventos where placa = '{p}' and data between '{periodo_inicial}' and '{periodo_final}' order by inicio
-                    """
-        dados = cf.getAll(query_pe)
-        query_resumo = f"select * from ResumoDiario where placa = '{placa_carro}' and data = '{periodo_inicial}'"
-        dados_resumo = cf.getAll(query_resumo)
+        query_resumos_diarios = ConsultaJornada(
+            'data, placa, horaAlmoco, tempoEspera, tempoDescanso', 'ResumoDiario'
+        ).placa(placa_carro).periodo(periodo_inicial, periodo_final)
+        dados_resumos_diarios = cf.getAll(*query_resumos_diarios.sql())
+        query_pe = ConsultaJornada(tabela='processamentoEventos').placa(p).periodo(
+            periodo_inicial, periodo_final
+        ).order_by('inicio')
+        dados = cf.getAll(*query_pe.sql())
+        query_resumo = ConsultaJornada(tabela='ResumoDiario').placa(placa_carro).dia(periodo_inicial)
+        dados_resumo = cf.getAll(*query_resumo.sql())
         tempo_processado = timedelta(days=0, hours=0, minutes=0, seconds=0)
         
         evento = 'ESPERA'
@@ -349,8 +282,8 @@ def relatorio(request):
                     print(f"Tempo total: {tempo_total}")
 
                 if dt != data:
-                    query_resumo = f"select * from ResumoDiario where placa = '{placa}' and data = '{data.year}-{data.month}-{data.day}'"
-                    dados_resumo = cf.getAll(query_resumo)
+                    query_resumo = ConsultaJornada(tabela='ResumoDiario').placa(placa).dia(data)
+                    dados_resumo = cf.getAll(*query_resumo.sql())
                     # renova os dados com a data atual
                     for r in dados_resumo:
                         dt = r[2]
@@ -643,8 +576,10 @@ def atualizarDados(request):
         tempo_espera = request.POST.get('tempo_espera')
         tempo_descanso = request.POST.get('tempo_descanso')
 
-        query_data = f"select placa, data, horaAlmoco, tempoEspera, tempoDescanso, dtAlteracao, userAlteracao from vw_consolidado where placa = '{placa}' and data = '{data_op}'"
-        sql = cf.getAll(query_data)[0]
+        query_data, params_data = ConsultaJornada(
+            'placa, data, horaAlmoco, tempoEspera, tempoDescanso, dtAlteracao, userAlteracao'
+        ).placa(placa).igual('data', data_op).sql()
+        sql = cf.getAll(query_data, params_data)[0]
         print(query_data)
 
         #processamento de Horas Banco
@@ -677,8 +612,8 @@ def atualizarDados(request):
             hoje = date.today()
             dt_alteracao = hoje.strftime("%d/%m/%Y")
             #query para atualizar dado
-            up = f"update vw_consolidado SET horaAlmoco = '{hr_almoco}', tempoEspera = '{tempo_espera}', dtAlteracao = '{dt_alteracao}', userAlteracao = '{request.user}', tempoDescanso = '{tempo_descanso}' WHERE placa = '{placa}' and data = '{data_op}';"
-            cf.query(up)
+            up = "update vw_consolidado SET horaAlmoco = ?, tempoEspera = ?, dtAlteracao = ?, userAlteracao = ?, tempoDescanso = ? WHERE placa = ? and data = ?"
+            cf.query(up, [hr_almoco, tempo_espera, dt_alteracao, str(request.user), tempo_descanso, str(placa or '').strip(), data_op])
             print("Registro atualizado com sucesso.")
             mensagem = "Registro atualizado com sucesso."
             return JsonResponse({'info': mensagem}, status=200)
@@ -703,8 +638,7 @@ def atualizarDados(request):
 def ordemServicoList(request):
     template_name = 'app/ordem_servico/lista_os.html'
     lista_os = []
-    query_placa = 'select distinct placa from vw_consolidado'
-    placas = cf.getAll(query_placa)
+    placas = cf.getAll(*consulta_distintos('placa'))
     #lista_os = OrdemServico.objects.values('placa', 'data')
     form = OrdemServicoForm(request.POST or None)
     data_atual = date.today()
@@ -738,8 +672,7 @@ def ordemServicoCreate(request):
     if request.method == "POST":
         placa = request.POST.get('placa')
         os = request.POST.get('os')
-        query_placa = f"select placa from vw_consolidado where placa = '{placa}'"
-        placas = cf.getAll(query_placa)
+        placas = cf.getAll(*ConsultaJornada('placa').placa(placa).sql())
         data_atual = date.today()
         if placas:
             if form.is_valid():
@@ -795,8 +728,7 @@ def ordemServicoDelete(request, id):
 
 @login_required
 def relatorio_movimento(request):
-    query_placa = 'select distinct placa from vw_consolidado'
-    placas = cf.getAll(query_placa)
+    placas = cf.getAll(*consulta_distintos('placa'))
     template_name = 'app/relatorio_mov.html'
     dados = []
     if request.method == 'POST':
@@ -825,3 +757,27 @@ def relatorio_movimento(request):
         }
         return render(request, template_name, context)
 
+
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def sql_metricas(request):
+    """
+    Métricas de SQL bruto deste processo (copral/metricas_sql.py), JSON por comando:
+    total, p50/p95/máx em ms, linhas e bytes médios. ?ordem=p95_ms|p50_ms|max_ms|soma_ms|total
+    e ?limite=N; POST zera as métricas. Só para staff.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'Acesso restrito.'}, status=403)
+    if request.method == 'POST':
+        metricas_sql.limpar()
+        return JsonResponse({'success': True})
+    try:
+        limite = int(request.GET.get('limite') or 0) or None
+    except ValueError:
+        limite = None
+    return JsonResponse({
+        'success': True,
+        'ativo': metricas_sql.ativo(),
+        'comandos': metricas_sql.resumo(request.GET.get('ordem') or 'p95_ms', limite),
+    })
@@ -1,19 +1,33 @@
 import pyodbc
 import pandas as pd
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
 from django.conf import settings
 
+from copral import metricas_sql
+
+
+logger = logging.getLogger(__name__)
+
+
+def _string_conexao():
+    return (
+        f'Driver={{{os.getenv("DB_DRIVER", "ODBC Driver 17 for SQL Server")}}};'
+        f'Server={os.getenv("DB_HOST", "localhost")};'
+        f'uid={os.getenv("DB_USER", "")};'
+        f'pwd={os.getenv("DB_PASSWORD", "")};'
+        f'Database={os.getenv("DB_NAME", "")};'
+        f'Encrypt={os.getenv("DB_ENCRYPT", "yes")};'
+        f'TrustServerCertificate={os.getenv("DB_TRUST_SERVER_CERTIFICATE", "yes")};'
+    )
+
+
 def conexao():
     try:
-        conn = pyodbc.connect(
-            f'Driver={{{os.getenv("DB_DRIVER", "ODBC Driver 17 for SQL Server")}}};'
-            f'Server={os.getenv("DB_HOST", "localhost")};'
-            f'uid={os.getenv("DB_USER", "")};'
-            f'pwd={os.getenv("DB_PASSWORD", "")};'
-            f'Database={os.getenv("DB_NAME", "")};'
-            f'Encrypt={os.getenv("DB_ENCRYPT", "yes")};'
-            f'TrustServerCertificate={os.getenv("DB_TRUST_SERVER_CERTIFICATE", "yes")};'
-        )
+        conn = pyodbc.connect(_string_conexao())
         # print("Conexão bem-sucedida!")
         return conn
     except pyodbc.Error as ex:
@@ -25,58 +39,369 @@ def conexao():
         print("Erro inesperado:", e)
 
 
+class PoolConexoes:
+    """
+    Pool simples e thread-safe de conexões pyodbc.
+
+    - max_size: máximo de conexões abertas ao mesmo tempo (em uso + livres)
+    - idle_timeout: conexões paradas há mais tempo que isso são fechadas
+    - health_check: conexões paradas há mais de `health_check` segundos
+      passam por um SELECT 1 antes de serem entregues
+    - timeout: tempo máximo de espera por uma conexão livre
+    """
+
+    def __init__(self, max_size=10, idle_timeout=300, health_check=30, timeout=30):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.timeout = timeout
+        self._livres = []  # lista de (conn, ultimo_uso)
+        self._abertas = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _conexao_ok(self, conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            return True
+        except Exception:
+            return False
+
+    def _fechar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _limpar_ociosas(self):
+        # chamado com o lock adquirido
+        agora = time.monotonic()
+        manter = []
+        for conn, ultimo_uso in self._livres:
+            if self.idle_timeout and agora - ultimo_uso > self.idle_timeout:
+                self._fechar(conn)
+                self._abertas -= 1
+            else:
+                manter.append((conn, ultimo_uso))
+        self._livres = manter
+
+    def obter(self):
+        limite = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                self._limpar_ociosas()
+                item = None
+                if self._livres:
+                    # LIFO: reaproveita a conexão mais "quente"
+                    item = self._livres.pop()
+                elif self._abertas < self.max_size:
+                    self._abertas += 1
+                else:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise TimeoutError("Pool de conexões esgotado")
+                    self._cond.wait(restante)
+                    continue
+
+            if item is None:
+                # abre fora do lock para não travar as outras threads
+                try:
+                    conn = pyodbc.connect(_string_conexao())
+                except Exception:
+                    with self._cond:
+                        self._abertas -= 1
+                        self._cond.notify()
+                    raise
+                return conn
+
+            conn, ultimo_uso = item
+            if time.monotonic() - ultimo_uso <= self.health_check or self._conexao_ok(conn):
+                return conn
+
+            # conexão morta: descarta e tenta de novo
+            self._fechar(conn)
+            with self._cond:
+                self._abertas -= 1
+                self._cond.notify()
+
+    def devolver(self, conn, descartar=False):
+        if not descartar:
+            try:
+                # garante que nada fique pendente para o próximo uso
+                conn.rollback()
+            except Exception:
+                descartar = True
+        if descartar:
+            self._fechar(conn)
+        with self._cond:
+            if descartar:
+                self._abertas -= 1
+            else:
+                self._livres.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def fechar_todas(self):
+        with self._cond:
+            for conn, _ in self._livres:
+                self._fechar(conn)
+            self._abertas -= len(self._livres)
+            self._livres = []
+            self._cond.notify_all()
+
+    @contextmanager
+    def conexao(self):
+        conn = self.obter()
+        try:
+            yield conn
+        except pyodbc.Error:
+            # erro de banco pode deixar a conexão inutilizável
+            self.devolver(conn, descartar=not self._conexao_ok(conn))
+            raise
+        except BaseException:
+            self.devolver(conn)
+            raise
+        else:
+            self.devolver(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolConexoes(
+                    max_size=int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+                    idle_timeout=int(os.getenv("DB_POOL_IDLE_TIMEOUT", "300")),
+                    health_check=int(os.getenv("DB_POOL_HEALTH_CHECK", "30")),
+                    timeout=int(os.getenv("DB_POOL_TIMEOUT", "30")),
+                )
+    return _pool
+
+
+def conexao_pool():
+    """
+    Context manager que empresta uma conexão do pool:
+
+        with cf.conexao_pool() as conn:
+            conn.execute(sql)
+    """
+    return get_pool().conexao()
+
+
 def truncateTable(sql):
-    cursor = conexao()
-    cursor.execute(sql)
-    cursor.commit()
-    cursor.close()
+    with conexao_pool() as conn, metricas_sql.medir(sql, origem='cf'):
+        conn.execute(sql)
+        conn.commit()
 
-def query(sql):
-    cursor = conexao()
-    cursor.execute(sql)
-    cursor.commit()
-    cursor.close()
+def query(sql, params=None):
+    with conexao_pool() as conn, metricas_sql.medir(sql, params, 'cf'):
+        _executar(conn, sql, params)
+        conn.commit()
 
 def insert(sql, *args):
-    cursor = conexao()
-    cursor.execute(sql, *args)
-    cursor.commit()
-    cursor.close()
+    with conexao_pool() as conn, metricas_sql.medir(sql, args, 'cf'):
+        conn.execute(sql, *args)
+        conn.commit()
 
 
 def delete(sql, *args):
-    cursor = conexao()
-    cursor.execute(sql, *args)
-    cursor.commit()
-    cursor.close()
+    with conexao_pool() as conn, metricas_sql.medir(sql, args, 'cf'):
+        conn.execute(sql, *args)
+        conn.commit()
 
 def insertLote(sql, args):
-    cursor = conexao()
-    lista = args
-    for i in lista:
-        cursor.execute(sql, i)
-    cursor.commit()
-    cursor.close()
+    """Insert em lote com um único commit no fim (tudo ou nada)."""
+    insertBulk(sql, args)
+
+
+def _chunks(linhas, chunk_size):
+    bloco = []
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) >= chunk_size:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def _chunk_padrao():
+    return int(os.getenv("DB_BULK_CHUNK_SIZE", "1000"))
+
+
+def insertBulk(sql, linhas, chunk_size=None, commit_por_bloco=False):
+    """
+    Insere as linhas em blocos usando fast_executemany (um único round-trip
+    por bloco). Por padrão faz um único commit no fim: se um bloco falhar,
+    nada é gravado. Com commit_por_bloco=True cada bloco é confirmado ao
+    terminar (cargas muito grandes, log de transação menor), e uma falha
+    deixa gravados os blocos anteriores.
+
+    Retorna um dict com o total de linhas, tempo gasto e linhas/segundo.
+    """
+    chunk_size = chunk_size or _chunk_padrao()
+    inicio = time.perf_counter()
+    total = 0
+    with conexao_pool() as conn, metricas_sql.medir(sql, origem='cf:bulk') as m:
+        cursor = conn.cursor()
+        cursor.fast_executemany = True
+        try:
+            for bloco in _chunks(linhas, chunk_size):
+                cursor.executemany(sql, bloco)
+                if commit_por_bloco:
+                    conn.commit()
+                total += len(bloco)
+                m.contar(bloco)
+            conn.commit()
+        finally:
+            cursor.close()
+    return _resumo_bulk(total, inicio)
+
+
+def insertBulkTVP(procedure, linhas, chunk_size=None, commit_por_bloco=False):
+    """
+    Caminho para lotes muito grandes: envia cada bloco como um
+    table-valued parameter para uma procedure do tipo
+
+        CREATE PROCEDURE sp_x @linhas dbo.TipoTabela READONLY AS
+            INSERT INTO tabela SELECT * FROM @linhas
+
+    As linhas devem estar na mesma ordem das colunas do tipo de tabela.
+    Commit como em insertBulk (único no fim, ou por bloco se pedido).
+    """
+    chunk_size = chunk_size or int(os.getenv("DB_BULK_TVP_CHUNK_SIZE", "50000"))
+    inicio = time.perf_counter()
+    total = 0
+    with conexao_pool() as conn, metricas_sql.medir(f"EXEC {procedure} ?", origem='cf:tvp') as m:
+        cursor = conn.cursor()
+        try:
+            for bloco in _chunks(linhas, chunk_size):
+                cursor.execute(f"EXEC {procedure} ?", [[tuple(l) for l in bloco]])
+                if commit_por_bloco:
+                    conn.commit()
+                total += len(bloco)
+                m.contar(bloco)
+            conn.commit()
+        finally:
+            cursor.close()
+    return _resumo_bulk(total, inicio)
+
+
+def _resumo_bulk(total, inicio):
+    segundos = time.perf_counter() - inicio
+    resumo = {
+        'linhas': total,
+        'segundos': round(segundos, 3),
+        'linhas_por_segundo': round(total / segundos, 1) if segundos > 0 else float(total),
+    }
+    logger.info("Bulk insert: %s linhas em %ss (%s linhas/s)",
+                resumo['linhas'], resumo['segundos'], resumo['linhas_por_segundo'])
+    return resumo
 
 
 def getId(sql):
-    cursor = conexao()
-    row = cursor.execute(sql)
-    id = 0
-    for i in row:
-        if i.id != None:
-            id = i.id
-
-    cursor.close()
+    with conexao_pool() as conn, metricas_sql.medir(sql, origem='cf'):
+        cursor = conn.cursor()
+        row = cursor.execute(sql)
+        id = 0
+        for i in row:
+            if i.id != None:
+                id = i.id
+        cursor.close()
     return id
 
 
-def getAll(sql):
-    cursor = conexao()
-    row = cursor.execute(sql)
-    List = []
-    for i in row:
-        List.append(i)
-    cursor.close()
+def getAll(sql, params=None):
+    with conexao_pool() as conn, metricas_sql.medir(sql, params, 'cf') as m:
+        cursor = conn.cursor()
+        row = _executar(cursor, sql, params)
+        List = []
+        for i in row:
+            List.append(i)
+        cursor.close()
+        m.contar(List)
     return List
 
+
+
+def _executar(cursor, sql, params=None):
+    if params:
+        return cursor.execute(sql, params)
+    return cursor.execute(sql)
+
+
+def _arraysize_padrao():
+    return int(os.getenv("DB_FETCH_ARRAYSIZE", "5000"))
+
+
+@contextmanager
+def consulta_em_blocos(sql, params=None, arraysize=None):
+    """
+    Executa o select e devolve as colunas e um gerador de blocos (listas de
+    Rows, via fetchmany), sem carregar o resultado inteiro na memória:
+
+        with cf.consulta_em_blocos(sql, params) as (colunas, blocos):
+            for rows in blocos:
+                ...
+
+    A conexão só sai do pool ao entrar no with e volta ao sair dele (mesmo
+    que os blocos não tenham sido lidos até o fim).
+    """
+    arraysize = arraysize or _arraysize_padrao()
+    # a medida vai até o fim do with (inclui o tempo de leitura em lotes)
+    with conexao_pool() as conn, metricas_sql.medir(sql, params, 'cf:blocos') as medida:
+        cursor = conn.cursor()
+        try:
+            cursor.arraysize = arraysize
+            _executar(cursor, sql, params)
+            # pula resultados sem colunas (ex.: "set dateformat dmy" antes do select)
+            while cursor.description is None and cursor.nextset():
+                pass
+            colunas = [c[0] for c in cursor.description] if cursor.description else []
+
+            def blocos():
+                while colunas:
+                    rows = cursor.fetchmany(arraysize)
+                    if not rows:
+                        break
+                    medida.contar(rows)
+                    yield rows
+
+            yield colunas, blocos()
+        finally:
+            cursor.close()
+
+
+def iter_rows(sql, params=None, arraysize=None):
+    """Gerador linha a linha, buscando do banco em lotes de `arraysize`."""
+    with consulta_em_blocos(sql, params, arraysize) as (colunas, blocos):
+        for rows in blocos:
+            for row in rows:
+                yield row
+
+
+def iter_dataframes(sql, params=None, arraysize=None):
+    """Versão colunar: um DataFrame por bloco, para agregar sem segurar todas as linhas."""
+    with consulta_em_blocos(sql, params, arraysize) as (colunas, blocos):
+        for rows in blocos:
+            yield pd.DataFrame.from_records([tuple(r) for r in rows], columns=colunas, coerce_float=False)
+
+
+def get_dataframe(sql, params=None, arraysize=None):
+    """Monta um único DataFrame, bloco a bloco (sem a lista intermediária de Rows)."""
+    with consulta_em_blocos(sql, params, arraysize) as (colunas, blocos):
+        partes = [
+            pd.DataFrame.from_records([tuple(r) for r in rows], columns=colunas, coerce_float=False)
+            for rows in blocos
+        ]
+    if not partes:
+        return pd.DataFrame(columns=colunas)
+    if len(partes) == 1:
+        return partes[0]
+    return pd.concat(partes, ignore_index=True)
@@ -0,0 +1,89 @@
+"""
+Variantes pré-processadas da logo (staticfiles/img/logo.png), montadas uma vez
+por processo e servidas da memória.
+
+- logo_pdf(): JPEG RGB (sem transparência, fundo branco) para o xhtml2pdf, como
+  data URI e como arquivo temporário (gravado uma vez, não a cada PDF)
+- logo_qr(tamanho): RGBA quadrada já sobre fundo branco, para colar no centro do QR Code
+
+As funções usam o mtime do arquivo na chave do cache: trocar a logo (ou rodar o
+collectstatic com uma nova) gera as variantes de novo sem reiniciar o processo.
+"""
+import base64
+import os
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from PIL import Image
+
+
+LOGO = 'img/logo.png'
+
+
+def _caminho():
+    try:
+        return staticfiles_storage.path(LOGO)
+    except Exception:
+        return os.path.join('staticfiles', LOGO)
+
+
+def _versao(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=2)
+def _rgba(path, versao):
+    with Image.open(path) as im:
+        return im.convert('RGBA')
+
+
+@lru_cache(maxsize=2)
+def _pdf(path, versao):
+    im = _rgba(path, versao)
+    # Converter logo para RGB (sem transparência) para evitar máscara escura no PDF
+    rgb = Image.new('RGB', im.size, (255, 255, 255))
+    rgb.paste(im, mask=im.split()[-1])
+    buf = BytesIO()
+    rgb.save(buf, format='JPEG', quality=95)
+    jpeg = buf.getvalue()
+    tmp = tempfile.NamedTemporaryFile(delete=False, prefix='logo_pdf_', suffix='.jpg')
+    with tmp:
+        tmp.write(jpeg)
+    return {
+        'data_uri': 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii'),
+        'path': tmp.name,
+        'file_uri': Path(tmp.name).as_uri(),
+    }
+
+
+@lru_cache(maxsize=16)
+def _qr(path, versao, tamanho):
+    logo = _rgba(path, versao).resize((tamanho, tamanho), Image.LANCZOS)
+    # fundo branco quadrado e a logo por cima (mesma composição que o QR fazia a cada requisição)
+    fundo = Image.new('RGBA', (tamanho, tamanho), (255, 255, 255, 255))
+    fundo.paste(logo, (0, 0), logo)
+    return fundo
+
+
+def logo_pdf():
+    """{'data_uri', 'path', 'file_uri'} da logo em JPEG, ou None se a logo não existir."""
+    path = _caminho()
+    versao = _versao(path)
+    if versao is None:
+        return None
+    return _pdf(path, versao)
+
+
+def logo_qr(tamanho):
+    """Logo RGBA tamanho x tamanho sobre fundo branco (não alterar a imagem retornada)."""
+    path = _caminho()
+    versao = _versao(path)
+    if versao is None:
+        raise FileNotFoundError(path)
+    return _qr(path, versao, int(tamanho))
@@ -0,0 +1,218 @@
+"""
+Métricas de SQL bruto por comando (opt-in: SQL_METRICAS=True).
+
+Cobre os dois caminhos que não passam pelo ORM:
+- connectionFactory (cf.getAll, cf.query, cf.insertBulk, consulta_em_blocos...): medidos
+  com medir(), que também conta as linhas lidas e estima os bytes
+- connection.cursor() do Django (movimentos, carta frete, EXEC sp_* das telas de
+  atualização/processamento; o ORM também passa por aí): um execute_wrapper em
+  toda conexão nova (sinal connection_created, ligado em app.apps). Aqui não dá
+  para ver o fetch, então linhas = rowcount quando o driver informa
+
+Nos inserts em lote (insertBulk/insertBulkTVP) linhas e bytes são os enviados.
+
+Cada execução é agrupada pelo SQL "modelo" (literais e listas IN trocados por
+marcadores) e guarda duração, linhas, bytes e um hash dos parâmetros. O resumo()
+devolve contagem e p50/p95 por modelo (endpoint JSON em app:sql_metricas).
+
+Os dados ficam na memória do processo (uma janela das últimas
+SQL_METRICAS_AMOSTRAS execuções por modelo); com vários workers cada um tem a sua.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+
+AMOSTRAS = int(os.getenv('SQL_METRICAS_AMOSTRAS', '500'))
+MAX_MODELOS = int(os.getenv('SQL_METRICAS_MODELOS', '300'))
+
+_LITERAL = re.compile(r"N?'(?:[^']|'')*'")
+_NUMERO = re.compile(r'(?<![\w@.])-?\d+(?:\.\d+)?\b')
+_LISTA_IN = re.compile(r'IN \((?:%s|\?)(?:, ?(?:%s|\?))*\)', re.IGNORECASE)
+_ESPACOS = re.compile(r'\s+')
+
+_lock = threading.Lock()
+_modelos = OrderedDict()  # modelo -> {'origem', 'total', 'erros', 'amostras': deque}
+
+
+def ativo():
+    return getattr(settings, 'SQL_METRICAS', False)
+
+
+def modelo_sql(sql):
+    """SQL normalizado: execuções iguais com valores diferentes caem no mesmo modelo."""
+    sql = _ESPACOS.sub(' ', str(sql)).strip()
+    sql = _NUMERO.sub('?', _LITERAL.sub('?', sql))
+    return _LISTA_IN.sub('IN (...)', sql)
+
+
+def _hash_params(params):
+    if not params:
+        return ''
+    return hashlib.sha1(repr(params).encode('utf-8', 'replace')).hexdigest()[:12]
+
+
+def _tamanho(rows):
+    """Estimativa barata dos bytes lidos (texto/binário pelo tamanho, o resto 8 bytes)."""
+    total = 0
+    for r in rows:
+        for v in r:
+            if isinstance(v, (str, bytes, bytearray)):
+                total += len(v)
+            elif v is not None:
+                total += 8
+    return total
+
+
+def registrar(sql, params, duracao_ms, linhas=None, bytes_lidos=None, origem='', erro=False):
+    modelo = modelo_sql(sql)
+    amostra = (duracao_ms, linhas, bytes_lidos, _hash_params(params))
+    with _lock:
+        item = _modelos.get(modelo)
+        if item is None:
+            if len(_modelos) >= MAX_MODELOS:
+                _modelos.popitem(last=False)  # descarta o modelo usado há mais tempo
+            item = {'origem': origem, 'total': 0, 'erros': 0, 'amostras': deque(maxlen=AMOSTRAS)}
+            _modelos[modelo] = item
+        else:
+            _modelos.move_to_end(modelo)
+        item['total'] += 1
+        item['erros'] += int(erro)
+        item['amostras'].append(amostra)
+
+
+class Medida:
+    """
+    Uma execução em andamento:
+
+        with metricas_sql.medir(sql, params, 'cf') as m:
+            rows = cursor.execute(sql, params).fetchall()
+            m.contar(rows)
+
+    Para leitura em blocos, chamar contar() a cada bloco e concluir() no fim.
+    """
+
+    def __init__(self, sql, params, origem):
+        self.sql = sql
+        self.params = params
+        self.origem = origem
+        self.linhas = None
+        self.bytes = None
+        self._inicio = time.perf_counter()
+        self._feita = False
+
+    def contar(self, rows):
+        self.linhas = (self.linhas or 0) + len(rows)
+        self.bytes = (self.bytes or 0) + _tamanho(rows)
+
+    def concluir(self, erro=False):
+        if self._feita:
+            return
+        self._feita = True
+        duracao = (time.perf_counter() - self._inicio) * 1000
+        registrar(self.sql, self.params, duracao, self.linhas, self.bytes, self.origem, erro)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, *exc):
+        self.concluir(erro=tipo is not None)
+        return False
+
+
+class _SemMedida:
+    def contar(self, rows):
+        pass
+
+    def concluir(self, erro=False):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_SEM_MEDIDA = _SemMedida()
+
+
+def medir(sql, params=None, origem=''):
+    return Medida(sql, params, origem) if ativo() else _SEM_MEDIDA
+
+
+def _wrapper_django(execute, sql, params, many, context):
+    inicio = time.perf_counter()
+    erro = True
+    try:
+        resultado = execute(sql, params, many, context)
+        erro = False
+        return resultado
+    finally:
+        linhas = None
+        try:
+            rowcount = context['cursor'].rowcount
+            linhas = rowcount if rowcount >= 0 else None
+        except Exception:
+            pass
+        registrar(
+            sql, params, (time.perf_counter() - inicio) * 1000,
+            linhas=linhas, origem=f"django:{context['connection'].alias}", erro=erro,
+        )
+
+
+def instalar(sender=None, connection=None, **kwargs):
+    """Receptor de connection_created: mede todo execute da conexão nova."""
+    if ativo() and _wrapper_django not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_wrapper_django)
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+ORDENS = ('p95_ms', 'p50_ms', 'max_ms', 'soma_ms', 'total')
+
+
+def resumo(ordem='p95_ms', limite=None):
+    """Lista por modelo: total, erros, p50/p95/máx (ms), média de linhas e bytes, parâmetros distintos."""
+    with _lock:
+        itens = [(m, dict(d, amostras=list(d['amostras']))) for m, d in _modelos.items()]
+    saida = []
+    for modelo, d in itens:
+        amostras = d['amostras']
+        duracoes = sorted(a[0] for a in amostras)
+        linhas = [a[1] for a in amostras if a[1] is not None]
+        bytes_lidos = [a[2] for a in amostras if a[2] is not None]
+        saida.append({
+            'sql': modelo,
+            'origem': d['origem'],
+            'total': d['total'],
+            'erros': d['erros'],
+            'amostras': len(amostras),
+            'p50_ms': round(_percentil(duracoes, 50) or 0, 2),
+            'p95_ms': round(_percentil(duracoes, 95) or 0, 2),
+            'max_ms': round(duracoes[-1], 2) if duracoes else 0,
+            'soma_ms': round(sum(duracoes), 1),
+            'linhas_media': round(sum(linhas) / len(linhas), 1) if linhas else None,
+            'bytes_media': round(sum(bytes_lidos) / len(bytes_lidos)) if bytes_lidos else None,
+            'parametros_distintos': len({a[3] for a in amostras}),
+        })
+    if ordem in ORDENS:
+        saida.sort(key=lambda x: x[ordem], reverse=True)
+    return saida[:limite] if limite else saida
+
+
+def limpar():
+    with _lock:
+        _modelos.clear()
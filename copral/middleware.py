@@ -0,0 +1,112 @@
+"""
+Contagem de consultas ao banco por requisição (opt-in: CONSULTAS_PROFILING=True).
+
+Conta tudo que passa pelo cursor do Django (ORM e connection.cursor()), soma o
+tempo gasto no banco e agrupa as consultas pelo SQL "modelo" (literais e listas
+IN viram marcadores, ver metricas_sql.modelo_sql), para apontar N+1: o mesmo
+SQL repetido CONSULTAS_REPETIDAS vezes ou mais.
+
+Cada resposta recebe o cabeçalho Server-Timing (db / app) e uma linha de log
+JSON no logger 'copral.consultas'. Orçamentos por view ficam em
+settings.CONSULTAS_ORCAMENTO ({'app:nome_da_url': max_consultas}); estourar o
+orçamento gera warning no log ou, com CONSULTAS_ORCAMENTO_ESTRITO=True (testes),
+levanta OrcamentoConsultasExcedido.
+"""
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metricas_sql import modelo_sql
+
+
+logger = logging.getLogger('copral.consultas')
+
+
+class OrcamentoConsultasExcedido(AssertionError):
+    pass
+
+
+class Medicao:
+    """
+    Context manager que mede as consultas de todos os bancos configurados:
+        with Medicao() as m:
+            ...
+        m.total, m.tempo_ms, m.repetidas()
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.tempo_ms = 0.0
+        self.por_modelo = Counter()
+        self._pilha = None
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo_ms += (time.perf_counter() - inicio) * 1000
+            self.total += 1
+            self.por_modelo[modelo_sql(sql)] += 1
+
+    def __enter__(self):
+        self._pilha = ExitStack()
+        for conn in connections.all():
+            self._pilha.enter_context(conn.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc):
+        self._pilha.close()
+        return False
+
+    def repetidas(self, minimo=None):
+        minimo = minimo or getattr(settings, 'CONSULTAS_REPETIDAS', 5)
+        return [(sql, n) for sql, n in self.por_modelo.most_common() if n >= minimo]
+
+
+class ConsultasMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'CONSULTAS_PROFILING', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        inicio = time.perf_counter()
+        with Medicao() as m:
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - inicio) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else ''
+        repetidas = m.repetidas()
+        response['Server-Timing'] = (
+            f'db;dur={m.tempo_ms:.1f};desc="{m.total} consultas", '
+            f'app;dur={max(total_ms - m.tempo_ms, 0):.1f}'
+        )
+        registro = {
+            'view': view,
+            'path': request.path,
+            'metodo': request.method,
+            'status': response.status_code,
+            'consultas': m.total,
+            'db_ms': round(m.tempo_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'repetidas': [{'sql': sql[:300], 'n': n} for sql, n in repetidas[:5]],
+        }
+        logger.info(json.dumps(registro, ensure_ascii=False))
+
+        orcamento = getattr(settings, 'CONSULTAS_ORCAMENTO', {}).get(view)
+        if orcamento is not None and m.total > orcamento:
+            msg = f'{view}: {m.total} consultas (orçamento {orcamento})'
+            if repetidas:
+                msg += f'; mais repetida ({repetidas[0][1]}x): {repetidas[0][0][:200]}'
+            if getattr(settings, 'CONSULTAS_ORCAMENTO_ESTRITO', False):
+                raise OrcamentoConsultasExcedido(msg)
+            logger.warning(msg)
+        return response
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'copral.middleware.ConsultasMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -108,6 +109,18 @@ DATABASES = {
     }
 }
 
+# Cache do Django (mapa de colunas das views em operacional/colunas.py). O padrão
+# LocMemCache é por processo: com vários workers o invalidar() do AtualizarDadosView
+# só limpa o worker que atendeu a requisição e os demais esperam o COLUNAS_CACHE_TTL.
+# Para um cache compartilhado, ex.: CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# com CACHE_LOCATION=<pasta>, ou ...db.DatabaseCache com CACHE_LOCATION=<tabela> (manage.py createcachetable)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -156,6 +169,46 @@ STATIC_ROOT = str(BASE_DIR / 'staticfiles')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Diagnóstico do controle de jornada (consulta de validação e logs detalhados)
+JORNADA_PROFILING = os.getenv('JORNADA_PROFILING', 'False').lower() == 'true'
+
+# Contagem de consultas por requisição (copral/middleware.py): Server-Timing, log
+# JSON em 'copral.consultas' e aviso de N+1 (mesmo SQL repetido CONSULTAS_REPETIDAS vezes)
+CONSULTAS_PROFILING = os.getenv('CONSULTAS_PROFILING', 'False').lower() == 'true'
+CONSULTAS_REPETIDAS = int(os.getenv('CONSULTAS_REPETIDAS', '5'))
+# Máximo de consultas por view (nome da URL); nos testes, CONSULTAS_ORCAMENTO_ESTRITO=True faz falhar
+CONSULTAS_ORCAMENTO = {
+    'operacional:gestao_fechamento': 15,
+    'operacional:contas_a_receber': 10,
+    'operacional:carta_frete_page': 8,
+    'operacional:carta_frete_api': 8,
+    'operacional:prestacao_contas_pdf': 6,
+    'operacional:prestacao_contas_pdf_status': 6,
+}
+CONSULTAS_ORCAMENTO_ESTRITO = os.getenv('CONSULTAS_ORCAMENTO_ESTRITO', 'False').lower() == 'true'
+
+# Linha JSON por requisição do ConsultasMiddleware (INFO) e avisos de orçamento (WARNING)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'consultas': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'consultas': {'class': 'logging.StreamHandler', 'formatter': 'consultas'},
+    },
+    'loggers': {
+        'copral.consultas': {
+            'handlers': ['consultas'],
+            'level': os.getenv('CONSULTAS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Tempo por comando de SQL bruto (connectionFactory e connection.cursor), p50/p95 em /sql/metricas/
+SQL_METRICAS = os.getenv('SQL_METRICAS', 'False').lower() == 'true'
+
 LOGIN_REDIRECT_URL = '/home/'
 LOGOUT_REDIRECT_URL = '/accounts/login'
 
@@ -90,7 +90,9 @@ def insertDados(xml):
            (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
           """
     
-    cf.insertLote(sql, listdata)
+    resumo = cf.insertBulk(sql, listdata)
+    if resumo is False:
+        print('Falha ao gravar os registros')
     print(f'Total de registros importados: {len(listdata)}')
     print('Importaçao Finalizada...')
     print(100*'*')
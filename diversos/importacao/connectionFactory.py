@@ -1,10 +1,14 @@
+import logging
 import pyodbc
 import pandas as pd
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 def conexao():
     try:
@@ -98,23 +102,49 @@ def delete(sql, *args):
         return False
 
 def insertLote(sql, args):
+    return insertBulk(sql, args) is not False
+
+
+def insertBulk(sql, linhas, chunk_size=None, commit_por_bloco=False):
+    """
+    Insere em blocos com fast_executemany. Por padrão um único commit no fim
+    (como o insertLote antigo: tudo ou nada); commit_por_bloco=True confirma
+    cada bloco ao terminar.
+    Retorna um dict com linhas, segundos e linhas_por_segundo (False em caso de erro).
+    """
+    chunk_size = chunk_size or int(os.getenv("DB_BULK_CHUNK_SIZE", "1000"))
     conn = conexao()
     if conn is None:
         print("Erro: Não foi possível conectar ao banco de dados")
         return False
+    inicio = time.perf_counter()
+    total = 0
     try:
         cursor = conn.cursor()
-        lista = args
-        for i in lista:
-            cursor.execute(sql, i)
+        cursor.fast_executemany = True
+        linhas = list(linhas)
+        for i in range(0, len(linhas), chunk_size):
+            bloco = linhas[i:i + chunk_size]
+            cursor.executemany(sql, bloco)
+            if commit_por_bloco:
+                conn.commit()
+            total += len(bloco)
         conn.commit()
         cursor.close()
         conn.close()
-        return True
     except Exception as e:
-        print(f"Erro ao executar insertLote: {e}")
+        gravadas = total if commit_por_bloco else 0
+        print(f"Erro ao executar insertBulk (linhas gravadas: {gravadas}): {e}")
         conn.close()
         return False
+    segundos = time.perf_counter() - inicio
+    resumo = {
+        'linhas': total,
+        'segundos': round(segundos, 3),
+        'linhas_por_segundo': round(total / segundos, 1) if segundos > 0 else float(total),
+    }
+    logger.info("Bulk insert: %s linhas em %ss (%s linhas/s)", total, resumo['segundos'], resumo['linhas_por_segundo'])
+    return resumo
 
 
 def getId(sql):
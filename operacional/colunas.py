@@ -0,0 +1,129 @@
+"""
+Cache do mapeamento de colunas das views de banco (VW_MOVIMENTACOES, VW_CARTA_FRETE).
+
+As views podem ter nomes de colunas variados; antes cada requisição fazia um
+SELECT TOP 1 * só para ler o cursor.description e rodava o find_col/pick_col.
+Aqui as colunas são lidas do INFORMATION_SCHEMA.COLUMNS uma vez, o mapa
+lógico -> físico é resolvido e guardado no cache do Django por um TTL
+(COLUNAS_CACHE_TTL). O AtualizarDadosView chama invalidar() após atualizar.
+
+invalidar() só alcança os outros processos se o cache for compartilhado
+(CACHE_BACKEND em settings); com o LocMemCache padrão cada worker tem a sua
+cópia, e o TTL curto limita quanto tempo um worker usa um mapa antigo.
+"""
+import os
+
+from django.core.cache import cache
+from django.db import connection
+
+
+VW_MOVIMENTACOES = 'VW_MOVIMENTACOES'
+VW_CARTA_FRETE = 'VW_CARTA_FRETE'
+
+CACHE_TTL = int(os.getenv('COLUNAS_CACHE_TTL', '60'))
+_PREFIXO = 'operacional:colunas:'
+
+# nome lógico -> (nomes exatos aceitos, trechos aceitos quando não houver nome exato)
+MAPA_MOVIMENTACOES = {
+    'code_col': (['cdservico', 'cd_servico', 'codigo', 'codigo_servico', 'cdserv', 'idservico'], ['servico']),
+    'name_col': (['nmservico', 'nm_servico', 'nome_servico', 'servico', 'descricao', 'descricao_servico'], ['serv']),
+    'type_col': (['nmtiposervico', 'nm_tipo_servico', 'tipo_servico', 'tipo', 'categoria', 'nmtipo'], ['tipo']),
+    'value_col': (['valor', 'vl_servico', 'vlr', 'vl', 'preco', 'preco_servico'], ['valor']),
+    'plate_col': (['placa', 'nrplaca', 'nr_placa', 'placa_principal', 'placa1'], ['placa']),
+    'agregado_col': (['agregado', 'nmagregado', 'nm_agregado', 'agregado_nome', 'nome_agregado'], ['agreg']),
+    'date_col': (['data', 'dtmov', 'dt_mov', 'dtservico', 'dt_servico', 'dtmovimento', 'data_mov', 'dt_emissao', 'dtemissao'], ['data']),
+    'os_col': (['cdorderservico', 'orderservico', 'ordemservico', 'cdordemservico', 'cd_os', 'os'], ['servico']),
+    'qty_col': (['qtde', 'quantidade', 'qtd'], ['qt']),
+    'total_col': (['total', 'vl_total', 'vltotal'], ['total']),
+    'item_code_col': (['cditem', 'cd_item', 'codigo_item'], ['item']),
+    'item_name_col': (['nmitem', 'nm_item', 'nome_item', 'descricao_item'], ['item']),
+    'status_col': (['status', 'st'], ['status']),
+    'unit_col': (['unidade', 'unid', 'und', 'un'], []),
+}
+
+
+def _pick(nomes):
+    # mesma regra do antigo pick_col: nome exato e depois "contém"
+    return (nomes, nomes)
+
+
+MAPA_CARTA_FRETE = {
+    'valor': _pick(['valor', 'vl', 'vl_total']),
+    'adiantamento': _pick(['adiantamento', 'adiant', 'vl_adiantamento']),
+    'outros': _pick(['outros', 'vl_outros']),
+    'saldo': _pick(['saldo', 'vl_saldo']),
+    'placa': _pick(['placa', 'nrplaca', 'placa_principal']),
+    'situacao': _pick(['situacao', 'situação']),
+    'codigo': _pick(['codigo', 'cd', 'cod']),
+    'empresa': _pick(['empresa']),
+    'data': _pick(['data', 'dt']),
+    'status': _pick(['status']),
+    'trecho': _pick(['trecho']),
+    'act': _pick(['act', 'descricao', 'observacao']),
+}
+
+MAPAS = {
+    VW_MOVIMENTACOES: MAPA_MOVIMENTACOES,
+    VW_CARTA_FRETE: MAPA_CARTA_FRETE,
+}
+
+
+def casar_coluna(colunas, exatos, contem=None):
+    """Retorna o nome real da coluna para a lista de candidatos (ou None)."""
+    lower_map = {c.lower(): c for c in colunas}
+    for nome in exatos:
+        if nome in lower_map:
+            return lower_map[nome]
+    for c in colunas:
+        cl = c.lower()
+        for nome in (contem or []):
+            if nome in cl:
+                return c
+    return None
+
+
+def _ler_colunas(view):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+            [view],
+        )
+        colunas = [r[0] for r in cursor.fetchall()]
+        if not colunas:
+            # sem permissão no INFORMATION_SCHEMA: lê só a estrutura, sem trazer linhas
+            cursor.execute(f"SELECT * FROM {view} WHERE 1 = 0")
+            colunas = [c[0] for c in cursor.description]
+    return colunas
+
+
+def _entrada(view):
+    chave = _PREFIXO + view
+    entrada = cache.get(chave)
+    if entrada is None:
+        colunas = _ler_colunas(view)
+        mapa = MAPAS.get(view, {})
+        entrada = {
+            'colunas': colunas,
+            'mapa': {
+                logico: casar_coluna(colunas, exatos, contem)
+                for logico, (exatos, contem) in mapa.items()
+            },
+        }
+        cache.set(chave, entrada, CACHE_TTL)
+    return entrada
+
+
+def colunas_view(view):
+    """Lista das colunas físicas da view, na ordem do banco."""
+    return list(_entrada(view)['colunas'])
+
+
+def mapa_colunas(view):
+    """Dict nome lógico -> nome físico (None quando a view não tem a coluna)."""
+    return dict(_entrada(view)['mapa'])
+
+
+def invalidar(view=None):
+    """Descarta o cache de uma view (ou de todas)."""
+    views = [view] if view else list(MAPAS.keys())
+    cache.delete_many([_PREFIXO + v for v in views])
@@ -0,0 +1,158 @@
+"""
+Totais consolidados do fechamento por placa (Contas a Receber, Contas a Pagar e Lançamentos).
+
+Antes a gestão de fechamento montava três dicts em Python (um por origem, cada
+um com fallbacks) e juntava tudo no fim. Aqui uma única consulta junta as
+origens com UNION ALL e agrega por placa/agregado com SUM(CASE ...):
+
+- base='vencimento' (grade da gestão de fechamento): vencimentos com
+  data_vencimento no dia; se a placa não tiver vencimento (ou somar 0), vale
+  a soma dos cabeçalhos com data_fechamento no dia
+- base='fechamento' (detalhes / prestação de contas): vencimentos dos
+  cabeçalhos com data_fechamento no dia
+- lançamentos do dia: Receita soma, Despesa subtrai
+
+total_final = Contas a Pagar - Contas a Receber + Lançamentos
+"""
+from datetime import timedelta
+
+from django.db import connection
+
+from .models import (
+    Agregado, Veiculo, ContasReceber, VencContasReceber, ContasPagar, VencContasPagar, Lancamento,
+)
+
+
+NATUREZAS_RECEITA = ('R', 'RECEITA', 'CREDITO', 'CREDIT')
+
+
+def valor_lancamento(natureza, valor):
+    """Valor do lançamento com o sinal da consolidação: Receita soma, o resto subtrai."""
+    valor = float(valor or 0.0)
+    return valor if (natureza or '').strip().upper() in NATUREZAS_RECEITA else -valor
+
+
+def _tabela(modelo):
+    return connection.ops.quote_name(modelo._meta.db_table)
+
+
+def _coluna(modelo, campo):
+    return connection.ops.quote_name(modelo._meta.get_field(campo).column)
+
+
+def _filtro_veiculos(coluna, veic_ids, params):
+    if veic_ids is None:
+        return ''
+    ids = [int(v) for v in veic_ids]
+    if not ids:
+        return ' AND 1 = 0'
+    params.extend(ids)
+    return f" AND {coluna} IN ({', '.join(['%s'] * len(ids))})"
+
+
+def _origens(dia, veic_ids, base):
+    """Partes do UNION ALL: (id_veiculo, fonte, valor)."""
+    partes = []
+    params = []
+    proximo_dia = dia + timedelta(days=1)
+
+    for fonte, cab, venc, fk in (
+        ('R', ContasReceber, VencContasReceber, 'contas_receber'),
+        ('P', ContasPagar, VencContasPagar, 'contas_pagar'),
+    ):
+        c_veic = 'c.' + _coluna(cab, 'placa')
+        join = f"FROM {_tabela(venc)} v JOIN {_tabela(cab)} c ON c.{_coluna(cab, 'id')} = v.{_coluna(venc, fk)}"
+        if base == 'fechamento':
+            params.append(dia)
+            where = f"c.{_coluna(cab, 'data_fechamento')} = %s"
+        else:
+            params.extend([dia, proximo_dia])
+            where = f"v.{_coluna(venc, 'data_vencimento')} >= %s AND v.{_coluna(venc, 'data_vencimento')} < %s"
+        where += _filtro_veiculos(c_veic, veic_ids, params)
+        partes.append(f"SELECT {c_veic} AS id_veiculo, '{fonte}V' AS fonte, v.{_coluna(venc, 'valor')} AS valor {join} WHERE {where}")
+
+        if base != 'fechamento':
+            # cabeçalhos do dia: usados só quando a placa não tem vencimento no dia
+            params.append(dia)
+            where = f"c.{_coluna(cab, 'data_fechamento')} = %s" + _filtro_veiculos(c_veic, veic_ids, params)
+            partes.append(
+                f"SELECT {c_veic} AS id_veiculo, '{fonte}C' AS fonte, c.{_coluna(cab, 'valor')} AS valor "
+                f"FROM {_tabela(cab)} c WHERE {where}"
+            )
+
+    l_veic = 'l.' + _coluna(Lancamento, 'veiculo')
+    receitas = ', '.join(f"'{n}'" for n in NATUREZAS_RECEITA)
+    natureza = f"UPPER(LTRIM(RTRIM(l.{_coluna(Lancamento, 'natureza')})))"
+    params.append(dia)
+    where = f"l.{_coluna(Lancamento, 'data')} = %s" + _filtro_veiculos(l_veic, veic_ids, params)
+    partes.append(
+        f"SELECT {l_veic} AS id_veiculo, 'LN' AS fonte, "
+        f"CASE WHEN {natureza} IN ({receitas}) THEN l.{_coluna(Lancamento, 'valor')} "
+        f"ELSE -l.{_coluna(Lancamento, 'valor')} END AS valor "
+        f"FROM {_tabela(Lancamento)} l WHERE {where}"
+    )
+    return ' UNION ALL '.join(partes), params
+
+
+def consulta_totais(dia, veic_ids=None, base='vencimento'):
+    """SQL (placeholders %s do cursor do Django) e parâmetros da consolidação."""
+    origens, params = _origens(dia, veic_ids, base)
+    a_placa = 'a.' + _coluna(Agregado, 'placa')
+    a_nome = 'a.' + _coluna(Agregado, 'nm_agregado')
+
+    def soma(fonte):
+        return f"SUM(CASE WHEN u.fonte = '{fonte}' THEN u.valor ELSE 0 END)"
+
+    sql = (
+        f"SELECT {a_placa} AS placa, {a_nome} AS agregado, "
+        f"{soma('RV')} AS receber_venc, {soma('RC')} AS receber_cab, "
+        f"{soma('PV')} AS pagar_venc, {soma('PC')} AS pagar_cab, "
+        f"{soma('LN')} AS lancamentos "
+        f"FROM ({origens}) u "
+        f"JOIN {_tabela(Veiculo)} ve ON ve.{_coluna(Veiculo, 'id_veiculo')} = u.id_veiculo "
+        f"JOIN {_tabela(Agregado)} a ON {a_placa} = ve.{_coluna(Veiculo, 'placa')} "
+        f"GROUP BY {a_placa}, {a_nome} "
+        f"ORDER BY {a_placa}"
+    )
+    return sql, params
+
+
+def totais_fechamento(dia, veic_ids=None, base='vencimento'):
+    """
+    Lista de dicts por placa: placa, agregado, total_receber, total_pagar,
+    lancamentos e total_final. `veic_ids` (lista de id_veiculo) restringe as
+    placas; None = todas.
+    """
+    sql, params = consulta_totais(dia, veic_ids, base)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    resultado = []
+    for placa, agregado, rv, rc, pv, pc, ln in rows:
+        rv, rc, pv, pc, ln = (float(x or 0.0) for x in (rv, rc, pv, pc, ln))
+        # regra da grade: cabeçalho só quando não há vencimento para a placa (evita dupla contagem)
+        total_receber = rv if rv != 0.0 else rc
+        total_pagar = pv if pv != 0.0 else pc
+        resultado.append({
+            'placa': placa,
+            'agregado': agregado or '',
+            'total_receber': total_receber,
+            'total_pagar': total_pagar,
+            'lancamentos': ln,
+            'total_final': total_pagar - total_receber + ln,
+        })
+    return resultado
+
+
+def totais_por_placa(dia, veic_ids=None, base='vencimento'):
+    """Mesmo resultado de totais_fechamento, indexado pela placa (maiúscula, sem espaços)."""
+    return {
+        (r['placa'] or '').strip().upper(): r
+        for r in totais_fechamento(dia, veic_ids, base)
+    }
+
+
+def resumo_totais(linhas):
+    """Soma as linhas de totais_fechamento em um único dict (mesmas chaves de valor)."""
+    chaves = ('total_receber', 'total_pagar', 'lancamentos', 'total_final')
+    return {k: sum(float(r.get(k) or 0.0) for r in linhas) for k in chaves}
@@ -0,0 +1,147 @@
+"""
+Fila de PDFs em segundo plano (tabela ope_tarefa_pdf), sem broker externo.
+
+- enfileirar(): a requisição só grava a tarefa e devolve o id (uma tarefa igual
+  ainda pendente/em andamento é reaproveitada)
+- o worker `python manage.py processar_tarefas_pdf` pega as pendentes, gera o PDF
+  (prestacao.gerar_pdf) e grava o arquivo em PDF_TAREFAS_DIR
+- as views consultam o status e entregam o arquivo direto do disco
+
+A tarefa é "reservada" com um UPDATE condicional (status pendente -> processando),
+então mais de um worker pode rodar ao mesmo tempo sem gerar o mesmo PDF duas vezes.
+"""
+import hashlib
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import TarefaPdf
+from .prestacao import gerar_pdf, limpar_fragmentos
+
+
+PDF_DIR = os.getenv('PDF_TAREFAS_DIR', str(Path(settings.BASE_DIR) / 'media' / 'pdfs'))
+MAX_TENTATIVAS = int(os.getenv('PDF_TAREFAS_TENTATIVAS', '3'))
+# tarefa em 'processando' há mais que isso (segundos) é de um worker que caiu: volta para a fila
+TEMPO_TRAVADA = int(os.getenv('PDF_TAREFAS_TIMEOUT', '900'))
+# arquivos e tarefas concluídas mais antigos que isso (dias) são removidos pelo worker
+DIAS_RETENCAO = int(os.getenv('PDF_TAREFAS_DIAS', '7'))
+
+TIPO_PRESTACAO = 'prestacao_contas'
+
+
+def _chave(tipo, parametros):
+    texto = tipo + ':' + json.dumps(parametros, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def enfileirar(data_str, placas, usuario=None):
+    """Cria (ou reaproveita) a tarefa de PDF da prestação de contas."""
+    parametros = {'data_fechamento': data_str, 'placas': list(placas)}
+    chave = _chave(TIPO_PRESTACAO, parametros)
+    existente = (
+        TarefaPdf.objects
+        .filter(chave=chave, status__in=['pendente', 'processando'])
+        .order_by('-id')
+        .first()
+    )
+    if existente:
+        return existente
+    return TarefaPdf.objects.create(
+        tipo=TIPO_PRESTACAO,
+        parametros=json.dumps(parametros, ensure_ascii=False),
+        chave=chave,
+        usuario=usuario if getattr(usuario, 'is_authenticated', False) else None,
+    )
+
+
+def caminho(tarefa):
+    """Caminho do arquivo gerado (None se ainda não houver arquivo em disco)."""
+    if tarefa.status != 'concluido' or not tarefa.arquivo:
+        return None
+    path = os.path.join(PDF_DIR, tarefa.arquivo)
+    return path if os.path.exists(path) else None
+
+
+def _reservar(tarefa_id):
+    return TarefaPdf.objects.filter(id=tarefa_id, status='pendente').update(
+        status='processando', dt_inicio=timezone.now(), erro='',
+    ) == 1
+
+
+def processar(tarefa):
+    """Gera o PDF de uma tarefa já reservada e grava o resultado."""
+    parametros = json.loads(tarefa.parametros or '{}')
+    try:
+        pdf, nome = gerar_pdf(parametros.get('data_fechamento') or '', parametros.get('placas') or [])
+        os.makedirs(PDF_DIR, exist_ok=True)
+        arquivo = f'{tarefa.id}.pdf'
+        destino = os.path.join(PDF_DIR, arquivo)
+        # grava em arquivo temporário e renomeia: download nunca vê um PDF pela metade
+        with open(destino + '.tmp', 'wb') as fh:
+            fh.write(pdf)
+        os.replace(destino + '.tmp', destino)
+        TarefaPdf.objects.filter(id=tarefa.id).update(
+            status='concluido', arquivo=arquivo, nome_arquivo=nome[:150], dt_fim=timezone.now(),
+        )
+        return True
+    except Exception as e:
+        tentativas = tarefa.tentativas + 1
+        # sem dados / biblioteca ausente não adianta repetir
+        definitivo = isinstance(e, (ValueError, RuntimeError)) or tentativas >= MAX_TENTATIVAS
+        TarefaPdf.objects.filter(id=tarefa.id).update(
+            status='erro' if definitivo else 'pendente',
+            tentativas=tentativas,
+            erro=str(e)[:2000],
+            dt_fim=timezone.now() if definitivo else None,
+        )
+        return False
+
+
+def liberar_travadas():
+    """
+    Devolve para a fila as tarefas presas em 'processando' (worker interrompido),
+    contando como tentativa: a que já esgotou MAX_TENTATIVAS (ex.: derruba o
+    worker toda vez) vai para 'erro' em vez de voltar para a fila.
+    """
+    agora = timezone.now()
+    travadas = TarefaPdf.objects.filter(status='processando', dt_inicio__lt=agora - timedelta(seconds=TEMPO_TRAVADA))
+    travadas.filter(tentativas__gte=MAX_TENTATIVAS - 1).update(
+        status='erro', tentativas=F('tentativas') + 1, dt_fim=agora,
+        erro='Processamento interrompido repetidas vezes (worker caiu ou excedeu o tempo limite).',
+    )
+    return travadas.update(status='pendente', tentativas=F('tentativas') + 1)
+
+
+def processar_pendentes(limite=None):
+    """Processa as tarefas pendentes (mais antigas primeiro). Retorna quantas foram processadas."""
+    liberar_travadas()
+    feitas = 0
+    ids = TarefaPdf.objects.filter(status='pendente').order_by('dt_criacao', 'id').values_list('id', flat=True)
+    for tarefa_id in list(ids[:limite] if limite else ids):
+        if not _reservar(tarefa_id):
+            continue  # outro worker pegou
+        processar(TarefaPdf.objects.get(id=tarefa_id))
+        feitas += 1
+    return feitas
+
+
+def limpar(dias=DIAS_RETENCAO):
+    """
+    Remove tarefas finalizadas antigas e os arquivos delas, e os fragmentos de
+    placa de dias anteriores (prestacao.limpar_fragmentos). Retorna quantas
+    tarefas foram removidas.
+    """
+    limpar_fragmentos()
+    limite = timezone.now() - timedelta(days=dias)
+    antigas = TarefaPdf.objects.filter(status__in=['concluido', 'erro'], dt_criacao__lt=limite)
+    for arquivo in antigas.exclude(arquivo='').values_list('arquivo', flat=True):
+        try:
+            os.remove(os.path.join(PDF_DIR, arquivo))
+        except OSError:
+            pass
+    return antigas.delete()[0]
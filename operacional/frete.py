@@ -0,0 +1,190 @@
+"""
+Acesso à VW_CARTA_FRETE (tela de Carta Frete, modal de itens e geração de Contas a Pagar).
+
+Antes cada tela fazia SELECT * na view, montava dict(zip(cols, r)) para todas as
+linhas e somava/agrupava em Python (a página ainda guardava uma matriz
+rows_values com os mesmos dados). Aqui:
+
+- resumo(): totais e grupos por placa calculados no banco (GROUP BY placa/situação)
+- a situação (aberto/fechado) é normalizada na própria consulta (situacao_norm) e o
+  filtro de status vira um predicado SQL sobre ela
+- iter_linhas(): linhas para o modal, como listas na ordem de `colunas`, lidas em lotes
+- selecionadas(): só as colunas usadas na geração de Contas a Pagar, para os códigos escolhidos
+
+Os nomes físicos das colunas vêm do mapa em cache de colunas.py.
+"""
+from django.db import connection
+
+from .colunas import colunas_view, mapa_colunas, VW_CARTA_FRETE
+
+
+VALORES = ('valor', 'adiantamento', 'outros', 'saldo')
+CAMPOS_ITEM = ('empresa', 'codigo', 'data', 'act', 'status', 'trecho') + VALORES
+LOTE = 1000
+
+# mesma regra que a tela aplicava linha a linha em Python
+CONTEM_FECHADO = ('FECH', 'ENCERR', 'CLOS')
+EXATOS_FECHADO = ('F', 'C', '1', 'TRUE')
+CONTEM_ABERTO = ('ABER', 'OPEN')
+EXATOS_ABERTO = ('A', 'O', '0', 'FALSE')
+
+
+def _q(nome):
+    return connection.ops.quote_name(nome)
+
+
+def chave(empresa, codigo):
+    """Chave estável de uma linha da view: 'empresa|codigo'."""
+    return f"{str(empresa or '').strip()}|{str(codigo or '').strip()}"
+
+
+def _status_sql(coluna):
+    """
+    CASE que normaliza a coluna de situação em 'FECHADO' / 'ABERTO' / ''.
+    Os padrões vão como parâmetros (evita escapar '%' no SQL). Retorna (sql, params).
+    """
+    if not coluna:
+        return "''", []
+    col = f"UPPER(LTRIM(RTRIM({_q(coluna)})))"
+
+    def regra(contem, exatos):
+        partes = [f"{col} LIKE %s"] * len(contem) + [f"{col} IN ({', '.join(['%s'] * len(exatos))})"]
+        return ' OR '.join(partes), [f'%{c}%' for c in contem] + list(exatos)
+
+    fechado, p_fechado = regra(CONTEM_FECHADO, EXATOS_FECHADO)
+    aberto, p_aberto = regra(CONTEM_ABERTO, EXATOS_ABERTO)
+    return f"CASE WHEN {fechado} THEN 'FECHADO' WHEN {aberto} THEN 'ABERTO' ELSE '' END", p_fechado + p_aberto
+
+
+def _origem(cmap, placa=None, data_inicio=None, data_fim=None, status=None):
+    """
+    FROM das consultas: a view filtrada por placa/período, com a coluna
+    situacao_norm, e o filtro de status aplicado sobre ela. Retorna (sql, params).
+    """
+    status_sql, params = _status_sql(cmap['situacao'])
+    where = []
+    if placa:
+        where.append('PLACA = %s')
+        params.append(placa)
+    if data_inicio:
+        where.append('CAST(DATA AS DATE) >= %s')
+        params.append(data_inicio)
+    if data_fim:
+        where.append('CAST(DATA AS DATE) <= %s')
+        params.append(data_fim)
+    sql = f"(SELECT v.*, {status_sql} AS situacao_norm FROM VW_CARTA_FRETE v"
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ') t'
+    if status and cmap['situacao']:
+        sql += ' WHERE t.situacao_norm = %s'
+        params.append(status.strip().upper())
+    return sql, params
+
+
+def resumo(placa=None, data_inicio=None, data_fim=None, status=None):
+    """
+    Retorna (grupos, totais):
+    - grupos: [{placa, qtd, valor, adiantamento, outros, saldo, status}] ordenado por placa
+    - totais: {valor, adiantamento, outros, saldo}
+    Uma consulta agrupada por placa e situação normalizada: o grupo é ABERTO se
+    tiver algum item aberto, senão FECHADO se tiver algum fechado.
+    """
+    cmap = mapa_colunas(VW_CARTA_FRETE)
+    origem, params = _origem(cmap, placa, data_inicio, data_fim, status)
+    col_placa = ('t.' + _q(cmap['placa'])) if cmap['placa'] else None
+    selects = [
+        (col_placa or 'NULL') + ' AS placa',
+        't.situacao_norm AS situacao',
+        'COUNT(*) AS qtd',
+    ] + [
+        (f"SUM(t.{_q(cmap[v])})" if cmap[v] else '0') + f' AS {v}'
+        for v in VALORES
+    ]
+    chaves_grupo = ([col_placa] if col_placa else []) + ['t.situacao_norm']
+    sql = f"SELECT {', '.join(selects)} FROM {origem} GROUP BY {', '.join(chaves_grupo)}"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        linhas = cursor.fetchall()
+
+    totais = {v: 0.0 for v in VALORES}
+    by_placa = {}
+    for placa_val, sit, qtd, *somas in linhas:
+        if not qtd:
+            continue
+        placa_key = str(placa_val or '').strip() if cmap['placa'] else '—'
+        g = by_placa.get(placa_key) or {'placa': placa_key, 'qtd': 0, 'valor': 0.0, 'adiantamento': 0.0, 'outros': 0.0, 'saldo': 0.0, 'has_open': False, 'has_closed': False}
+        g['qtd'] += int(qtd)
+        for v, s in zip(VALORES, somas):
+            s = float(s or 0)
+            g[v] += s
+            totais[v] += s
+        g['has_closed'] = g['has_closed'] or sit == 'FECHADO'
+        g['has_open'] = g['has_open'] or sit == 'ABERTO'
+        by_placa[placa_key] = g
+
+    grupos = []
+    for g in by_placa.values():
+        status_txt = ''
+        if g['has_open']:
+            status_txt = 'ABERTO'
+        elif g['has_closed']:
+            status_txt = 'FECHADO'
+        grupos.append({
+            'placa': g['placa'],
+            'qtd': g['qtd'],
+            'valor': g['valor'],
+            'adiantamento': g['adiantamento'],
+            'outros': g['outros'],
+            'saldo': g['saldo'],
+            'status': status_txt,
+        })
+    return sorted(grupos, key=lambda x: x['placa']), totais
+
+
+def colunas_modal():
+    """Colunas exibidas no modal de itens (todas as da view, na ordem do banco)."""
+    return colunas_view(VW_CARTA_FRETE)
+
+
+def iter_linhas(colunas, placa=None, data_inicio=None, data_fim=None, status=None):
+    """Gera as linhas (listas na ordem de `colunas`) lendo o cursor em lotes."""
+    cmap = mapa_colunas(VW_CARTA_FRETE)
+    origem, params = _origem(cmap, placa, data_inicio, data_fim, status)
+    sql = f"SELECT {', '.join('t.' + _q(c) for c in colunas)} FROM {origem}"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            lote = cursor.fetchmany(LOTE)
+            if not lote:
+                break
+            for r in lote:
+                yield list(r)
+
+
+def selecionadas(placa, codigos):
+    """
+    Linhas da placa com os códigos informados, só com as colunas usadas na geração
+    de Contas a Pagar. Dicts com os nomes lógicos de CAMPOS_ITEM (None se a view
+    não tiver a coluna). Consulta em lotes por causa do limite de parâmetros do SQL Server.
+    """
+    cmap = mapa_colunas(VW_CARTA_FRETE)
+    if not cmap['codigo']:
+        raise ValueError('Coluna de código não encontrada na VW_CARTA_FRETE.')
+    campos = [c for c in CAMPOS_ITEM if cmap[c]]
+    colunas = ', '.join(_q(cmap[c]) for c in campos)
+    codigos = list(codigos)
+    linhas = []
+    with connection.cursor() as cursor:
+        for i in range(0, len(codigos), LOTE):
+            lote = codigos[i:i + LOTE]
+            cursor.execute(
+                f"SELECT {colunas} FROM VW_CARTA_FRETE WHERE PLACA = %s "
+                f"AND {_q(cmap['codigo'])} IN ({', '.join(['%s'] * len(lote))})",
+                [placa] + lote,
+            )
+            for r in cursor.fetchall():
+                d = dict.fromkeys(CAMPOS_ITEM)
+                d.update(zip(campos, r))
+                linhas.append(d)
+    return linhas
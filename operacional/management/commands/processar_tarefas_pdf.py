@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from operacional import fila_pdf
+
+
+class Command(BaseCommand):
+    help = 'Worker da fila de PDFs (ope_tarefa_pdf): gera os PDFs pendentes e grava em disco.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uma-vez', action='store_true', help='Processa as pendentes e sai (ex.: cron).')
+        parser.add_argument('--intervalo', type=float, default=3.0, help='Segundos de espera quando a fila está vazia.')
+
+    def handle(self, *args, **options):
+        intervalo = max(options['intervalo'], 0.5)
+        ultima_limpeza = 0.0
+        while True:
+            close_old_connections()
+            if time.monotonic() - ultima_limpeza > 3600:
+                removidas = fila_pdf.limpar()
+                if removidas:
+                    self.stdout.write(f'{removidas} tarefas antigas removidas.')
+                ultima_limpeza = time.monotonic()
+            feitas = fila_pdf.processar_pendentes()
+            if feitas:
+                self.stdout.write(self.style.SUCCESS(f'{feitas} PDF(s) processado(s).'))
+            if options['uma_vez']:
+                break
+            if not feitas:
+                time.sleep(intervalo)
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from operacional.snapshot import reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói a tabela ope_fechamento_snapshot (totais do fechamento por placa/dia).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', help='Data inicial (AAAA-MM-DD). Padrão: todo o histórico.')
+        parser.add_argument('--fim', help='Data final (AAAA-MM-DD).')
+
+    def _data(self, valor):
+        if not valor:
+            return None
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Data inválida: {valor} (use AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        inicio = self._data(options.get('inicio'))
+        fim = self._data(options.get('fim'))
+        dias, linhas = reconstruir(inicio, fim)
+        self.stdout.write(self.style.SUCCESS(f'Snapshot reconstruído: {dias} dias, {linhas} placas/dia.'))
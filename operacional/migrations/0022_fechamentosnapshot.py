@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operacional', '0021_remove_item_valor_fixo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FechamentoSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('placa', models.CharField(max_length=10)),
+                ('agregado', models.CharField(blank=True, default='', max_length=150)),
+                ('data_fechamento', models.DateField()),
+                ('total_receber', models.FloatField(default=0)),
+                ('total_pagar', models.FloatField(default=0)),
+                ('lancamentos', models.FloatField(default=0)),
+                ('total_final', models.FloatField(default=0)),
+                ('cod_ag', models.CharField(blank=True, max_length=20, null=True)),
+                ('status', models.CharField(choices=[('aberto', 'Aberto'), ('fechado', 'Fechado'), ('enviado', 'Enviado AG')], default='aberto', max_length=10)),
+                ('dt_atualizacao', models.DateTimeField(auto_now=True)),
+                ('fechamento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='snapshots', to='operacional.fechamento')),
+            ],
+            options={
+                'verbose_name': 'resumo de fechamento',
+                'verbose_name_plural': 'resumos de fechamento',
+                'db_table': 'ope_fechamento_snapshot',
+                'indexes': [models.Index(fields=['data_fechamento', 'placa'], name='ope_fech_snap_data_idx')],
+                'unique_together': {('placa', 'data_fechamento')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operacional', '0022_fechamentosnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarefaPdf',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(default='prestacao_contas', max_length=30)),
+                ('parametros', models.TextField(default='{}')),
+                ('chave', models.CharField(db_index=True, max_length=64)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('concluido', 'Concluído'), ('erro', 'Erro')], default='pendente', max_length=12)),
+                ('arquivo', models.CharField(blank=True, default='', max_length=255)),
+                ('nome_arquivo', models.CharField(blank=True, default='', max_length=150)),
+                ('erro', models.TextField(blank=True, default='')),
+                ('tentativas', models.IntegerField(default=0)),
+                ('dt_criacao', models.DateTimeField(auto_now_add=True)),
+                ('dt_inicio', models.DateTimeField(blank=True, null=True)),
+                ('dt_fim', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(blank=True, db_column='id_usuario', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tarefas_pdf', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'tarefa de PDF',
+                'verbose_name_plural': 'tarefas de PDF',
+                'db_table': 'ope_tarefa_pdf',
+                'indexes': [models.Index(fields=['status', 'dt_criacao'], name='ope_tarefa_pdf_status_idx')],
+            },
+        ),
+    ]
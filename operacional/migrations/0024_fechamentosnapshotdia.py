@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operacional', '0023_tarefapdf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FechamentoSnapshotDia',
+            fields=[
+                ('data_fechamento', models.DateField(primary_key=True, serialize=False)),
+                ('dt_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'dia do resumo de fechamento',
+                'verbose_name_plural': 'dias do resumo de fechamento',
+                'db_table': 'ope_fechamento_snapshot_dia',
+            },
+        ),
+    ]
@@ -349,4 +349,92 @@ class VencContasPagar(models.Model):
         db_table = 'ope_contas_pagar_vencimento'
         verbose_name = 'vencimento de contas pagar'
         verbose_name_plural = 'vencimentos de contas pagar'
-        permissions = [('acessar_operacional', 'Pode acessar o módulo de operações')]
\ No newline at end of file
+        permissions = [('acessar_operacional', 'Pode acessar o módulo de operações')]
+
+class FechamentoSnapshot(models.Model):
+    """
+    Totais do fechamento por placa/dia (mesma regra da gestão de fechamento),
+    mantidos por operacional/snapshot.py a cada alteração de contas,
+    lançamentos e fechamentos.
+    """
+    STATUS_CHOICES = [
+        ('aberto', 'Aberto'),
+        ('fechado', 'Fechado'),
+        ('enviado', 'Enviado AG'),
+    ]
+    placa = models.CharField(max_length=10)
+    agregado = models.CharField(max_length=150, blank=True, default='')
+    data_fechamento = models.DateField()
+    total_receber = models.FloatField(default=0)
+    total_pagar = models.FloatField(default=0)
+    lancamentos = models.FloatField(default=0)
+    total_final = models.FloatField(default=0)
+    fechamento = models.ForeignKey(Fechamento, on_delete=models.SET_NULL, null=True, blank=True, related_name='snapshots')
+    cod_ag = models.CharField(max_length=20, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='aberto')
+    dt_atualizacao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ope_fechamento_snapshot'
+        verbose_name = 'resumo de fechamento'
+        verbose_name_plural = 'resumos de fechamento'
+        unique_together = ('placa', 'data_fechamento')
+        indexes = [
+            models.Index(fields=['data_fechamento', 'placa'], name='ope_fech_snap_data_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.placa} - {self.data_fechamento.strftime('%d/%m/%Y')} - R$ {self.total_final}"
+
+
+class FechamentoSnapshotDia(models.Model):
+    """
+    Dias em que o snapshot foi montado por completo (todas as placas). Só esses
+    dias são lidos do snapshot; os demais a tela calcula na hora.
+    """
+    data_fechamento = models.DateField(primary_key=True)
+    dt_atualizacao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ope_fechamento_snapshot_dia'
+        verbose_name = 'dia do resumo de fechamento'
+        verbose_name_plural = 'dias do resumo de fechamento'
+
+    def __str__(self):
+        return self.data_fechamento.strftime('%d/%m/%Y')
+
+
+class TarefaPdf(models.Model):
+    """
+    Fila de geração de PDFs (prestação de contas) processada em segundo plano pelo
+    comando `processar_tarefas_pdf`; o arquivo fica em disco para download.
+    """
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('concluido', 'Concluído'),
+        ('erro', 'Erro'),
+    ]
+    tipo = models.CharField(max_length=30, default='prestacao_contas')
+    parametros = models.TextField(default='{}')
+    chave = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='pendente')
+    arquivo = models.CharField(max_length=255, blank=True, default='')
+    nome_arquivo = models.CharField(max_length=150, blank=True, default='')
+    erro = models.TextField(blank=True, default='')
+    tentativas = models.IntegerField(default=0)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_column='id_usuario', related_name='tarefas_pdf')
+    dt_criacao = models.DateTimeField(auto_now_add=True)
+    dt_inicio = models.DateTimeField(null=True, blank=True)
+    dt_fim = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'ope_tarefa_pdf'
+        verbose_name = 'tarefa de PDF'
+        verbose_name_plural = 'tarefas de PDF'
+        indexes = [
+            models.Index(fields=['status', 'dt_criacao'], name='ope_tarefa_pdf_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.id} - {self.get_status_display()}"
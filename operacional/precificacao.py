@@ -0,0 +1,205 @@
+"""
+Regras de "cobrar" das movimentações (VW_MOVIMENTACOES), calculadas em lote.
+
+Recebe todas as linhas de uma vez (lista de dicts do get_queryset ou DataFrame)
+e calcula com pandas, para todas as linhas juntas:
+
+- unit_eff (Vl Sistema): vl_sistema do item (>0) ou valor unitário + percentual do item
+- cobrar: serviço -> valor do cadastro de Serviço (fallback: total); demais -> unit_eff * quantidade
+- perc_display: percentual exibido na tela
+- status: 'fechado' / 'aberto' (coluna status da view ou itens já fechados)
+
+e depois monta a hierarquia placa -> tipo -> itens usada no template.
+"""
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+STATUS_FECHADO = ('fechado', 'closed', '1', 'true')
+STATUS_ABERTO = ('aberto', 'open', '0', 'false')
+
+COLUNAS_LINHA = [
+    'cd_servico', 'nm_servico', 'nm_tipo_servico', 'valor', 'placa', 'agregado', 'data',
+    'ordem_servico', 'quantidade', 'total', 'cd_item', 'nm_item', 'unidade', 'status',
+]
+
+
+def sem_acento(texto):
+    return ''.join(
+        c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c)
+    )
+
+
+def _texto(serie):
+    """str(v).strip() preservando vazio para None/NaN."""
+    return serie.map(lambda v: '' if v is None or (isinstance(v, float) and np.isnan(v)) else str(v).strip())
+
+
+def _numero(serie):
+    return pd.to_numeric(serie, errors='coerce').astype(float)
+
+
+def _inteiro(serie):
+    """Como o antigo to_int_safe: código numérico inteiro ou NaN."""
+    n = _numero(serie)
+    return n.where(np.floor(n) == n)
+
+
+def _buscar(chave_id, chave_codigo, chave_nome, por_id, por_codigo, por_nome):
+    """
+    Resolve o valor do item pela ordem: id_item (se existir no mapa), senão
+    pro_codigo e, se vier zerado, nome do item.
+    """
+    em_id = chave_id.isin(list(por_id.keys())) if por_id else pd.Series(False, index=chave_id.index)
+    val_id = chave_id.map(por_id).astype(float).fillna(0.0) if por_id else 0.0
+    val_codigo = chave_codigo.map(por_codigo).astype(float).fillna(0.0) if por_codigo else pd.Series(0.0, index=chave_id.index)
+    val_nome = chave_nome.map(por_nome).astype(float).fillna(0.0) if por_nome else pd.Series(0.0, index=chave_id.index)
+    val_fallback = val_codigo.where(val_codigo != 0, val_nome)
+    return pd.Series(np.where(em_id, val_id, val_fallback), index=chave_id.index, dtype=float)
+
+
+def calcular_cobranca(rows, servico_valor=None, item_percentual=None, item_vl_sistema=None,
+                      fechados_item=None, fechados_servico=None, status_filter=None):
+    """
+    Calcula unit_eff/cobrar/perc_display/status para todas as linhas.
+
+    - servico_valor: {cd_servico(int): valor}
+    - item_percentual / item_vl_sistema: {'id': {...}, 'codigo': {...}, 'nome': {...}}
+    - fechados_item / fechados_servico: sets de (ordem, código, data, placa) já fechados,
+      usados quando a view não traz a coluna status
+    - status_filter: 'aberto' ou 'fechado' para manter só essas linhas
+
+    Retorna um DataFrame (linhas do tipo "lançamento" já removidas).
+    """
+    servico_valor = servico_valor or {}
+    item_percentual = item_percentual or {}
+    item_vl_sistema = item_vl_sistema or {}
+    fechados_item = fechados_item or set()
+    fechados_servico = fechados_servico or set()
+
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows), dtype=object)
+    df = df.reindex(columns=list(dict.fromkeys(list(df.columns) + COLUNAS_LINHA))).astype(object)
+    df = df.where(df.notna(), None)
+    if df.empty:
+        return df.assign(placa_grupo=[], tipo_grupo=[], total_item=[], unit_eff=[],
+                         cobrar=[], perc_display=[], status_item=[])
+
+    placa = _texto(df['placa'])
+    df['placa_grupo'] = placa.where(placa != '', 'SEM PLACA')
+
+    tipo_raw = _texto(df['nm_tipo_servico'])
+    tipo_norm = tipo_raw.str.lower().map(sem_acento)
+    # Ocultar completamente o tipo "lançamento"
+    manter = ~tipo_norm.str.contains('lancamento', regex=False)
+    df, tipo_raw, tipo_norm = df[manter].copy(), tipo_raw[manter], tipo_norm[manter]
+    df['tipo_grupo'] = tipo_raw.where(tipo_raw != '', 'SEM TIPO')
+    is_servico = tipo_norm.str.contains('servic', regex=False).to_numpy()
+
+    valor = _numero(df['valor']).fillna(0.0)
+    qtde = _numero(df['quantidade'])
+    total = _numero(df['total'])
+    qtde_total = qtde.where(qtde.fillna(0) != 0, 1.0)  # (quantidade or 1)
+    df['total_item'] = total.where(df['total'].notna(), valor * qtde_total).fillna(0.0)
+    qtde = qtde.fillna(0.0)
+
+    # Serviços: valor do cadastro, com fallback para o total
+    base_servico = _inteiro(df['cd_servico']).map(servico_valor).astype(float).fillna(0.0)
+    cobrar_servico = base_servico.where(base_servico != 0, df['total_item'])
+
+    # Demais tipos: vl_sistema (>0) ou unitário frota + percentual do item
+    cd_item_id = _inteiro(df['cd_item'])
+    cd_item_codigo = _texto(df['cd_item'])
+    nm_item_chave = _texto(df['nm_item']).str.upper()
+    vl_sistema = _buscar(cd_item_id, cd_item_codigo, nm_item_chave,
+                         item_vl_sistema.get('id'), item_vl_sistema.get('codigo'), item_vl_sistema.get('nome'))
+    perc = _buscar(cd_item_id, cd_item_codigo, nm_item_chave,
+                   item_percentual.get('id'), item_percentual.get('codigo'), item_percentual.get('nome'))
+    fator = np.where(perc <= 1, perc, perc / 100.0)
+    usa_sistema = vl_sistema > 0
+    unit_eff = np.where(usa_sistema, vl_sistema, valor * (1 + fator))
+    perc_item = np.where(usa_sistema, 0.0, np.where(perc > 1, perc, perc * 100.0))
+
+    df['unit_eff'] = np.where(is_servico, 0.0, unit_eff)
+    df['perc_display'] = np.where(is_servico, 0.0, perc_item)
+    df['cobrar'] = np.where(is_servico, cobrar_servico, unit_eff * qtde)
+
+    # Status: coluna status da view; se não vier, conferir itens já fechados
+    status_raw = _texto(df['status']).str.lower()
+    fechado = status_raw.isin(STATUS_FECHADO).to_numpy()
+    sem_status = (~status_raw.isin(STATUS_FECHADO + STATUS_ABERTO)).to_numpy()
+    if sem_status.any():
+        datas = df['data'].map(lambda v: v.date() if hasattr(v, 'date') else v)
+        chaves_serv = zip(df['ordem_servico'], df['cd_servico'], datas, df['placa_grupo'])
+        chaves_item = zip(df['ordem_servico'], df['cd_item'], datas, df['placa_grupo'])
+        legado = np.array([
+            bool(k_serv[1]) and k_serv in fechados_servico if serv else bool(k_item[1]) and k_item in fechados_item
+            for k_serv, k_item, serv in zip(chaves_serv, chaves_item, is_servico)
+        ], dtype=bool)
+        fechado = np.where(sem_status, legado, fechado)
+    df['status_item'] = np.where(fechado, 'fechado', 'aberto')
+
+    if status_filter in ('aberto', 'fechado'):
+        df = df[df['status_item'] == status_filter]
+    return df
+
+
+def _status_grupo(fechados):
+    has_closed = bool(fechados.any())
+    has_open = not bool(fechados.all())
+    if has_open and has_closed:
+        return 'mixed'
+    if has_closed:
+        return 'all_closed'
+    return 'all_open'
+
+
+def _valor_ou_zero(v):
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return 0
+    return v
+
+
+def agrupar_hierarquia(df):
+    """Monta [{placa, total_placa, cobrar_placa, status_placa, tipos: [...]}] a partir do calcular_cobranca."""
+    lista = []
+    if df.empty:
+        return lista
+    for placa, df_placa in df.groupby('placa_grupo', sort=True):
+        tipos = []
+        for tipo, df_tipo in df_placa.groupby('tipo_grupo', sort=True):
+            itens = [{
+                'data': r['data'],
+                'ordem_servico': r['ordem_servico'],
+                'cd_item': r['cd_item'],
+                'nm_item': r['nm_item'],
+                'quantidade': _valor_ou_zero(r['quantidade']),
+                'valor': _valor_ou_zero(r['valor']),
+                'total': r['total_item'],
+                'perc': r['perc_display'],
+                'vl_sistema': r['unit_eff'],
+                'cobrar': r['cobrar'],
+                'cd_servico': r['cd_servico'],
+                'nm_servico': r['nm_servico'],
+                'unidade': _valor_ou_zero(r['unidade']) or '',
+                'status': r['status_item'],
+            } for r in df_tipo.to_dict('records')]
+            fechados = df_tipo['status_item'] == 'fechado'
+            tipos.append({
+                'tipo': tipo,
+                'total_tipo': float(df_tipo['total_item'].sum()),
+                'cobrar_tipo': float(df_tipo['cobrar'].sum()),
+                'itens': itens,
+                'has_open': not bool(fechados.all()),
+                'has_closed': bool(fechados.any()),
+                'status_tipo': _status_grupo(fechados),
+            })
+        lista.append({
+            'placa': placa,
+            'total_placa': float(df_placa['total_item'].sum()),
+            'cobrar_placa': float(df_placa['cobrar'].sum()),
+            'status_placa': _status_grupo(df_placa['status_item'] == 'fechado'),
+            'tipos': tipos,
+        })
+    return lista
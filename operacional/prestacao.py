@@ -0,0 +1,337 @@
+"""
+Prestação de Contas em PDF (xhtml2pdf).
+
+montar_docs() junta, por placa, os itens/vencimentos de Contas a Receber e a
+Pagar, os lançamentos e os totais do dia; gerar_pdf() renderiza o template
+operacional/prestacao_contas_pdf.html e devolve (bytes do PDF, nome do arquivo),
+reaproveitando o PDF de cada placa enquanto os dados dela não mudarem (no mesmo
+dia de emissão).
+Usado pela fila de PDFs (fila_pdf.py), fora do ciclo da requisição.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from datetime import date, datetime
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.template.loader import render_to_string
+try:
+    from xhtml2pdf import pisa  # type: ignore
+except Exception:
+    pisa = None
+try:
+    from pypdf import PdfReader, PdfWriter  # type: ignore
+except Exception:
+    PdfReader = PdfWriter = None
+
+from copral import imagens
+
+from .consolidacao import totais_fechamento, resumo_totais, valor_lancamento
+from .models import (
+    Veiculo, Lancamento, ItensContasReceber, VencContasReceber, ItensContasPagar, VencContasPagar,
+)
+
+
+FRAGMENTOS_DIR = os.getenv('PDF_FRAGMENTOS_DIR', str(Path(settings.BASE_DIR) / 'media' / 'pdfs' / 'fragmentos'))
+# trocar quando o layout do template mudar (invalida todos os fragmentos em disco)
+VERSAO_LAYOUT = '1'
+
+
+def _data(data_str):
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            return datetime.strptime(data_str, fmt).date()
+        except Exception:
+            continue
+    return None
+
+
+def _chave(placa):
+    return (placa or '').strip().upper()
+
+
+def montar_docs(data_str, placas):
+    """
+    Lista de documentos (um por placa) no formato do template do PDF.
+    Carrega todas as placas de uma vez: cada tabela é lida uma única vez com
+    filtros `__in` e as linhas são separadas por placa em memória (número de
+    consultas fixo, independente da quantidade de placas).
+    """
+    dt = _data(data_str)
+    if dt is None or not placas:
+        return []
+
+    # Veículos das placas (id_veiculo -> placa pedida) e nome do agregado
+    pedidas = {_chave(p) for p in placas}
+    placa_do_veiculo = {}
+    agregados = {}
+    for v in Veiculo.objects.select_related('placa').filter(placa__placa__in=pedidas | set(placas)):
+        chave = _chave(v.placa_id)
+        if chave not in pedidas:
+            continue
+        placa_do_veiculo[v.id_veiculo] = chave
+        agregados.setdefault(chave, getattr(v.placa, 'nm_agregado', '') or '')
+    veic_ids = list(placa_do_veiculo.keys())
+
+    por_placa = {p: {'cr_itens': [], 'cp_itens': [], 'cr_venc': [], 'cp_venc': [], 'lanc': []} for p in pedidas}
+
+    def anexar(id_veiculo, lista, linha):
+        chave = placa_do_veiculo.get(id_veiculo)
+        if chave is not None:
+            por_placa[chave][lista].append(linha)
+
+    if veic_ids:
+        # Vencimentos CR/CP por data de fechamento (regra ajustada)
+        for v in VencContasReceber.objects.select_related('contas_receber').filter(
+                contas_receber__data_fechamento=dt, contas_receber__placa__in=veic_ids):
+            anexar(v.contas_receber.placa_id, 'cr_venc', {
+                'seq': v.seq_vencimento,
+                'data': v.data_vencimento.strftime('%d/%m/%Y') if v.data_vencimento else '',
+                'valor': float(v.valor or 0),
+            })
+        for v in VencContasPagar.objects.select_related('contas_pagar').filter(
+                contas_pagar__data_fechamento=dt, contas_pagar__placa__in=veic_ids):
+            anexar(v.contas_pagar.placa_id, 'cp_venc', {
+                'seq': v.seq_vencimento,
+                'data': v.data_vencimento.strftime('%d/%m/%Y') if v.data_vencimento else '',
+                'valor': float(v.valor or 0),
+            })
+        # Lançamentos
+        for l in Lancamento.objects.select_related('categoria').filter(data=dt, veiculo_id__in=veic_ids):
+            anexar(l.veiculo_id, 'lanc', {
+                'data': l.data.strftime('%d/%m/%Y') if l.data else '',
+                'categoria': getattr(l.categoria, 'nome', ''),
+                'natureza': l.natureza or '',
+                'valor': valor_lancamento(l.natureza, l.valor),
+                'obs': l.obs or '',
+                'periodo': getattr(l, 'periodo', '') or '',
+                'parcela': getattr(l, 'parcela', 1) or 1,
+            })
+        # Itens CR/CP (filtrando pelo cabeçalho no mesmo JOIN)
+        for it in ItensContasReceber.objects.select_related('contas_receber').filter(
+                contas_receber__data_fechamento=dt, contas_receber__placa__in=veic_ids).order_by('data', 'ordemServico'):
+            anexar(it.contas_receber.placa_id, 'cr_itens', {
+                'os': it.ordemServico,
+                'servico': it.nmServico,
+                'data': it.data.strftime('%d/%m/%Y') if it.data else '',
+                'item': it.nmItem,
+                'qtde': float(it.qtde or 0),
+                'un': it.unidade or '',
+                'valor': float(it.valor or 0),
+                'percentual': float(it.percentual or 0),
+                'valor_unit': float(it.valor_unitario or 0),
+                'total': float(it.total or 0),
+                'periodo': getattr(it, 'periodo', '') or '',
+                'parcela': getattr(it, 'parcela', 1) or 1,
+            })
+        for it in ItensContasPagar.objects.select_related('contas_pagar').filter(
+                contas_pagar__data_fechamento=dt, contas_pagar__placa__in=veic_ids).order_by('data', 'codigo'):
+            anexar(it.contas_pagar.placa_id, 'cp_itens', {
+                'empresa': it.empresa or '',
+                'codigo': it.codigo or '',
+                'placa': it.placa or '',
+                'data': it.data.strftime('%d/%m/%Y') if it.data else '',
+                'act': it.act or '',
+                'status': it.status or '',
+                'trecho': it.trecho or '',
+                'valor': float(it.valor or 0),
+                'adiantamento': float(it.adiantamento or 0),
+                'outros': float(it.outros or 0),
+                'saldo': float(it.saldo or 0),
+                'periodo': it.periodo or '',
+                'parcela': it.parcela or 1,
+            })
+
+    # Totais (ótica do agregado, como no front), pela consolidação compartilhada com a grade: uma consulta
+    totais = {}
+    if veic_ids:
+        for linha in totais_fechamento(dt, veic_ids, base='fechamento'):
+            totais.setdefault(_chave(linha['placa']), []).append(linha)
+
+    docs = []
+    for placa in placas:
+        chave = _chave(placa)
+        tot = resumo_totais(totais.get(chave, []))
+        docs.append({
+            'placa': placa,
+            'agregado': agregados.get(chave, ''),
+            'data': data_str,
+            **por_placa[chave],
+            'totais': {
+                'sCR': tot['total_receber'],  # a pagar (agregado)
+                'sCP': tot['total_pagar'],  # a receber (agregado)
+                'sLN': tot['lancamentos'],
+                'totalGeral': tot['total_final'],
+            }
+        })
+    return docs
+
+
+def _sanitize(t: str) -> str:
+    try:
+        t = unicodedata.normalize('NFD', str(t))
+        t = ''.join(ch for ch in t if unicodedata.category(ch) != 'Mn')
+        t = re.sub(r'[^A-Za-z0-9_\\-]+', '_', t)
+        t = re.sub(r'_+', '_', t).strip('_')
+        return t
+    except Exception:
+        return str(t).replace(' ', '_')
+
+
+def _contexto_base(hoje):
+    """Contexto do template sem os documentos (logo e data de emissão)."""
+    context = {
+        'logo_url': staticfiles_storage.url('img/logo.png'),
+        'logo_src': (getattr(staticfiles_storage, 'base_url', None) or '/static/') + 'img/logo.png',
+        'logo_data_uri': None,
+        'logo_abs_path': None,
+        'logo_file_uri': None,
+        'hoje': hoje,
+    }
+    # Logo em JPEG RGB (sem transparência, evita máscara escura no PDF), pré-processada uma vez por processo
+    try:
+        logo = imagens.logo_pdf()
+        if logo:
+            context['logo_abs_path'] = logo['path']
+            context['logo_file_uri'] = logo['file_uri']
+            context['logo_data_uri'] = logo['data_uri']
+    except Exception:
+        pass
+    return context
+
+
+def _link_callback(uri, rel):
+    try:
+        base_url = getattr(staticfiles_storage, 'base_url', None) or '/static/'
+        # map /static/... to filesystem path
+        if uri.startswith(base_url):
+            rel_path = uri.replace(base_url, '')
+            return staticfiles_storage.path(rel_path)
+        # file:/// scheme
+        if uri.startswith('file://'):
+            return uri.replace('file://', '')
+        # absolute path on filesystem
+        if os.path.isabs(uri) and os.path.exists(uri):
+            return uri
+        return uri
+    except Exception:
+        return uri
+
+
+def _renderizar(docs, contexto):
+    html = render_to_string('operacional/prestacao_contas_pdf.html', dict(contexto, docs=docs))
+    result = BytesIO()
+    pisa.CreatePDF(html, dest=result, link_callback=_link_callback, encoding='utf-8')
+    pdf = result.getvalue()
+    if not pdf:
+        raise ValueError('Falha ao montar PDF.')
+    return pdf
+
+
+def _hash_doc(doc, hoje):
+    """
+    Hash do conteúdo de uma placa (itens, vencimentos, lançamentos, totais) + emissão.
+    A data de emissão é impressa no fragmento, então o cache só vale no mesmo dia:
+    no dia seguinte toda placa é renderizada de novo e os fragmentos de dias
+    anteriores ficam órfãos (removidos por limpar_fragmentos()).
+    """
+    texto = json.dumps({'layout': VERSAO_LAYOUT, 'hoje': hoje, 'doc': doc}, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def _fragmento(doc, data_str, hoje, contexto):
+    """
+    PDF de uma placa: lido do cache em disco se o conteúdo não mudou, senão
+    renderizado e gravado (apagando as versões anteriores da mesma placa/data).
+    `contexto` é uma função (o contexto só é montado se alguma placa precisar renderizar).
+    """
+    prefixo = f"{_sanitize(doc.get('placa') or '')}_{_sanitize(data_str)}_"
+    path = os.path.join(FRAGMENTOS_DIR, prefixo + _hash_doc(doc, hoje)[:32] + '.pdf')
+    try:
+        with open(path, 'rb') as fh:
+            return fh.read()
+    except OSError:
+        pass
+    pdf = _renderizar([doc], contexto())
+    try:
+        os.makedirs(FRAGMENTOS_DIR, exist_ok=True)
+        for antigo in Path(FRAGMENTOS_DIR).glob(glob.escape(prefixo) + '*.pdf'):
+            antigo.unlink(missing_ok=True)
+        with open(path + '.tmp', 'wb') as fh:
+            fh.write(pdf)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass  # sem cache não impede a geração
+    return pdf
+
+
+def limpar_fragmentos(hoje=None):
+    """
+    Remove os fragmentos gravados antes de hoje (não são mais reaproveitados, o
+    hash inclui a data de emissão) e temporários largados. Retorna quantos removeu.
+    """
+    inicio = datetime.combine(hoje or date.today(), datetime.min.time()).timestamp()
+    removidos = 0
+    for arquivo in list(Path(FRAGMENTOS_DIR).glob('*.pdf')) + list(Path(FRAGMENTOS_DIR).glob('*.pdf.tmp')):
+        try:
+            if arquivo.stat().st_mtime < inicio:
+                arquivo.unlink()
+                removidos += 1
+        except OSError:
+            pass
+    return removidos
+
+
+def _juntar(partes):
+    writer = PdfWriter()
+    for parte in partes:
+        writer.append(PdfReader(BytesIO(parte)))
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def gerar_pdf(data_str, placas):
+    """
+    Gera o PDF único com todas as placas. Retorna (pdf, nome_arquivo).
+    Cada placa é renderizada separadamente e guardada em FRAGMENTOS_DIR pelo hash
+    do conteúdo; só as placas cujos dados mudaram são renderizadas de novo e o
+    arquivo final junta os fragmentos (pypdf). Sem pypdf, renderiza tudo de uma vez.
+    ValueError quando não há dados ou a renderização falha.
+    """
+    if pisa is None:
+        raise RuntimeError('Biblioteca xhtml2pdf não instalada no servidor.')
+    docs = montar_docs(data_str, placas)
+    if not docs:
+        raise ValueError('Sem dados para gerar.')
+    hoje = date.today().strftime('%d/%m/%Y')
+    if PdfWriter is None:
+        pdf = _renderizar(docs, _contexto_base(hoje))
+    else:
+        cache_contexto = {}
+
+        def contexto():
+            if 'ctx' not in cache_contexto:
+                cache_contexto['ctx'] = _contexto_base(hoje)
+            return cache_contexto['ctx']
+
+        partes = [_fragmento(doc, data_str, hoje, contexto) for doc in docs]
+        pdf = partes[0] if len(partes) == 1 else _juntar(partes)
+    # Definir nome do arquivo
+    fname = f'prestacao_{data_str}.pdf'
+    try:
+        if len(placas) == 1 and docs:
+            placa_fname = _sanitize(docs[0].get('placa') or placas[0] or '')
+            ag_fname = _sanitize(docs[0].get('agregado') or '')
+            parts = [p for p in [placa_fname, ag_fname, data_str] if p]
+            if parts:
+                fname = '_'.join(parts) + '.pdf'
+    except Exception:
+        pass
+    return pdf, fname
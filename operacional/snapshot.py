@@ -0,0 +1,313 @@
+"""
+Manutenção da tabela ope_fechamento_snapshot (FechamentoSnapshot).
+
+Guarda, por placa/dia, os totais da gestão de fechamento (consolidacao.totais_fechamento,
+base 'vencimento') junto com o fechamento, o cod_ag e o status. Assim as telas de
+fechamento leem uma única consulta indexada em vez de recalcular tudo.
+
+Atualização incremental: as views que alteram contas, lançamentos ou fechamentos
+chamam agendar()/agendar_contas() e o recálculo dos dias afetados roda depois do
+commit da transação. O recálculo é sempre da placa inteira (todos os veículos do
+agregado), e um dia que ainda não foi montado por completo (FechamentoSnapshotDia)
+é montado inteiro na primeira alteração. Depois da sp_cadastros (AtualizarDadosView)
+apos_cadastros() acerta os nomes de agregado e remonta os dias das placas cujos
+veículos mudaram. Reconstrução completa:
+
+    python manage.py rebuild_fechamento_snapshot [--inicio AAAA-MM-DD] [--fim AAAA-MM-DD]
+"""
+import logging
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from .consolidacao import totais_fechamento
+from .models import (
+    Agregado, Veiculo, Fechamento, FechamentoSnapshot, FechamentoSnapshotDia, ContasReceber, VencContasReceber,
+    ContasPagar, VencContasPagar, Lancamento,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# tamanho dos lotes de id_veiculo em filtros IN (limite de 2100 parâmetros do SQL Server)
+LOTE_VEICULOS = 1000
+
+CAMPOS_ATUALIZAVEIS = [
+    'agregado', 'total_receber', 'total_pagar', 'lancamentos', 'total_final',
+    'fechamento', 'cod_ag', 'status', 'dt_atualizacao',
+]
+
+
+def _chave(placa):
+    return (placa or '').strip().upper()
+
+
+def _para_data(valor):
+    return valor.date() if isinstance(valor, datetime) else valor
+
+
+def _status(fech):
+    if not fech:
+        return 'aberto'
+    if (fech.get('cod_ag') or '').strip():
+        return 'enviado'
+    return 'fechado'
+
+
+def _fechamentos_do_dia(dia, veic_ids=None):
+    """PLACA -> {'id', 'cod_ag'} dos fechamentos do dia."""
+    inicio = datetime.combine(dia, datetime.min.time())
+    qs = Fechamento.objects.filter(data_fechamento__gte=inicio, data_fechamento__lt=inicio + timedelta(days=1))
+    if veic_ids is not None:
+        qs = qs.filter(placa_id__in=list(veic_ids))
+    mapa = {}
+    for f in qs.order_by('id').values('id', 'cod_ag', 'placa__placa__placa'):
+        mapa.setdefault(_chave(f['placa__placa__placa']), f)
+    return mapa
+
+
+def _veiculos_das_placas(veic_ids):
+    """
+    (veic_ids, placas) com todos os veículos das placas dos veic_ids: o snapshot
+    é por placa, então recalcular só um dos veículos gravaria um total parcial.
+    """
+    placas = sorted(set(
+        Veiculo.objects.filter(id_veiculo__in=veic_ids).values_list('placa_id', flat=True)
+    ))
+    ids = set(veic_ids) | set(
+        Veiculo.objects.filter(placa_id__in=placas).values_list('id_veiculo', flat=True)
+    )
+    return sorted(ids), placas
+
+
+def dia_completo(dia):
+    return FechamentoSnapshotDia.objects.filter(data_fechamento=_para_data(dia)).exists()
+
+
+def atualizar_dia(dia, veic_ids=None):
+    """
+    Recalcula o snapshot de um dia (todas as placas ou só as placas dos veic_ids).
+    Placas que deixaram de ter valores no dia são removidas. Se o dia ainda não
+    foi montado por completo, monta todas as placas.
+    """
+    dia = _para_data(dia)
+    if veic_ids is not None:
+        veic_ids = sorted({int(v) for v in veic_ids if v is not None})
+        if not veic_ids:
+            return 0
+        if not dia_completo(dia):
+            veic_ids = None
+    placas = None
+    if veic_ids is not None:
+        veic_ids, placas = _veiculos_das_placas(veic_ids)
+    totais = totais_fechamento(dia, veic_ids)
+    fechamentos = _fechamentos_do_dia(dia, veic_ids)
+
+    existentes_qs = FechamentoSnapshot.objects.filter(data_fechamento=dia)
+    if placas is not None:
+        existentes_qs = existentes_qs.filter(placa__in=placas)
+
+    with transaction.atomic():
+        existentes = {_chave(s.placa): s for s in existentes_qs.select_for_update()}
+        novos, alterados = [], []
+        for tot in totais:
+            chave = _chave(tot['placa'])
+            fech = fechamentos.get(chave)
+            valores = {
+                'agregado': (tot['agregado'] or '')[:150],
+                'total_receber': tot['total_receber'],
+                'total_pagar': tot['total_pagar'],
+                'lancamentos': tot['lancamentos'],
+                'total_final': tot['total_final'],
+                'fechamento_id': fech['id'] if fech else None,
+                'cod_ag': (fech.get('cod_ag') if fech else None) or None,
+                'status': _status(fech),
+            }
+            snap = existentes.pop(chave, None)
+            if snap is None:
+                novos.append(FechamentoSnapshot(placa=tot['placa'], data_fechamento=dia, **valores))
+            else:
+                for campo, valor in valores.items():
+                    setattr(snap, campo, valor)
+                alterados.append(snap)
+        if novos:
+            FechamentoSnapshot.objects.bulk_create(novos)
+        if alterados:
+            FechamentoSnapshot.objects.bulk_update(alterados, CAMPOS_ATUALIZAVEIS)
+        if existentes:
+            FechamentoSnapshot.objects.filter(id__in=[s.id for s in existentes.values()]).delete()
+        if veic_ids is None:
+            FechamentoSnapshotDia.objects.update_or_create(data_fechamento=dia)
+    return len(novos) + len(alterados)
+
+
+def atualizar(dias, veic_ids=None):
+    for dia in sorted({_para_data(d) for d in dias if d}):
+        atualizar_dia(dia, veic_ids)
+
+
+def agendar(dias, veic_ids=None):
+    """
+    Agenda o recálculo dos dias/veículos para depois do commit da transação atual
+    (ou executa na hora, fora de transação). Falhas não derrubam a requisição.
+    """
+    dias = {_para_data(d) for d in dias if d}
+    veic_ids = None if veic_ids is None else {v for v in veic_ids if v is not None}
+    if not dias:
+        return
+
+    def _executar():
+        try:
+            atualizar(dias, veic_ids)
+        except Exception:
+            logger.exception('Falha ao atualizar snapshot de fechamento (dias %s)', sorted(dias))
+
+    transaction.on_commit(_executar)
+
+
+def _vencimentos_de(cab):
+    if isinstance(cab, ContasPagar):
+        return VencContasPagar, 'contas_pagar_id'
+    return VencContasReceber, 'contas_receber_id'
+
+
+def dias_contas(cab):
+    """Dias que o cabeçalho CR/CP afeta: data de fechamento e datas dos vencimentos."""
+    dias = {cab.data_fechamento} if cab.data_fechamento else set()
+    if cab.pk is not None:
+        venc, fk = _vencimentos_de(cab)
+        dias.update(venc.objects.filter(**{fk: cab.pk}).values_list('data_vencimento', flat=True))
+    return dias
+
+
+def agendar_contas(cab, dias_antes=()):
+    """
+    Agenda o recálculo de um cabeçalho CR/CP alterado: os dias de antes da
+    alteração (dias_contas() chamado antes) e os dias atuais, lidos após o commit.
+    """
+    venc, fk = _vencimentos_de(cab)
+    cab_id, veic_id = cab.pk, cab.placa_id
+    dias = set(dias_antes)
+    if cab.data_fechamento:
+        dias.add(cab.data_fechamento)
+
+    def _executar():
+        try:
+            todos = set(dias)
+            if cab_id is not None:
+                todos.update(venc.objects.filter(**{fk: cab_id}).values_list('data_vencimento', flat=True))
+            atualizar(todos, [veic_id])
+        except Exception:
+            logger.exception('Falha ao atualizar snapshot de fechamento (veículo %s)', veic_id)
+
+    transaction.on_commit(_executar)
+
+
+def agendar_fechamento(fech):
+    agendar([fech.data_fechamento], [fech.placa_id])
+
+
+def dias_com_movimento(inicio=None, fim=None, veic_ids=None):
+    """
+    Todos os dias com vencimento, cabeçalho ou lançamento (para a reconstrução);
+    com veic_ids, só os dias com movimento desses veículos.
+    """
+    fontes = [
+        (VencContasReceber, 'data_vencimento', 'contas_receber__placa_id'),
+        (VencContasPagar, 'data_vencimento', 'contas_pagar__placa_id'),
+        (ContasReceber, 'data_fechamento', 'placa_id'),
+        (ContasPagar, 'data_fechamento', 'placa_id'),
+        (Lancamento, 'data', 'veiculo_id'),
+    ]
+    lotes = [None]
+    if veic_ids is not None:
+        ids = sorted(veic_ids)
+        lotes = [ids[i:i + LOTE_VEICULOS] for i in range(0, len(ids), LOTE_VEICULOS)]
+    dias = set()
+    for modelo, campo, veiculo in fontes:
+        qs = modelo.objects.all()
+        if inicio:
+            qs = qs.filter(**{f'{campo}__gte': inicio})
+        if fim:
+            qs = qs.filter(**{f'{campo}__lte': fim})
+        for lote in lotes:
+            filtrado = qs if lote is None else qs.filter(**{f'{veiculo}__in': lote})
+            dias.update(filtrado.values_list(campo, flat=True).distinct())
+    dias.discard(None)
+    return sorted(dias)
+
+
+def veiculos_e_placas():
+    """{id_veiculo: placa}: foto do cadastro para comparar antes/depois da sp_cadastros."""
+    return dict(Veiculo.objects.values_list('id_veiculo', 'placa_id'))
+
+
+def apos_cadastros(antes):
+    """
+    Acerta o snapshot depois da sp_cadastros (`antes` = veiculos_e_placas() de
+    antes da procedure):
+    - nome do agregado: um UPDATE nas linhas cujo nome mudou
+    - veículos que trocaram de placa (ou entraram/saíram do cadastro): os dias já
+      montados em que eles têm movimento são remontados por inteiro
+    Retorna (linhas com nome atualizado, dias remontados).
+    """
+    nomes = Agregado.objects.filter(placa=OuterRef('placa'))
+    renomeadas = FechamentoSnapshot.objects.filter(
+        Exists(nomes.exclude(nm_agregado=OuterRef('agregado')))
+    ).update(agregado=Subquery(nomes.values('nm_agregado')[:1]))
+
+    depois = veiculos_e_placas()
+    mudaram = {v for v in set(antes) | set(depois) if antes.get(v) != depois.get(v)}
+    dias = []
+    if mudaram:
+        montados = set(FechamentoSnapshotDia.objects.values_list('data_fechamento', flat=True))
+        dias = [d for d in dias_com_movimento(veic_ids=mudaram) if d in montados]
+        atualizar(dias)
+    return renomeadas, len(dias)
+
+
+def reconstruir(inicio=None, fim=None):
+    """Apaga e recalcula o snapshot do período (ou de tudo). Retorna (dias, linhas)."""
+    antigos = FechamentoSnapshot.objects.all()
+    dias_antigos = FechamentoSnapshotDia.objects.all()
+    if inicio:
+        antigos = antigos.filter(data_fechamento__gte=inicio)
+        dias_antigos = dias_antigos.filter(data_fechamento__gte=inicio)
+    if fim:
+        antigos = antigos.filter(data_fechamento__lte=fim)
+        dias_antigos = dias_antigos.filter(data_fechamento__lte=fim)
+    dias = dias_com_movimento(inicio, fim)
+    linhas = 0
+    with transaction.atomic():
+        antigos.delete()
+        dias_antigos.delete()
+        for dia in dias:
+            linhas += atualizar_dia(dia)
+    return len(dias), linhas
+
+
+def linhas_do_dia(dia, veic_ids=None):
+    """
+    Linhas do snapshot no formato da grade da gestão de fechamento, ou None se o
+    dia ainda não foi montado por completo (a tela então calcula na hora).
+    """
+    if not dia_completo(dia):
+        return None
+    qs = FechamentoSnapshot.objects.filter(data_fechamento=_para_data(dia))
+    if veic_ids is not None:
+        placas = Veiculo.objects.filter(id_veiculo__in=list(veic_ids)).values_list('placa_id', flat=True)
+        qs = qs.filter(placa__in=list(placas))
+    return [
+        {
+            'placa': s.placa,
+            'agregado': s.agregado,
+            'total_receber': s.total_receber,
+            'total_pagar': s.total_pagar,
+            'lancamentos': s.lancamentos,
+            'total_final': s.total_final,
+            'fechamento_id': s.fechamento_id,
+            'cod_ag': s.cod_ag or '',
+        }
+        for s in qs.order_by('placa')
+    ]
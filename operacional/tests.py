@@ -1,3 +1,438 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User, Permission
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from copral.middleware import Medicao, OrcamentoConsultasExcedido
+
+from . import colunas, fila_pdf, prestacao, snapshot, vencimentos
+from .consolidacao import totais_fechamento, totais_por_placa, resumo_totais, valor_lancamento
+from .models import (
+    Agregado, Veiculo, OpeCategoria, Lancamento, ContasReceber, ItensContasReceber, VencContasReceber,
+    ContasPagar, VencContasPagar,
+)
+from .precificacao import calcular_cobranca
+from .prestacao import montar_docs
+
+
+DIA = date(2025, 5, 10)
+
+COLUNAS_CARTA_FRETE = [
+    'empresa', 'codigo', 'placa', 'data', 'situacao', 'status', 'trecho', 'act',
+    'valor', 'adiantamento', 'outros', 'saldo',
+]
+
+
+def criar_usuario(nome):
+    usuario = User.objects.create_user(nome, password='x')
+    usuario.user_permissions.add(
+        *Permission.objects.filter(codename='acessar_operacional', content_type__app_label='operacional')
+    )
+    return usuario
+
+
+def criar_veiculo(id_veiculo, placa, agregado='AGREGADO'):
+    ag, _ = Agregado.objects.get_or_create(placa=placa, defaults={'nm_agregado': agregado, 'dt_atualizacao': timezone.now()})
+    # bulk_create: Veiculo.save() espera a placa como texto (cadastro vem da sp_cadastros)
+    return Veiculo.objects.bulk_create([Veiculo(
+        placa=ag, id_veiculo=id_veiculo, cd_veiculo=id_veiculo, cd_frota=1, nm_frota='FROTA',
+        cd_centro_custo=1, nm_centro_custo='CC', dt_atualizacao=timezone.now(),
+    )])[0]
+
+
+@override_settings(CONSULTAS_PROFILING=True, CONSULTAS_ORCAMENTO_ESTRITO=True)
+class OrcamentoConsultasTests(TestCase):
+    """
+    Orçamento de consultas (settings.CONSULTAS_ORCAMENTO) das telas principais. Com
+    CONSULTAS_ORCAMENTO_ESTRITO o ConsultasMiddleware levanta OrcamentoConsultasExcedido
+    quando a view passa do limite, então um N+1 novo quebra o teste.
+    Os dados têm várias placas para que consultas por placa estourem o orçamento.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = criar_usuario('orcamento')
+        categoria = OpeCategoria.objects.create(nome='DIVERSOS')
+        for i in range(1, 7):
+            veiculo = criar_veiculo(i, f'PLC{i:04d}', f'AGREGADO {i % 3}')
+            cr = ContasReceber.objects.create(
+                placa=veiculo, data_fechamento=DIA, valor=100.0 * i,
+                criado_por=cls.usuario, atualizado_por=cls.usuario,
+            )
+            VencContasReceber.objects.create(contas_receber=cr, seq_vencimento=1, data_vencimento=DIA, valor=100.0 * i)
+            ItensContasReceber.objects.create(
+                ordemServico=i, cdServico=1, nmServico='SERVICO', data=timezone.make_aware(datetime(2025, 5, 1)), tipo='PECA',
+                cdItem=i, nmItem='ITEM', qtde=1, unidade='UN', valor_unitario=100.0 * i, percentual=0,
+                valor=100.0 * i, total=100.0 * i, periodo='S', parcela=1, contas_receber=cr,
+            )
+            Lancamento.objects.create(
+                veiculo=veiculo, categoria=categoria, data=DIA, valor=10.0, natureza='D', usuario=cls.usuario,
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE VW_CARTA_FRETE (empresa VARCHAR(3), codigo VARCHAR(10), placa VARCHAR(10), '
+                'data DATE, situacao VARCHAR(20), status VARCHAR(1), trecho VARCHAR(10), act VARCHAR(250), '
+                'valor FLOAT, adiantamento FLOAT, outros FLOAT, saldo FLOAT)'
+            )
+            for i in range(1, 7):
+                cursor.execute(
+                    'INSERT INTO VW_CARTA_FRETE VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                    ['1', f'CF{i}', f'PLC{i:04d}', DIA, 'ABERTO', 'A', 'T', 'ACT', 50.0, 10.0, 0.0, 40.0],
+                )
+
+    def setUp(self):
+        # mapa de colunas já em cache, como depois da primeira requisição em produção
+        colunas.invalidar()
+        with mock.patch.object(colunas, '_ler_colunas', return_value=COLUNAS_CARTA_FRETE):
+            colunas.mapa_colunas(colunas.VW_CARTA_FRETE)
+        self.client.force_login(self.usuario)
+
+    def tearDown(self):
+        colunas.invalidar()
+
+    def test_gestao_fechamento(self):
+        resp = self.client.get(reverse('operacional:gestao_fechamento'), {'data_fechamento': DIA.isoformat()})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.context['rows']), 6)
+
+    def test_contas_a_receber(self):
+        resp = self.client.get(reverse('operacional:contas_a_receber'))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_carta_frete_page(self):
+        resp = self.client.get(reverse('operacional:carta_frete_page'), {
+            'data_inicio': '2025-05-01', 'data_fim': '2025-05-31',
+        })
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([str(m) for m in resp.context['messages'] if m.level_tag == 'error'], [])
+
+    def test_carta_frete_api(self):
+        resp = self.client.get(reverse('operacional:carta_frete_api'), {
+            'placa': 'PLC0001', 'data_inicio': '2025-05-01', 'data_fim': '2025-05-31',
+        })
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()['success'])
+
+    def test_prestacao_contas_pdf_e_status(self):
+        resp = self.client.post(
+            reverse('operacional:prestacao_contas_pdf'),
+            data=json.dumps({'data_fechamento': DIA.isoformat(), 'placas': [f'PLC{i:04d}' for i in range(1, 7)]}),
+            content_type='application/json',
+        )
+        self.assertEqual(resp.status_code, 202)
+        tarefa_id = resp.json()['tarefa_id']
+        resp = self.client.get(reverse('operacional:prestacao_contas_pdf_status', args=[tarefa_id]))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['status'], 'pendente')
+
+    @override_settings(CONSULTAS_ORCAMENTO={'operacional:contas_a_receber': 1})
+    def test_orcamento_estourado_levanta(self):
+        with self.assertRaises(OrcamentoConsultasExcedido):
+            self.client.get(reverse('operacional:contas_a_receber'))
+
+    @override_settings(CONSULTAS_ORCAMENTO={'operacional:contas_a_receber': 1}, CONSULTAS_ORCAMENTO_ESTRITO=False)
+    def test_orcamento_estourado_sem_estrito_so_avisa(self):
+        with self.assertLogs('copral.consultas', level='WARNING') as logs:
+            resp = self.client.get(reverse('operacional:contas_a_receber'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('orçamento 1', logs.output[-1])
+
+    def test_server_timing(self):
+        resp = self.client.get(reverse('operacional:contas_a_receber'))
+        self.assertIn('db;dur=', resp['Server-Timing'])
+
+
+class MedicaoTests(TestCase):
+
+    def test_repetidas_agrupa_pelo_modelo_do_sql(self):
+        ids = [criar_veiculo(i, f'REP{i:04d}').id_veiculo for i in range(1, 6)]
+        with Medicao() as m:
+            for id_veiculo in ids:
+                Veiculo.objects.get(id_veiculo=id_veiculo)
+            Agregado.objects.count()
+        self.assertEqual(m.total, 6)
+        repetidas = m.repetidas(minimo=5)
+        self.assertEqual(len(repetidas), 1)
+        self.assertEqual(repetidas[0][1], 5)
+        self.assertEqual(m.repetidas(minimo=6), [])
+
+    def test_medicao_nao_conta_fora_do_bloco(self):
+        with Medicao() as m:
+            Agregado.objects.count()
+        Agregado.objects.count()
+        self.assertEqual(m.total, 1)
+
+
+def linha_mov(**campos):
+    linha = {
+        'cd_servico': None, 'nm_servico': '', 'nm_tipo_servico': 'PECAS', 'valor': 0.0, 'placa': 'ABC1234',
+        'agregado': 'AGREGADO', 'data': DIA, 'ordem_servico': 1, 'quantidade': 1, 'total': None,
+        'cd_item': None, 'nm_item': '', 'unidade': 'UN', 'status': 'aberto',
+    }
+    linha.update(campos)
+    return linha
+
+
+class CalcularCobrancaTests(SimpleTestCase):
+    """Precedência das regras de "cobrar" de precificacao.calcular_cobranca."""
+
+    def test_servico_usa_valor_do_cadastro_e_senao_o_total(self):
+        df = calcular_cobranca([
+            linha_mov(nm_tipo_servico='SERVIÇOS', cd_servico=10, valor=50.0, quantidade=2, total=100.0),
+            linha_mov(nm_tipo_servico='SERVIÇOS', cd_servico=99, valor=50.0, quantidade=2, total=100.0),
+        ], servico_valor={10: 80.0})
+        self.assertEqual(list(df['cobrar']), [80.0, 100.0])
+        self.assertEqual(list(df['unit_eff']), [0.0, 0.0])
+
+    def test_item_vl_sistema_tem_precedencia_sobre_percentual(self):
+        df = calcular_cobranca(
+            [linha_mov(cd_item=7, valor=10.0, quantidade=3)],
+            item_percentual={'id': {7: 0.5}},
+            item_vl_sistema={'id': {7: 12.0}},
+        )
+        self.assertEqual(df['unit_eff'].iloc[0], 12.0)
+        self.assertEqual(df['cobrar'].iloc[0], 36.0)
+        self.assertEqual(df['perc_display'].iloc[0], 0.0)
+
+    def test_item_sem_vl_sistema_aplica_percentual_fracao_ou_inteiro(self):
+        df = calcular_cobranca(
+            [linha_mov(cd_item=1, valor=10.0, quantidade=2), linha_mov(cd_item=2, valor=10.0, quantidade=2)],
+            item_percentual={'id': {1: 0.2, 2: 20}},
+        )
+        self.assertEqual([round(v, 2) for v in df['unit_eff']], [12.0, 12.0])
+        self.assertEqual([round(v, 2) for v in df['cobrar']], [24.0, 24.0])
+        self.assertEqual([round(v, 2) for v in df['perc_display']], [20.0, 20.0])
+
+    def test_busca_do_item_por_id_depois_codigo_depois_nome(self):
+        mapas = {'id': {5: 30.0}, 'codigo': {'5': 20.0, '6': 0.0}, 'nome': {'FILTRO': 10.0, 'OLEO': 15.0}}
+        df = calcular_cobranca([
+            linha_mov(cd_item=5, nm_item='FILTRO'),
+            linha_mov(cd_item='X6', nm_item='OLEO'),
+            linha_mov(cd_item='6', nm_item='filtro'),
+        ], item_vl_sistema=mapas)
+        self.assertEqual(list(df['unit_eff']), [30.0, 15.0, 10.0])
+
+    def test_remove_lancamentos_e_filtra_status(self):
+        linhas = [
+            linha_mov(nm_tipo_servico='Lançamento', valor=5.0),
+            linha_mov(cd_item=1, valor=5.0, status='fechado'),
+            linha_mov(cd_item=2, valor=5.0, status='aberto'),
+        ]
+        self.assertEqual(len(calcular_cobranca(linhas)), 2)
+        abertos = calcular_cobranca(linhas, status_filter='aberto')
+        self.assertEqual(list(abertos['cd_item']), [2])
+
+    def test_sem_coluna_status_usa_itens_ja_fechados(self):
+        df = calcular_cobranca(
+            [linha_mov(cd_item=1, status=None, ordem_servico=9), linha_mov(cd_item=2, status=None, ordem_servico=9)],
+            fechados_item={(9, 1, DIA, 'ABC1234')},
+        )
+        self.assertEqual(list(df['status_item']), ['fechado', 'aberto'])
+
+
+class VencimentosTests(SimpleTestCase):
+
+    def test_dividir_ajuste_de_centavos_na_ultima(self):
+        self.assertEqual(vencimentos.dividir(100.0, 3), [33.33, 33.33, 33.34])
+        self.assertEqual(vencimentos.dividir(10.0, 4), [2.5, 2.5, 2.5, 2.5])
+        self.assertAlmostEqual(sum(vencimentos.dividir(0.05, 3)), 0.05)
+
+    def test_dividir_parcela_invalida_vira_uma(self):
+        self.assertEqual(vencimentos.dividir(12.5, 0), [12.5])
+        self.assertEqual(vencimentos.dividir(10.0, None), [10.0])
+
+    def test_cronograma_soma_por_data_e_periodo(self):
+        por_data = vencimentos.cronograma(DIA, [(100.0, 3, 'S'), (50.0, 2, 'Q'), (10.0, 1, None)])
+        self.assertEqual(por_data, {
+            DIA: 33.33 + 25.0 + 10.0,
+            DIA + timedelta(days=7): 33.33,
+            DIA + timedelta(days=14): 33.34 + 25.0,
+        })
+
+    def test_cronograma_mensal_a_cada_28_dias(self):
+        por_data = vencimentos.cronograma(DIA, [(90.0, 3, 'm')])
+        self.assertEqual(sorted(por_data), [DIA, DIA + timedelta(days=28), DIA + timedelta(days=56)])
+        self.assertEqual(por_data[DIA + timedelta(days=56)], 30.0)
+
+
+class TotaisFechamentoTests(TestCase):
+    """consolidacao.totais_fechamento: a regra compartilhada pela grade, detalhes e PDF."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = criar_usuario('totais')
+        cls.v1 = criar_veiculo(1, 'AAA1111', 'AGREGADO A')
+        cls.v2 = criar_veiculo(2, 'AAA1111', 'AGREGADO A')
+        cls.v3 = criar_veiculo(3, 'BBB2222', 'AGREGADO B')
+        categoria = OpeCategoria.objects.create(nome='DIVERSOS')
+        for veiculo, valor, natureza in ((cls.v1, 30.0, 'R'), (cls.v2, 50.0, 'D'), (cls.v3, 5.0, 'd')):
+            Lancamento.objects.create(
+                veiculo=veiculo, categoria=categoria, data=DIA, valor=valor, natureza=natureza, usuario=cls.usuario,
+            )
+        # A: cabeçalho do dia com vencimentos (um deles em outro dia)
+        cr = ContasReceber.objects.create(
+            placa=cls.v1, data_fechamento=DIA, valor=300.0, criado_por=cls.usuario, atualizado_por=cls.usuario,
+        )
+        VencContasReceber.objects.create(contas_receber=cr, seq_vencimento=1, data_vencimento=DIA, valor=200.0)
+        VencContasReceber.objects.create(
+            contas_receber=cr, seq_vencimento=2, data_vencimento=DIA + timedelta(days=7), valor=100.0,
+        )
+        # B: cabeçalho do dia sem vencimento
+        cp = ContasPagar.objects.create(
+            placa=cls.v3, data_fechamento=DIA, valor=80.0, criado_por=cls.usuario, atualizado_por=cls.usuario,
+        )
+        VencContasPagar.objects.create(contas_pagar=cp, seq_vencimento=1, data_vencimento=DIA - timedelta(days=7), valor=80.0)
+
+    def test_base_vencimento_com_lancamentos_pela_natureza(self):
+        totais = totais_por_placa(DIA)
+        self.assertEqual(set(totais), {'AAA1111', 'BBB2222'})
+        a, b = totais['AAA1111'], totais['BBB2222']
+        self.assertEqual((a['total_receber'], a['total_pagar'], a['lancamentos']), (200.0, 0.0, -20.0))
+        self.assertEqual(a['total_final'], 0.0 - 200.0 - 20.0)
+        # sem vencimento no dia: vale o cabeçalho
+        self.assertEqual((b['total_receber'], b['total_pagar'], b['lancamentos']), (0.0, 80.0, -5.0))
+        self.assertEqual(b['total_final'], 75.0)
+
+    def test_base_fechamento_soma_vencimentos_do_cabecalho(self):
+        a = totais_por_placa(DIA, base='fechamento')['AAA1111']
+        self.assertEqual(a['total_receber'], 300.0)
+
+    def test_filtro_por_veiculo_traz_a_placa_e_placa_desconhecida_zera(self):
+        linhas = totais_fechamento(DIA, [self.v3.id_veiculo])
+        self.assertEqual([r['placa'] for r in linhas], ['BBB2222'])
+        self.assertEqual(totais_fechamento(DIA, []), [])
+        self.assertEqual(resumo_totais(totais_fechamento(DIA, [])), {
+            'total_receber': 0.0, 'total_pagar': 0.0, 'lancamentos': 0.0, 'total_final': 0.0,
+        })
+
+    def test_valor_lancamento_com_sinal(self):
+        self.assertEqual(valor_lancamento('R', 10), 10.0)
+        self.assertEqual(valor_lancamento(' receita ', 10), 10.0)
+        self.assertEqual(valor_lancamento('D', 10), -10.0)
+        self.assertEqual(valor_lancamento(None, None), 0.0)
+
+    def test_prestacao_usa_os_mesmos_totais_e_linhas_com_sinal(self):
+        docs = montar_docs(DIA.isoformat(), ['AAA1111', 'ZZZ9999'])
+        a, desconhecida = docs
+        self.assertEqual(sorted(l['valor'] for l in a['lanc']), [-50.0, 30.0])
+        self.assertEqual(a['totais']['sLN'], sum(l['valor'] for l in a['lanc']))
+        fechamento = totais_por_placa(DIA, base='fechamento')['AAA1111']
+        self.assertEqual(a['totais']['totalGeral'], fechamento['total_final'])
+        self.assertEqual(desconhecida['totais'], {'sCR': 0.0, 'sCP': 0.0, 'sLN': 0.0, 'totalGeral': 0.0})
+
+
+class SnapshotFechamentoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = criar_usuario('snapshot')
+        cls.v1 = criar_veiculo(1, 'AAA1111')
+        cls.v2 = criar_veiculo(2, 'AAA1111')
+        cls.v3 = criar_veiculo(3, 'BBB2222')
+        cls.categoria = OpeCategoria.objects.create(nome='DIVERSOS')
+        for veiculo in (cls.v1, cls.v2, cls.v3):
+            cls.lancar(veiculo, 10.0)
+
+    @classmethod
+    def lancar(cls, veiculo, valor):
+        return Lancamento.objects.create(
+            veiculo=veiculo, categoria=cls.categoria, data=DIA, valor=valor, natureza='R', usuario=cls.usuario,
+        )
+
+    def por_placa(self):
+        return {r['placa']: r['lancamentos'] for r in snapshot.linhas_do_dia(DIA)}
+
+    def test_dia_sem_montagem_fica_com_o_calculo_na_hora(self):
+        self.assertIsNone(snapshot.linhas_do_dia(DIA))
+
+    def test_montagem_completa_marca_o_dia(self):
+        self.assertEqual(snapshot.atualizar_dia(DIA), 2)
+        self.assertTrue(snapshot.dia_completo(DIA))
+        self.assertEqual(self.por_placa(), {'AAA1111': 20.0, 'BBB2222': 10.0})
+
+    def test_incremental_em_dia_incompleto_monta_todas_as_placas(self):
+        snapshot.atualizar_dia(DIA, [self.v3.id_veiculo])
+        self.assertTrue(snapshot.dia_completo(DIA))
+        self.assertEqual(self.por_placa(), {'AAA1111': 20.0, 'BBB2222': 10.0})
+
+    def test_incremental_recalcula_a_placa_inteira(self):
+        snapshot.atualizar_dia(DIA)
+        self.lancar(self.v2, 5.0)
+        snapshot.atualizar_dia(DIA, [self.v2.id_veiculo])
+        # os dois veículos da placa entram no total, não só o alterado
+        self.assertEqual(self.por_placa(), {'AAA1111': 25.0, 'BBB2222': 10.0})
+
+    def test_placa_sem_valores_sai_do_snapshot(self):
+        snapshot.atualizar_dia(DIA)
+        Lancamento.objects.filter(veiculo=self.v3).delete()
+        snapshot.atualizar_dia(DIA, [self.v3.id_veiculo])
+        self.assertEqual(self.por_placa(), {'AAA1111': 20.0})
+        self.assertEqual(snapshot.linhas_do_dia(DIA, [self.v1.id_veiculo])[0]['placa'], 'AAA1111')
+
+    def test_apos_cadastros_acerta_agregado_e_troca_de_placa(self):
+        snapshot.atualizar_dia(DIA)
+        antes = snapshot.veiculos_e_placas()
+        # sp_cadastros: agregado renomeado e veículo 2 passa para a outra placa
+        Agregado.objects.filter(placa='AAA1111').update(nm_agregado='NOVO NOME')
+        Veiculo.objects.filter(id_veiculo=self.v2.id_veiculo).update(placa='BBB2222')
+        self.assertEqual(snapshot.apos_cadastros(antes), (1, 1))
+        self.assertEqual(self.por_placa(), {'AAA1111': 10.0, 'BBB2222': 20.0})
+        nomes = {r['placa']: r['agregado'] for r in snapshot.linhas_do_dia(DIA)}
+        self.assertEqual(nomes['AAA1111'], 'NOVO NOME')
+
+    def test_apos_cadastros_sem_mudancas_nao_remonta(self):
+        snapshot.atualizar_dia(DIA)
+        self.assertEqual(snapshot.apos_cadastros(snapshot.veiculos_e_placas()), (0, 0))
+
+
+class PrestacaoContasPdfTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dono = criar_usuario('dono')
+        cls.outro = criar_usuario('outro')
+        cls.staff = criar_usuario('staff')
+        cls.staff.is_staff = True
+        cls.staff.save()
+        cls.tarefa = fila_pdf.enfileirar(DIA.isoformat(), ['AAA1111'], cls.dono)
+
+    def test_enfileirar_exige_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.dono)
+        resp = client.post(
+            reverse('operacional:prestacao_contas_pdf'),
+            data=json.dumps({'data_fechamento': DIA.isoformat(), 'placas': ['AAA1111']}),
+            content_type='application/json',
+        )
+        self.assertEqual(resp.status_code, 403)
+
+    def test_status_e_download_so_do_dono_ou_staff(self):
+        urls = [
+            reverse('operacional:prestacao_contas_pdf_status', args=[self.tarefa.id]),
+            reverse('operacional:prestacao_contas_pdf_download', args=[self.tarefa.id]),
+        ]
+        self.client.force_login(self.outro)
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 404)
+        for usuario in (self.dono, self.staff):
+            self.client.force_login(usuario)
+            self.assertEqual(self.client.get(urls[0]).status_code, 200)
+            # ainda pendente: existe, mas o arquivo não está pronto
+            self.assertEqual(self.client.get(urls[1]).status_code, 409)
+
+    def test_limpeza_remove_fragmentos_de_dias_anteriores(self):
+        with tempfile.TemporaryDirectory() as pasta, mock.patch.object(prestacao, 'FRAGMENTOS_DIR', pasta):
+            antigo, atual = os.path.join(pasta, 'AAA1111_a.pdf'), os.path.join(pasta, 'AAA1111_b.pdf')
+            for path in (antigo, atual):
+                open(path, 'wb').close()
+            ontem = (timezone.now() - timedelta(days=1)).timestamp()
+            os.utime(antigo, (ontem, ontem))
+            fila_pdf.limpar()
+            self.assertEqual(os.listdir(pasta), ['AAA1111_b.pdf'])
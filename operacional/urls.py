@@ -9,6 +9,8 @@ urlpatterns = [
     path('itens/', views.ItensListView.as_view(), name='itens'),
     path('abastecimento/', views.AbastecimentoListView.as_view(), name='abastecimento'),
     path('servicos-movimentos/', views.ServicosMovimentosListView.as_view(), name='servicos_movimentos'),
+    # Itens de uma placa/tipo (carregados ao expandir)
+    path('servicos-movimentos/itens/', views.servicos_movimentos_itens, name='servicos_movimentos_itens'),
     # Fechamento de caixa (serviços movimentos)
     path('servicos-movimentos/fechamento/check/', views.check_fechamento, name='check_fechamento'),
     path('servicos-movimentos/fechamento/fechar/', views.fechar_caixa, name='fechar_caixa'),
@@ -44,6 +46,8 @@ urlpatterns = [
     # Prestação de Contas (Movimentos)
     path('prestacao-contas/', views.PrestacaoContasView.as_view(), name='prestacao_contas'),
     path('prestacao-contas/pdf/', views.prestacao_contas_pdf, name='prestacao_contas_pdf'),
+    path('prestacao-contas/pdf/<int:tarefa_id>/', views.prestacao_contas_pdf_status, name='prestacao_contas_pdf_status'),
+    path('prestacao-contas/pdf/<int:tarefa_id>/download/', views.prestacao_contas_pdf_download, name='prestacao_contas_pdf_download'),
     path('fechamentos/<int:fechamento_id>/itens/', views.get_fechamento_itens, name='fechamento_itens'),
     path('fechamentos/<int:fechamento_id>/excluir/', views.excluir_fechamento, name='excluir_fechamento'),
     path('fechamentos/<int:fechamento_id>/alterar-data/', views.alterar_data_fechamento, name='alterar_data_fechamento'),
@@ -0,0 +1,95 @@
+"""
+Cronograma de vencimentos (parcelas) de Contas a Receber / Contas a Pagar.
+
+Regra (a mesma que estava copiada em fechar_caixa, gerar_contas_a_pagar e nas
+exclusões de item): cada item é dividido em `parcela` partes iguais (ajuste de
+centavos na última), vencendo a cada 7/14/28 dias (período S/Q/M) a partir da
+data de fechamento do cabeçalho; os valores são somados por data de vencimento.
+
+Em vez de apagar e recriar os vencimentos um a um, regenerar() compara o
+cronograma com as linhas existentes e aplica só a diferença com
+bulk_update/bulk_create (e um único delete para as sobras).
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import ContasPagar, VencContasPagar, VencContasReceber
+
+
+PERIODO_DIAS = {'S': 7, 'Q': 14, 'M': 28}
+
+
+def dividir(valor, n_parc):
+    """Divide o valor em n_parc parcelas de 2 casas, com o ajuste na última."""
+    n_parc = max(int(n_parc or 1), 1)
+    if n_parc == 1:
+        return [round(valor, 2)]
+    base = round(valor / n_parc, 2)
+    partes = [base] * (n_parc - 1)
+    partes.append(round(valor - sum(partes), 2))
+    return partes
+
+
+def cronograma(data_fechamento, itens):
+    """
+    itens: iterável de (valor, parcela, periodo). Retorna {data_vencimento: valor}
+    em uma única passada.
+    """
+    por_data = {}
+    for valor, parcela, periodo in itens:
+        delta = PERIODO_DIAS.get(str(periodo or 'S').upper(), 7)
+        for idx, parte in enumerate(dividir(float(valor or 0.0), parcela)):
+            due = data_fechamento + timedelta(days=delta * idx)
+            por_data[due] = float(por_data.get(due, 0.0) + parte)
+    return por_data
+
+
+def cronograma_itens(data_fechamento, itens_qs, campo_valor):
+    """Cronograma a partir de um queryset de itens (lê só valor/parcela/periodo)."""
+    return cronograma(data_fechamento, itens_qs.values_list(campo_valor, 'parcela', 'periodo'))
+
+
+def _modelo_vencimento(cab):
+    if isinstance(cab, ContasPagar):
+        return VencContasPagar, 'contas_pagar'
+    return VencContasReceber, 'contas_receber'
+
+
+def regenerar(cab, por_data):
+    """
+    Deixa os vencimentos do cabeçalho iguais ao cronograma `por_data`
+    ({data: valor}), numerados por data (seq 1..n) e sem fechamento vinculado.
+    Retorna (criados, atualizados, removidos).
+    """
+    modelo, fk = _modelo_vencimento(cab)
+    existentes = {}
+    sobras = []
+    for v in modelo.objects.filter(**{fk: cab}).order_by('seq_vencimento', 'id'):
+        if v.data_vencimento in existentes:
+            sobras.append(v.id)
+        else:
+            existentes[v.data_vencimento] = v
+
+    agora = timezone.now()
+    novos, alterados = [], []
+    for seq, due_date in enumerate(sorted(por_data.keys()), start=1):
+        valor = round(por_data[due_date], 2)
+        v = existentes.pop(due_date, None)
+        if v is None:
+            novos.append(modelo(**{fk: cab}, fechamento=None, seq_vencimento=seq, data_vencimento=due_date, valor=valor))
+        elif v.seq_vencimento != seq or v.valor != valor or v.fechamento_id is not None:
+            v.seq_vencimento = seq
+            v.valor = valor
+            v.fechamento = None
+            v.dt_atualizacao = agora
+            alterados.append(v)
+    sobras.extend(v.id for v in existentes.values())
+
+    if sobras:
+        modelo.objects.filter(id__in=sobras).delete()
+    if alterados:
+        modelo.objects.bulk_update(alterados, ['seq_vencimento', 'valor', 'fechamento', 'dt_atualizacao'])
+    if novos:
+        modelo.objects.bulk_create(novos)
+    return len(novos), len(alterados), len(sobras)
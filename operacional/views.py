@@ -3,29 +3,22 @@ from django.contrib.auth.decorators import login_required, permission_required
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.views.generic import ListView, TemplateView
-from django.db.models import Q, Sum, F
+from django.db.models import Q, Sum, F, Count, Exists, OuterRef, Subquery, IntegerField, Value
+from django.db.models.functions import Coalesce
 from django.db import models
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, FileResponse
+from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 import re
+import math
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_POST
 from django.db import connection, transaction
 from django.contrib import messages
 from django.template.loader import render_to_string
-from django.contrib.staticfiles.storage import staticfiles_storage
-from io import BytesIO
-from PIL import Image  # type: ignore
-import base64
-import tempfile
-from pathlib import Path
 import os
-try:
-    from xhtml2pdf import pisa  # type: ignore
-except Exception:
-    pisa = None
-from .models import Veiculo, Servico, Item, Abastecimento, Atualizações, Lancamento, OpeCategoria, Fechamento, ContasReceber, ItensContasReceber, ItensContasPagar, VencContasReceber, VencContasPagar, tipo_periodo
+from .models import Veiculo, Servico, Item, Abastecimento, Atualizações, Lancamento, OpeCategoria, Fechamento, ContasReceber, ItensContasReceber, ItensContasPagar, VencContasReceber, VencContasPagar, tipo_periodo, TarefaPdf
 
 # Aliases para nomes de modelos que podem variar
 try:
@@ -56,12 +49,33 @@ except Exception:
             from .models import ItensContasAReceber as ItensFechamento  # type: ignore
         except Exception:
             pass
+
+def _nome_fk(modelo, modelo_destino):
+    """Nome do FK de `modelo` para `modelo_destino` (None se não houver)."""
+    if modelo is None or modelo_destino is None:
+        return None
+    for f in modelo._meta.get_fields():
+        if isinstance(f, models.ForeignKey) and f.related_model == modelo_destino:
+            return f.name
+    return None
+
+
+# FK dos itens de contas a pagar para o cabeçalho, resolvido uma vez no import
+ITENS_CAP_FK = _nome_fk(ItensContasAPagarModel, ContasAPagarModel)
+
 from datetime import date, timedelta, datetime  
-from django.db import IntegrityError
+from django.db import DatabaseError
 import json
 from django.utils import timezone
 from django.contrib.auth.models import User
 from .forms import LancamentoForm
+from .precificacao import calcular_cobranca, agrupar_hierarquia, STATUS_FECHADO, STATUS_ABERTO
+from .colunas import mapa_colunas, invalidar as invalidar_colunas, VW_MOVIMENTACOES, VW_CARTA_FRETE
+from .consolidacao import totais_fechamento, resumo_totais, valor_lancamento
+from . import snapshot
+from . import vencimentos
+from . import frete
+from . import fila_pdf
 # Create your views here.
 
 class VeiculosListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
@@ -775,6 +789,8 @@ class AtualizarDadosView(LoginRequiredMixin, PermissionRequiredMixin, TemplateVi
         """
         # Executar procedure de cadastros
         try:
+            # placas dos veículos antes da procedure (para acertar o snapshot de fechamento)
+            veiculos_antes = snapshot.veiculos_e_placas()
             # Usar autocommit para evitar problemas de transação
             with connection.cursor() as cursor:
                 # Garantir autocommit
@@ -790,6 +806,12 @@ class AtualizarDadosView(LoginRequiredMixin, PermissionRequiredMixin, TemplateVi
                 
         except Exception as e1:
             messages.error(request, f'Erro na atualização de cadastros: {str(e1)}')
+        else:
+            # nomes de agregado e placas dos veículos podem ter mudado
+            try:
+                snapshot.apos_cadastros(veiculos_antes)
+            except Exception as e:
+                messages.warning(request, f'Cadastros atualizados, mas o resumo da gestão de fechamento não foi recalculado: {e}')
         
         # Executar procedure de abastecimentos
         try:
@@ -808,6 +830,9 @@ class AtualizarDadosView(LoginRequiredMixin, PermissionRequiredMixin, TemplateVi
                 
         except Exception as e2:
             messages.error(request, f'Erro na atualização de abastecimentos: {str(e2)}')
+
+        # As procedures podem recriar as views: descartar o mapa de colunas em cache
+        invalidar_colunas()
             
         return self.get(request, *args, **kwargs)
     
@@ -842,55 +867,198 @@ class ServicosMovimentosListView(LoginRequiredMixin, PermissionRequiredMixin, Li
     template_name = 'operacional/servicos_movimentos.html'
     permission_required = 'operacional.acessar_operacional'
     context_object_name = 'servicos'
-    paginate_by = None
+    # Paginação por placa: a página traz só o resumo (placa/tipo) e os itens
+    # são carregados sob demanda em servicos_movimentos_itens
+    paginate_by = 20
 
-    def get_queryset(self):
-        """
-        Busca dados diretamente da view VW_MOVIMENTACOES aplicando filtros opcionais.
-        Retorna uma lista de dicts compatível com o template.
-        """
+    def _tem_filtro(self):
+        return any((self.request.GET.get(k) or '').strip() for k in ('placa', 'agregado', 'data_inicio', 'data_fim'))
+
+    def _status_item_filtro(self):
+        status_item_filtro = (self.request.GET.get('status_item') or '').strip().lower()
+        return status_item_filtro if status_item_filtro in ('aberto', 'fechado') else ''
+
+    def _where_movimentos(self, cmap, placas=None, tipo=None):
+        """Filtros da tela (placa, agregado, período) + placas/tipo exatos quando informados."""
         placa_filtro = self.request.GET.get('placa', '').strip()
         agregado_filtro = self.request.GET.get('agregado', '').strip()
         data_inicio = self.request.GET.get('data_inicio', '').strip()
         data_fim = self.request.GET.get('data_fim', '').strip()
+        plate_col = cmap['plate_col']
+        agregado_col = cmap['agregado_col']
+        date_col = cmap['date_col']
+        type_col = cmap['type_col']
+        where = []
+        params = []
+
+        if placa_filtro and plate_col:
+            where.append(f"{plate_col} LIKE %s")
+            params.append(f"%{placa_filtro}%")
+
+        if agregado_filtro and agregado_col:
+            where.append(f"{agregado_col} LIKE %s")
+            params.append(f"%{agregado_filtro}%")
+
+        if data_inicio and date_col:
+            where.append(f"{date_col} >= %s")
+            params.append(data_inicio)
+
+        if data_fim and date_col:
+            try:
+                fim = datetime.strptime(data_fim, '%Y-%m-%d').date() + timedelta(days=1)
+                where.append(f"{date_col} < %s")
+                params.append(fim)
+            except ValueError:
+                where.append(f"CAST({date_col} AS DATE) <= %s")
+                params.append(data_fim)
+
+        if placas is not None and plate_col:
+            placas_txt = [p for p in placas if p != 'SEM PLACA']
+            cond = []
+            if placas_txt:
+                cond.append(f"LTRIM(RTRIM({plate_col})) IN (" + ", ".join(["%s"] * len(placas_txt)) + ")")
+                params.extend(placas_txt)
+            if 'SEM PLACA' in placas:
+                cond.append(f"({plate_col} IS NULL OR LTRIM(RTRIM({plate_col})) = '')")
+            where.append("(" + " OR ".join(cond or ["1 = 0"]) + ")")
+
+        if tipo is not None and type_col:
+            if tipo == 'SEM TIPO':
+                where.append(f"({type_col} IS NULL OR LTRIM(RTRIM({type_col})) = '')")
+            else:
+                where.append(f"LTRIM(RTRIM({type_col})) = %s")
+                params.append(tipo)
+
+        return where, params
 
+    def _fechado_sql(self, cmap):
+        """
+        Expressão SQL (1/0) de item fechado, com a mesma regra do calcular_cobranca:
+        coluna status da view e, quando ela não vem (ou traz outro valor), item já
+        lançado em ItensFechamento com mesma ordem, data, placa e código do serviço
+        (tipos "serviço") ou do item (demais tipos).
+        """
+        q = connection.ops.quote_name
+        status_col = cmap['status_col']
+        plate_col, date_col, os_col, type_col = cmap['plate_col'], cmap['date_col'], cmap['os_col'], cmap['type_col']
+        code_col, item_code_col = cmap['code_col'], cmap['item_code_col']
+
+        legado = "0"
+        if plate_col and date_col and os_col and (code_col or item_code_col):
+            itens, cab, veic = ItensFechamento._meta, ContasReceber._meta, Veiculo._meta
+            col = lambda meta, campo: q(meta.get_field(campo).column)
+            # dentro do EXISTS as colunas da view precisam do nome da view (a tabela
+            # de itens tem colunas com os mesmos nomes: CDSERVICO, CDITEM, DATA...)
+            vw = lambda c: f"{VW_MOVIMENTACOES}.{c}" if c else c
+            plate_col, date_col, os_col, type_col = vw(plate_col), vw(date_col), vw(os_col), vw(type_col)
+            code_col, item_code_col = vw(code_col), vw(item_code_col)
+            servico = f"LOWER({type_col}) LIKE '%%servi_o%%'" if type_col else "1 = 0"
+            codigos = []
+            if code_col:
+                codigos.append(f"({servico} AND {code_col} IS NOT NULL AND {code_col} <> 0 AND i.{col(itens, 'cdServico')} = {code_col})")
+            if item_code_col:
+                codigos.append(f"(NOT ({servico}) AND {item_code_col} IS NOT NULL AND {item_code_col} <> 0 AND i.{col(itens, 'cdItem')} = {item_code_col})")
+            legado = (
+                f"CASE WHEN EXISTS (SELECT 1 FROM {q(itens.db_table)} i"
+                f" JOIN {q(cab.db_table)} c ON c.{q(cab.pk.column)} = i.{col(itens, 'contas_receber')}"
+                f" JOIN {q(veic.db_table)} v ON v.{q(veic.pk.column)} = c.{col(cab, 'placa')}"
+                f" WHERE i.{col(itens, 'ordemServico')} = {os_col}"
+                f" AND CAST(i.{col(itens, 'data')} AS DATE) = CAST({date_col} AS DATE)"
+                f" AND v.{col(veic, 'placa')} = LTRIM(RTRIM({plate_col}))"
+                f" AND ({' OR '.join(codigos)})) THEN 1 ELSE 0 END"
+            )
+        if not status_col:
+            return legado
+        status = f"LOWER(LTRIM(RTRIM({status_col})))"
+        lista = lambda valores: ', '.join(f"'{v}'" for v in valores)
+        return (
+            f"CASE WHEN {status} IN ({lista(STATUS_FECHADO)}) THEN 1"
+            f" WHEN {status} IN ({lista(STATUS_ABERTO)}) THEN 0"
+            f" ELSE {legado} END"
+        )
+
+    def get_queryset(self):
+        """
+        Resumo por placa/tipo calculado no banco (GROUP BY). É essa lista que é
+        paginada; cobrar/status das placas da página vêm do get_context_data.
+        """
         # Não carregar dados inicialmente: exigir ao menos um filtro
-        if not any([placa_filtro, agregado_filtro, data_inicio, data_fim]):
+        if not self._tem_filtro():
+            return []
+
+        cmap = mapa_colunas(VW_MOVIMENTACOES)
+        plate_col = cmap['plate_col']
+        type_col = cmap['type_col']
+        if not plate_col:
             return []
+        tipo_expr = f"LTRIM(RTRIM({type_col}))" if type_col else "''"
+        if cmap['total_col']:
+            total_expr = f"COALESCE({cmap['total_col']}, 0)"
+        elif cmap['value_col'] and cmap['qty_col']:
+            total_expr = f"COALESCE({cmap['value_col']}, 0) * COALESCE(NULLIF({cmap['qty_col']}, 0), 1)"
+        else:
+            total_expr = "0"
+        fechado_expr = self._fechado_sql(cmap)
 
-        # Descobrir nomes reais das colunas da view
+        where, params = self._where_movimentos(cmap)
+        if type_col:
+            # Ocultar completamente o tipo "lançamento"
+            where.append(f"({type_col} IS NULL OR {type_col} NOT LIKE '%%lan_amento%%')")
+        status_filter = self._status_item_filtro()
+        if status_filter:
+            where.append(f"{fechado_expr} = %s")
+            params.append(1 if status_filter == 'fechado' else 0)
+
+        sql = [
+            f"SELECT LTRIM(RTRIM({plate_col})) AS placa, {tipo_expr} AS tipo, COUNT(*) AS qtd,",
+            f"       SUM({total_expr}) AS total, SUM({fechado_expr}) AS fechados",
+            "FROM VW_MOVIMENTACOES",
+        ]
+        if where:
+            sql.append("WHERE " + " AND ".join(where))
+        sql.append(f"GROUP BY LTRIM(RTRIM({plate_col})), {tipo_expr}")
+
+        resumo = {}
         with connection.cursor() as cursor:
-            cursor.execute("SELECT TOP 1 * FROM VW_MOVIMENTACOES")
-            all_cols = [c[0] for c in cursor.description]
-
-        cols_lower = {c.lower(): c for c in all_cols}
-
-        def find_col(candidates, fallback_contains=None):
-            # tenta casar por nomes conhecidos
-            for cand in candidates:
-                if cand in cols_lower:
-                    return cols_lower[cand]
-            # fallback: tenta por substring no nome da coluna
-            if fallback_contains:
-                for k_lower, orig in cols_lower.items():
-                    if fallback_contains in k_lower:
-                        return orig
-            return None
-
-        code_col = find_col(['cdservico', 'cd_servico', 'codigo', 'codigo_servico', 'cdserv', 'idservico'], fallback_contains='servico')
-        name_col = find_col(['nmservico', 'nm_servico', 'nome_servico', 'servico', 'descricao', 'descricao_servico'], fallback_contains='serv')
-        type_col = find_col(['nmtiposervico', 'nm_tipo_servico', 'tipo_servico', 'tipo', 'categoria', 'nmtipo'], fallback_contains='tipo')
-        value_col = find_col(['valor', 'vl_servico', 'vlr', 'vl', 'preco', 'preco_servico'], fallback_contains='valor')
-        plate_col = find_col(['placa', 'nrplaca', 'nr_placa', 'placa_principal', 'placa1'], fallback_contains='placa')
-        agregado_col = find_col(['agregado', 'nmagregado', 'nm_agregado', 'agregado_nome', 'nome_agregado'], fallback_contains='agreg')
-        date_col = find_col(['data', 'dtmov', 'dt_mov', 'dtservico', 'dt_servico', 'dtmovimento', 'data_mov', 'dt_emissao', 'dtemissao'], fallback_contains='data')
-        os_col = find_col(['cdorderservico', 'orderservico', 'ordemservico', 'cdordemservico', 'cd_os', 'os'], fallback_contains='servico')
-        qty_col = find_col(['qtde', 'quantidade', 'qtd'], fallback_contains='qt')
-        total_col = find_col(['total', 'vl_total', 'vltotal'], fallback_contains='total')
-        item_code_col = find_col(['cditem', 'cd_item', 'codigo_item'], fallback_contains='item')
-        item_name_col = find_col(['nmitem', 'nm_item', 'nome_item', 'descricao_item'], fallback_contains='item')
-        status_col = find_col(['status', 'st'], fallback_contains='status')
-        unit_col = find_col(['unidade', 'unid', 'und', 'un'])
+            cursor.execute("\n".join(sql), params)
+            for placa, tipo, qtd, total, fechados in cursor.fetchall():
+                placa = placa or 'SEM PLACA'
+                tipo = tipo or 'SEM TIPO'
+                g = resumo.setdefault(placa, {'placa': placa, 'qtd': 0, 'fechados': 0, 'total_placa': 0.0, 'tipos': {}})
+                t = g['tipos'].setdefault(tipo, {'tipo': tipo, 'qtd': 0, 'fechados': 0, 'total_tipo': 0.0})
+                t['qtd'] += qtd or 0
+                t['fechados'] += fechados or 0
+                t['total_tipo'] += float(total or 0)
+                g['qtd'] += qtd or 0
+                g['fechados'] += fechados or 0
+                g['total_placa'] += float(total or 0)
+        return [resumo[k] for k in sorted(resumo.keys())]
+
+    def _carregar_movimentos(self, placas=None, tipo=None):
+        """
+        Busca as linhas da view VW_MOVIMENTACOES aplicando os filtros da tela,
+        opcionalmente restritas a algumas placas/tipo.
+        Retorna uma lista de dicts compatível com o _agrupar_hierarquia.
+        """
+        if not self._tem_filtro():
+            return []
+
+        # Nomes reais das colunas da view (mapa em cache, ver operacional/colunas.py)
+        cmap = mapa_colunas(VW_MOVIMENTACOES)
+        code_col = cmap['code_col']
+        name_col = cmap['name_col']
+        type_col = cmap['type_col']
+        value_col = cmap['value_col']
+        plate_col = cmap['plate_col']
+        agregado_col = cmap['agregado_col']
+        date_col = cmap['date_col']
+        os_col = cmap['os_col']
+        qty_col = cmap['qty_col']
+        total_col = cmap['total_col']
+        item_code_col = cmap['item_code_col']
+        item_name_col = cmap['item_name_col']
+        status_col = cmap['status_col']
+        unit_col = cmap['unit_col']
 
         select_parts = []
         if code_col: select_parts.append(f"{code_col} AS code_col")
@@ -934,25 +1102,7 @@ class ServicosMovimentosListView(LoginRequiredMixin, PermissionRequiredMixin, Li
                 "       QTDE AS qty_col, VALOR AS value_col, TOTAL AS total_col",
                 "FROM VW_MOVIMENTACOES",
             ]
-        where = []
-        params = []
-
-
-        if placa_filtro and plate_col:
-            where.append(f"{plate_col} LIKE %s")
-            params.append(f"%{placa_filtro}%")
-
-        if agregado_filtro and agregado_col:
-            where.append(f"{agregado_col} LIKE %s")
-            params.append(f"%{agregado_filtro}%")
-
-        if data_inicio and date_col:
-            where.append(f"CAST({date_col} AS DATE) >= %s")
-            params.append(data_inicio)
-
-        if data_fim and date_col:
-            where.append(f"CAST({date_col} AS DATE) <= %s")
-            params.append(data_fim)
+        where, params = self._where_movimentos(cmap, placas=placas, tipo=tipo)
 
         if where:
             sql.append("WHERE " + " AND ".join(where))
@@ -965,8 +1115,6 @@ class ServicosMovimentosListView(LoginRequiredMixin, PermissionRequiredMixin, Li
         rows = []
         with connection.cursor() as cursor:
             cursor.execute("\n".join(sql), params)
-            print(sql)
-            print(params)
             cols = [col[0].lower() for col in cursor.description]
             for r in cursor.fetchall():
                 row = dict(zip(cols, r))
@@ -990,7 +1138,6 @@ class ServicosMovimentosListView(LoginRequiredMixin, PermissionRequiredMixin, Li
         return rows
 
     def _agrupar_hierarquia(self, rows, data_inicio=None, data_fim=None, status_filter=None):
-        grupos = {}
         # Coleta códigos/ids para minimizar queries
         service_codes = set()
         item_ids = set()
@@ -1074,240 +1221,60 @@ class ServicosMovimentosListView(LoginRequiredMixin, PermissionRequiredMixin, Li
             closed_by_item.add((it['ordemServico'], it.get('cdItem'), date_only, plate_txt))
             closed_by_serv.add((it['ordemServico'], it.get('cdServico'), date_only, plate_txt))
 
-        for r in rows:
-            placa = (r.get('placa') or '').strip() if r.get('placa') else 'SEM PLACA'
-            tipo_raw = (r.get('nm_tipo_servico') or '').strip() if r.get('nm_tipo_servico') else ''
-            tipo_norm = tipo_raw.lower().replace('ç','c').replace('õ','o').replace('ó','o').replace('á','a').replace('é','e').replace('í','i').replace('ú','u').replace('â','a').replace('ê','e').replace('ô','o')
-            # Ocultar completamente o tipo "lançamento"
-            if 'lancamento' in tipo_norm:
-                continue
-            tipo = tipo_raw if tipo_raw else 'SEM TIPO'
-            total_item = r.get('total') if r.get('total') is not None else ((r.get('valor') or 0) * (r.get('quantidade') or 1))
-            # Calcula "cobrar" com chaves normalizadas
-            cobrar_val = 0.0
-            cd_servico_row = r.get('cd_servico')
-            cd_item_row = r.get('cd_item')
-            # normalizar chaves para int quando possível
-            def to_int_safe(v):
-                try:
-                    return int(v)
-                except Exception:
-                    return None
-            cd_servico_key = to_int_safe(cd_servico_row) if cd_servico_row is not None else None
-            cd_item_key = to_int_safe(cd_item_row) if cd_item_row is not None else None
-            is_servico = 'servic' in tipo_norm  # somente quando o tipo indicar serviço
-            if is_servico:
-                # Serviço: usar valor do modelo; fallback para TOTAL do item
-                base_val = servico_code_to_valor.get(cd_servico_key) if cd_servico_key is not None else None
-                cobrar_val = float(base_val or 0)
-                if cobrar_val == 0:
-                    cobrar_val = float(total_item or 0)
-                perc_display = 0.0  # para serviços não aplicar percentual por padrão
-            else:
-                # Demais tipos:
-                # Regra de prioridade (unitário):
-                # 1) Se houver vl_sistema (>0), usar vl_sistema (unitário)
-                # 2) Caso contrário, usar (valor unitário "Vl Frota") + percentual do item aplicado sobre o unitário
-                # Em ambos os casos, "cobrar" = unitário efetivo * quantidade
-                # Buscar vl_sistema por id, código ou nome
-                vl_sistema_lookup = 0
-                if cd_item_key is not None and cd_item_key in item_id_to_vl_sistema:
-                    vl_sistema_lookup = item_id_to_vl_sistema.get(cd_item_key) or 0
-                else:
-                    cd_item_raw = r.get('cd_item')
-                    cd_item_str = str(cd_item_raw).strip() if cd_item_raw is not None else ''
-                    vl_sistema_lookup = item_code_to_vl_sistema.get(cd_item_str) or 0
-                    if not vl_sistema_lookup:
-                        nm_item_raw = r.get('nm_item')
-                        nm_item_key = str(nm_item_raw).strip().upper() if nm_item_raw else ''
-                        vl_sistema_lookup = item_name_to_vl_sistema.get(nm_item_key) or 0
-                try:
-                    vl_sistema_f = float(vl_sistema_lookup or 0)
-                except Exception:
-                    vl_sistema_f = 0.0
-                # Percentual do item
-                perc_lookup = 0
-                if cd_item_key is not None and cd_item_key in item_id_to_percent:
-                    perc_lookup = item_id_to_percent.get(cd_item_key) or 0
-                else:
-                    # tentar por código como string
-                    cd_item_raw = r.get('cd_item')
-                    cd_item_str = str(cd_item_raw).strip() if cd_item_raw is not None else ''
-                    perc_lookup = item_code_to_percent.get(cd_item_str) or 0
-                    if not perc_lookup:
-                        # fallback por nome do item
-                        nm_item_raw = r.get('nm_item')
-                        nm_item_key = str(nm_item_raw).strip().upper() if nm_item_raw else ''
-                        perc_lookup = item_name_to_percent.get(nm_item_key) or 0
-                try:
-                    perc_f = float(perc_lookup or 0)
-                except Exception:
-                    perc_f = 0.0
-                fator = perc_f if perc_f <= 1 else (perc_f / 100.0)
-                unit_frota = 0.0
-                try:
-                    unit_frota = float(r.get('valor') or 0)
-                except Exception:
-                    unit_frota = 0.0
-                qty_f = 0.0
-                try:
-                    qty_f = float(r.get('quantidade') or 0)
-                except Exception:
-                    qty_f = 0.0
-                # Determinar unitário efetivo para "Vl Sistema"
-                if vl_sistema_f > 0:
-                    unit_eff = vl_sistema_f
-                    perc_display = 0.0  # para exibição
-                else:
-                    unit_eff = unit_frota * (1 + (fator if fator else 0.0))
-                    perc_display = perc_f if perc_f > 1 else (perc_f * 100.0)
-                cobrar_val = unit_eff * qty_f
-
-            if placa not in grupos:
-                grupos[placa] = { 'placa': placa, 'total_placa': 0, 'cobrar_placa': 0, 'tipos': {}, 'status_placa': 'all_open' }
-
-            if tipo not in grupos[placa]['tipos']:
-                grupos[placa]['tipos'][tipo] = { 'tipo': tipo, 'total_tipo': 0, 'cobrar_tipo': 0, 'itens': [], 'has_open': False, 'has_closed': False, 'status_tipo': 'all_open' }
-
-            # Determinar status do item fechado/aberto baseado APENAS no campo 'status' quando disponível
-            status_raw = (r.get('status') or '').strip().lower() if r.get('status') else ''
-            if status_raw in ('fechado', 'closed', '1', 'true'):
-                item_fechado = True
-            elif status_raw in ('aberto', 'open', '0', 'false'):
-                item_fechado = False
-            else:
-                # fallback legacy (se status não vier na view)
-                data_val = r.get('data')
-                data_only = data_val.date() if hasattr(data_val,'date') else data_val
-                os_val = r.get('ordem_servico')
-                cd_item_val = r.get('cd_item')
-                cd_serv_val = r.get('cd_servico')
-                is_servico = 'servic' in tipo_norm
-                if is_servico:
-                    item_fechado = bool(cd_serv_val) and ((os_val, cd_serv_val, data_only, placa) in closed_by_serv)
-                else:
-                    item_fechado = bool(cd_item_val) and ((os_val, cd_item_val, data_only, placa) in closed_by_item)
-
-            item_status_str = 'fechado' if item_fechado else 'aberto'
-            # Aplicar filtro de status, se solicitado
-            if status_filter in ('aberto', 'fechado') and item_status_str != status_filter:
-                continue
-
-            grupos[placa]['tipos'][tipo]['itens'].append({
-                'data': r.get('data'),
-                'ordem_servico': r.get('ordem_servico'),
-                'cd_item': r.get('cd_item'),
-                'nm_item': r.get('nm_item'),
-                'quantidade': r.get('quantidade') or 0,
-                'valor': r.get('valor') or 0,
-                'total': total_item or 0,
-                'perc': perc_display if 'perc_display' in locals() else 0.0,
-                # "Vl Sistema" unitário efetivo (vl_sistema se >0, senão unitário + percentual do item)
-                'vl_sistema': unit_eff if 'unit_eff' in locals() else (vl_sistema_f if 'vl_sistema_f' in locals() else 0.0),
-                'cobrar': cobrar_val or 0,
-                'cd_servico': r.get('cd_servico'),
-                'nm_servico': r.get('nm_servico'),
-                'unidade': r.get('unidade') or '',
-                'status': item_status_str,
-            })
-
-            grupos[placa]['tipos'][tipo]['total_tipo'] += (total_item or 0)
-            grupos[placa]['tipos'][tipo]['cobrar_tipo'] += (cobrar_val or 0)
-            grupos[placa]['total_placa'] += (total_item or 0)
-            grupos[placa]['cobrar_placa'] += (cobrar_val or 0)
-
-            # Atualiza status agregador do tipo e da placa
-            if item_fechado:
-                grupos[placa]['tipos'][tipo]['has_closed'] = True
-            else:
-                grupos[placa]['tipos'][tipo]['has_open'] = True
-            if 'has_closed' not in grupos[placa]:
-                grupos[placa]['has_closed'] = False
-                grupos[placa]['has_open'] = False
-            if item_fechado:
-                grupos[placa]['has_closed'] = True
-            else:
-                grupos[placa]['has_open'] = True
-
-        # converter para listas ordenadas e definir status_placa, removendo tipos/placas sem itens
-        lista = []
-        for placa_key in sorted(grupos.keys()):
-            tipo_list = []
-            for tipo_key in sorted(grupos[placa_key]['tipos'].keys()):
-                t = grupos[placa_key]['tipos'][tipo_key]
-                # descarta tipos sem itens
-                if not t['itens']:
-                    continue
-                if t['has_open'] and t['has_closed']:
-                    t['status_tipo'] = 'mixed'
-                elif t['has_closed'] and not t['has_open']:
-                    t['status_tipo'] = 'all_closed'
-                else:
-                    t['status_tipo'] = 'all_open'
-                tipo_list.append(t)
-
-            # pular placas sem tipos válidos
-            if not tipo_list:
-                continue
-
-            # status por placa baseado nos itens agregados
-            has_open = grupos[placa_key].get('has_open', False)
-            has_closed = grupos[placa_key].get('has_closed', False)
-            if has_open and has_closed:
-                placa_status = 'mixed'
-            elif has_closed and not has_open:
-                placa_status = 'all_closed'
-            else:
-                placa_status = 'all_open'
-
-            lista.append({
-                'placa': grupos[placa_key]['placa'],
-                'total_placa': grupos[placa_key]['total_placa'],
-                'cobrar_placa': grupos[placa_key].get('cobrar_placa', 0),
-                'status_placa': placa_status,
-                'tipos': tipo_list,
-            })
-        return lista
+        # Regras de preço/status calculadas em lote (ver operacional/precificacao.py)
+        df_cobranca = calcular_cobranca(
+            rows,
+            servico_valor=servico_code_to_valor,
+            item_percentual={'id': item_id_to_percent, 'codigo': item_code_to_percent, 'nome': item_name_to_percent},
+            item_vl_sistema={'id': item_id_to_vl_sistema, 'codigo': item_code_to_vl_sistema, 'nome': item_name_to_vl_sistema},
+            fechados_item=closed_by_item,
+            fechados_servico=closed_by_serv,
+            status_filter=status_filter,
+        )
+        return agrupar_hierarquia(df_cobranca)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         # Valores distintos para filtro de tipo vindos da view (descoberta de coluna dinâmica)
         tipos_servico_disponiveis = []
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT TOP 1 * FROM VW_MOVIMENTACOES")
-            all_cols = [c[0] for c in cursor.description]
-        cols_lower = {c.lower(): c for c in all_cols}
-        for cand in ['nmtiposervico', 'nm_tipo_servico', 'tipo_servico', 'tipo', 'categoria', 'nmtipo']:
-            if cand in cols_lower:
-                type_col = cols_lower[cand]
-                break
-        else:
-            type_col = None
+        type_col = mapa_colunas(VW_MOVIMENTACOES)['type_col']
 
         if type_col:
             with connection.cursor() as cursor:
                 cursor.execute(f"SELECT DISTINCT {type_col} FROM VW_MOVIMENTACOES WHERE {type_col} IS NOT NULL AND {type_col} <> '' ORDER BY {type_col}")
                 tipos_servico_disponiveis = [row[0] for row in cursor.fetchall()]
 
-        # Preparar grupos e métricas para cards
-        rows_ctx = self.get_queryset()
-        status_item_filtro = (self.request.GET.get('status_item') or '').strip().lower()
-        if status_item_filtro not in ('aberto', 'fechado'):
-            status_item_filtro = ''
-        grupos_ctx = self._agrupar_hierarquia(rows_ctx, data_inicio=self.request.GET.get('data_inicio', ''), data_fim=self.request.GET.get('data_fim', ''), status_filter=status_item_filtro)
-        # métricas
-        total_placas = len(grupos_ctx)
-        placas_fechadas = sum(1 for g in grupos_ctx if g.get('status_placa') == 'all_closed')
+        # Resumo completo (todas as placas) e página atual
+        resumo = context['paginator'].object_list if context.get('paginator') else context['object_list']
+        pagina = list(context['object_list'])
+        status_item_filtro = self._status_item_filtro()
+
+        # cobrar/status apenas das placas da página; os itens ficam para o carregamento sob demanda
+        rows_ctx = self._carregar_movimentos(placas=[g['placa'] for g in pagina]) if pagina else []
+        calculados = {
+            g['placa']: g for g in self._agrupar_hierarquia(
+                rows_ctx, data_inicio=self.request.GET.get('data_inicio', ''),
+                data_fim=self.request.GET.get('data_fim', ''), status_filter=status_item_filtro,
+            )
+        }
+        grupos_ctx = []
+        for resumo_placa in pagina:
+            g = calculados.get(resumo_placa['placa'])
+            if not g:
+                continue
+            for t in g['tipos']:
+                t['qtd_itens'] = len(t['itens'])
+                t['itens'] = []
+            grupos_ctx.append(g)
+
+        # métricas (sobre todas as placas do filtro, a partir do resumo do banco; o
+        # "fechado" do SQL segue a mesma regra do calcular_cobranca, ver _fechado_sql)
+        total_placas = len(resumo)
+        placas_fechadas = sum(1 for g in resumo if g['qtd'] and g['fechados'] >= g['qtd'])
         placas_abertas = total_placas - placas_fechadas
-
-        total_itens = 0
-        itens_fechados = 0
-        for g in grupos_ctx:
-            for t in g.get('tipos', []):
-                itens = t.get('itens', [])
-                total_itens += len(itens)
-                itens_fechados += sum(1 for it in itens if it.get('status') == 'fechado')
+        total_itens = sum(g['qtd'] for g in resumo)
+        itens_fechados = sum(g['fechados'] for g in resumo)
         itens_abertos = max(total_itens - itens_fechados, 0)
 
         context.update({
@@ -1319,7 +1286,7 @@ class ServicosMovimentosListView(LoginRequiredMixin, PermissionRequiredMixin, Li
             'data_inicio': self.request.GET.get('data_inicio', ''),
             'data_fim': self.request.GET.get('data_fim', ''),
             'tipos_servico_disponiveis': tipos_servico_disponiveis,
-            'total_servicos': len(rows_ctx),
+            'total_servicos': total_itens,
             'grupos': grupos_ctx,
             'status_item_filtro': status_item_filtro,
             # métricas para cards
@@ -1338,6 +1305,47 @@ class ServicosMovimentosListView(LoginRequiredMixin, PermissionRequiredMixin, Li
         return context
 
 
+@login_required
+@permission_required('operacional.acessar_operacional', raise_exception=True)
+@require_GET
+def servicos_movimentos_itens(request):
+    """
+    Itens de uma placa/tipo da tela de Serviços Movimentos (carregados ao expandir o tipo).
+    Usa os mesmos filtros da tela (placa, agregado, data_inicio, data_fim, status_item) e
+    devolve as linhas já renderizadas no mesmo formato da tabela.
+    Parâmetros: placa_grupo, tipo, p (índice da placa na página), t (índice do tipo).
+    """
+    placa = (request.GET.get('placa_grupo') or '').strip()
+    tipo = (request.GET.get('tipo') or '').strip()
+    if not placa or not tipo:
+        return JsonResponse({'success': False, 'error': 'Informe placa e tipo.'}, status=400)
+    try:
+        view = ServicosMovimentosListView()
+        view.setup(request)
+        rows = view._carregar_movimentos(placas=[placa], tipo=tipo)
+        grupos = view._agrupar_hierarquia(
+            rows, data_inicio=request.GET.get('data_inicio', ''), data_fim=request.GET.get('data_fim', ''),
+            status_filter=view._status_item_filtro(),
+        )
+        itens = []
+        for g in grupos:
+            for t in g['tipos']:
+                if t['tipo'] == tipo:
+                    itens = t['itens']
+        html = render_to_string('operacional/partials/servicos_movimentos_itens.html', {
+            'itens': itens,
+            'tipo': tipo,
+            'p': request.GET.get('p', '0'),
+            't': request.GET.get('t', '0'),
+            'periodos_choices': tipo_periodo,
+            'periodo_selecionado': request.GET.get('periodo', 'S'),
+            'parcela_selecionada': request.GET.get('parcela', 1),
+        }, request=request)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+    return JsonResponse({'success': True, 'html': html, 'qtd': len(itens)})
+
+
 class FechamentosListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     """Gestão de fechamentos com filtros de placa e data de fechamento, tabela similar à de movimentações."""
     template_name = 'operacional/fechamentos.html'
@@ -1421,143 +1429,108 @@ class FechamentosListView(LoginRequiredMixin, PermissionRequiredMixin, ListView)
         return context
 
 
-class ContasAPagarListView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
-    template_name = 'operacional/contas_a_pagar.html'
-    permission_required = 'operacional.acessar_operacional'
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        di = (self.request.GET.get('data_inicio') or '').strip()
-        df = (self.request.GET.get('data_fim') or '').strip()
-        placa_f = (self.request.GET.get('placa') or '').strip()
-        contas_list = []
-        placas_disponiveis = []
-        if ContasAPagarModel is not None:
-            qs = ContasAPagarModel.objects.select_related('placa', 'placa__placa').all()
-            if di:
-                qs = qs.filter(data_fechamento__gte=di)
-            if df:
-                qs = qs.filter(data_fechamento__lte=df)
-            if placa_f:
-                try:
-                    qs = qs.filter(placa__placa__placa__iexact=placa_f)
-                except Exception:
-                    # fallback em caso de diferente caminho de FK
-                    qs = qs.filter(placa__placa__iexact=placa_f)
-            qs = qs.order_by('-data_fechamento')
-            # Descobrir nome do FK nos itens CAP (robusto a variações)
-            fk_field_name = None
-            try:
-                if ItensContasAPagarModel is not None:
-                    for f in ItensContasAPagarModel._meta.get_fields():
-                        try:
-                            if isinstance(f, models.ForeignKey) and f.related_model == ContasAPagarModel:
-                                fk_field_name = f.name
-                                break
-                        except Exception:
-                            continue
-            except Exception:
-                fk_field_name = None
-            for cab in qs:
-                try:
-                    if fk_field_name and ItensContasAPagarModel is not None:
-                        qtd_itens = ItensContasAPagarModel.objects.filter(**{fk_field_name: cab}).count()
-                    else:
-                        qtd_itens = 0
-                except Exception:
-                    qtd_itens = 0
-                try:
-                    qtd_venc = VencContasPagar.objects.filter(contas_pagar=cab).count()
-                    locked = VencContasPagar.objects.filter(contas_pagar=cab, fechamento__isnull=False).exists()
-                except Exception:
-                    qtd_venc = 0
-                    locked = False
-                contas_list.append({
-                    'id': cab.id,
-                    'placa': cab.placa,
-                    'data_fechamento': cab.data_fechamento,
-                    'valor': getattr(cab, 'valor', 0.0),
-                    'qtd_itens': qtd_itens,
-                    'qtd_venc': qtd_venc,
-                    'locked': locked,
-                })
-            # placas disponíveis
-            try:
-                placas_disponiveis = list(
-                    ContasAPagarModel.objects.select_related('placa', 'placa__placa')
-                    .values_list('placa__placa__placa', flat=True)
-                    .distinct()
-                    .order_by('placa__placa__placa')
-                )
-            except Exception:
-                placas_disponiveis = []
-        context.update({
-            'contas': contas_list,
-            'placas_disponiveis': placas_disponiveis,
-            'placa_filtro': placa_f,
-            'data_inicio': di,
-            'data_fim': df,
-        })
-        return context
+def _contar_por(modelo, fk):
+    """Subquery com a quantidade de registros de `modelo` ligados ao cabeçalho (OuterRef pk)."""
+    sub = (
+        modelo.objects.filter(**{fk: OuterRef('pk')})
+        .order_by()
+        .values(fk)
+        .annotate(n=Count('pk'))
+        .values('n')[:1]
+    )
+    return Coalesce(Subquery(sub, output_field=IntegerField()), Value(0))
 
-class ContasAReceberListView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
-    template_name = 'operacional/contas_a_receber.html'
-    permission_required = 'operacional.acessar_operacional'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        di = (self.request.GET.get('data_inicio') or '').strip()
-        df = (self.request.GET.get('data_fim') or '').strip()
-        placa_f = (self.request.GET.get('placa') or '').strip()
-        qs = ContasReceber.objects.select_related('placa', 'placa__placa').all()
+def _anotar_contas(qs, itens_modelo, itens_fk, venc_modelo, venc_fk):
+    """
+    Anota qtd_itens, qtd_venc e locked (vencimento já vinculado a fechamento)
+    em uma única consulta, no lugar de count()/exists() por cabeçalho.
+    """
+    anotacoes = {
+        'qtd_venc': _contar_por(venc_modelo, venc_fk),
+        'locked': Exists(venc_modelo.objects.filter(**{venc_fk: OuterRef('pk'), 'fechamento__isnull': False})),
+    }
+    if itens_modelo is not None and itens_fk:
+        anotacoes['qtd_itens'] = _contar_por(itens_modelo, itens_fk)
+    else:
+        anotacoes['qtd_itens'] = Value(0, output_field=IntegerField())
+    return qs.annotate(**anotacoes)
+
+
+class _ContasListMixin:
+    """Filtros comuns (data de fechamento e placa) das listas de contas a pagar/receber."""
+    context_object_name = 'contas'
+    paginate_by = 50
+
+    def _filtros(self):
+        return (
+            (self.request.GET.get('data_inicio') or '').strip(),
+            (self.request.GET.get('data_fim') or '').strip(),
+            (self.request.GET.get('placa') or '').strip(),
+        )
+
+    def _filtrar(self, qs):
+        di, df, placa_f = self._filtros()
         if di:
             qs = qs.filter(data_fechamento__gte=di)
         if df:
             qs = qs.filter(data_fechamento__lte=df)
         if placa_f:
             qs = qs.filter(placa__placa__placa__iexact=placa_f)
-        qs = qs.order_by('-data_fechamento')
-        contas = []
-        for cab in qs:
-            try:
-                qtd_itens = ItensContasReceber.objects.filter(contas_receber=cab).count()
-            except Exception:
-                qtd_itens = 0
-            try:
-                qtd_venc = VencContasReceber.objects.filter(contas_receber=cab).count()
-            except Exception:
-                qtd_venc = 0
-            try:
-                locked = VencContasReceber.objects.filter(contas_receber=cab, fechamento__isnull=False).exists()
-            except Exception:
-                locked = False
-            contas.append({
-                'id': cab.id,
-                'placa': cab.placa,
-                'data_fechamento': cab.data_fechamento,
-                'valor': cab.valor,
-                'qtd_itens': qtd_itens,
-                'qtd_venc': qtd_venc,
-                'locked': locked,
-            })
-        # placas com contas a receber
+        return qs.order_by('-data_fechamento', '-id')
+
+    def _placas_disponiveis(self, modelo):
         try:
-            placas_disponiveis = list(
-                ContasReceber.objects.select_related('placa','placa__placa')
+            return list(
+                modelo.objects
                 .values_list('placa__placa__placa', flat=True)
                 .distinct()
                 .order_by('placa__placa__placa')
             )
         except Exception:
-            placas_disponiveis = []
+            return []
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        di, df, placa_f = self._filtros()
         context.update({
-            'contas': contas,
-            'placas_disponiveis': placas_disponiveis,
             'placa_filtro': placa_f,
             'data_inicio': di,
             'data_fim': df,
         })
         return context
 
+
+class ContasAPagarListView(LoginRequiredMixin, PermissionRequiredMixin, _ContasListMixin, ListView):
+    template_name = 'operacional/contas_a_pagar.html'
+    permission_required = 'operacional.acessar_operacional'
+
+    def get_queryset(self):
+        if ContasAPagarModel is None:
+            return []
+        qs = ContasAPagarModel.objects.select_related('placa', 'placa__placa')
+        qs = _anotar_contas(qs, ItensContasAPagarModel, ITENS_CAP_FK, VencContasPagar, 'contas_pagar')
+        return self._filtrar(qs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['placas_disponiveis'] = self._placas_disponiveis(ContasAPagarModel) if ContasAPagarModel is not None else []
+        return context
+
+class ContasAReceberListView(LoginRequiredMixin, PermissionRequiredMixin, _ContasListMixin, ListView):
+    template_name = 'operacional/contas_a_receber.html'
+    permission_required = 'operacional.acessar_operacional'
+
+    def get_queryset(self):
+        qs = ContasReceber.objects.select_related('placa', 'placa__placa')
+        qs = _anotar_contas(qs, ItensContasReceber, 'contas_receber', VencContasReceber, 'contas_receber')
+        return self._filtrar(qs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['placas_disponiveis'] = self._placas_disponiveis(ContasReceber)
+        return context
+
 @permission_required('operacional.acessar_operacional', raise_exception=True)
 @require_GET
 def contas_a_receber_itens(request, cr_id: int):
@@ -1618,10 +1591,12 @@ def contas_a_receber_excluir(request, cr_id: int):
     # Bloqueio por vínculo com fechamento
     if VencContasReceber.objects.filter(contas_receber=cab, fechamento__isnull=False).exists():
         return JsonResponse({'success': False, 'error': 'Não é possível excluir: existem vencimentos vinculados a fechamento.'}, status=400)
+    dias_snapshot = snapshot.dias_contas(cab)
     with transaction.atomic():
         VencContasReceber.objects.filter(contas_receber=cab).delete()
         ItensContasReceber.objects.filter(contas_receber=cab).delete()
         cab.delete()
+        snapshot.agendar_contas(cab, dias_snapshot)
     return JsonResponse({'success': True, 'message': 'Contas a Receber excluído com sucesso.'})
 
 @permission_required('operacional.acessar_operacional', raise_exception=True)
@@ -1637,6 +1612,7 @@ def contas_a_receber_excluir_item(request, item_id: int):
     # Bloqueio por vínculo com fechamento
     if VencContasReceber.objects.filter(contas_receber=cab, fechamento__isnull=False).exists():
         return JsonResponse({'success': False, 'error': 'Não é permitido excluir. Já existem vencimentos vinculados a fechamento.'}, status=400)
+    dias_snapshot = snapshot.dias_contas(cab)
     try:
         # Excluir item e recalcular total do cabeçalho e vencimentos
         with transaction.atomic():
@@ -1653,39 +1629,11 @@ def contas_a_receber_excluir_item(request, item_id: int):
             cab.save(update_fields=['valor', 'atualizado_por', 'dt_atualizacao'] if hasattr(cab, 'atualizado_por') else ['valor', 'dt_atualizacao'])
             # Recalcular vencimentos (mantém fechamento=None)
             try:
-                VencContasReceber.objects.filter(contas_receber=cab).delete()
-                period_days = {'S': 7, 'Q': 14, 'M': 28}
-                by_due_date = {}
-                items_qs = ItensContasReceber.objects.filter(contas_receber=cab)
-                for it in items_qs:
-                    n_parc = int(getattr(it, 'parcela', 1) or 1)
-                    per = str(getattr(it, 'periodo', 'S') or 'S').upper()
-                    delta = period_days.get(per, 7)
-                    valor_item = float(getattr(it, 'total', 0) or 0.0)
-                    if n_parc <= 0:
-                        n_parc = 1
-                    if n_parc == 1:
-                        shares = [round(valor_item, 2)]
-                    else:
-                        base = round(valor_item / n_parc, 2)
-                        shares = [base] * (n_parc - 1)
-                        last = round(valor_item - sum(shares), 2)
-                        shares.append(last)
-                    for idx in range(n_parc):
-                        due = cab.data_fechamento + timedelta(days=delta * idx)
-                        by_due_date[due] = float(by_due_date.get(due, 0.0) + shares[idx])
-                seq = 1
-                for due_date in sorted(by_due_date.keys()):
-                    VencContasReceber.objects.create(
-                        contas_receber=cab,
-                        fechamento=None,
-                        seq_vencimento=seq,
-                        data_vencimento=due_date,
-                        valor=round(by_due_date[due_date], 2),
-                    )
-                    seq += 1
+                vencimentos.regenerar(cab, vencimentos.cronograma_itens(
+                    cab.data_fechamento, ItensContasReceber.objects.filter(contas_receber=cab), 'total'))
             except Exception:
                 pass
+            snapshot.agendar_contas(cab, dias_snapshot)
     except Exception:
         return JsonResponse({'success': False, 'error': 'Falha ao excluir item.'}, status=500)
     # Retornar totais atualizados para a UI
@@ -1693,6 +1641,60 @@ def contas_a_receber_excluir_item(request, item_id: int):
     qtd_venc = VencContasReceber.objects.filter(contas_receber=cab).count()
     return JsonResponse({'success': True, 'total_cab': float(getattr(cab, 'valor', 0) or 0.0), 'qtd_itens': qtd_itens, 'qtd_venc': qtd_venc, 'cr_id': cab.id})
 
+class _IndicePlacas:
+    """
+    Índice da requisição para a gestão de fechamento: placa -> veículos/agregado
+    em uma única consulta e os fechamentos do dia por id_veiculo em outra,
+    no lugar de um Veiculo/Fechamento .filter() por placa.
+    """
+
+    def __init__(self, dia=None):
+        self.veiculos = {}   # PLACA -> [(id_veiculo, nm_agregado), ...]
+        self.placas = []     # placas como estão no cadastro (ordem do banco)
+        self.agregados = set()
+        rows = (
+            Veiculo.objects
+            .order_by('placa__placa', 'id_veiculo')
+            .values_list('id_veiculo', 'placa__placa', 'placa__nm_agregado')
+        )
+        for id_veiculo, placa, nm_agregado in rows:
+            chave = (placa or '').strip().upper()
+            if chave not in self.veiculos:
+                self.placas.append(placa)
+            self.veiculos.setdefault(chave, []).append((id_veiculo, nm_agregado or ''))
+            self.agregados.add(nm_agregado)
+
+        self.fechamentos = {}  # id_veiculo -> {'id', 'cod_ag'}
+        if dia:
+            inicio = datetime.combine(dia, datetime.min.time())
+            fech_qs = (
+                Fechamento.objects
+                .filter(data_fechamento__gte=inicio, data_fechamento__lt=inicio + timedelta(days=1))
+                .order_by('id')
+                .values('id', 'placa_id', 'cod_ag')
+            )
+            for f in fech_qs:
+                self.fechamentos.setdefault(f['placa_id'], f)
+
+    def veiculo(self, placa):
+        """(id_veiculo, nm_agregado) do primeiro veículo da placa, ou None."""
+        lista = self.veiculos.get((placa or '').strip().upper())
+        return lista[0] if lista else None
+
+    def ids_placa(self, placa):
+        return [v for v, _ in self.veiculos.get((placa or '').strip().upper(), [])]
+
+    def ids_agregado(self, texto):
+        texto = (texto or '').lower()
+        return [
+            v for lista in self.veiculos.values() for v, ag in lista
+            if texto in ag.lower()
+        ]
+
+    def fechamento(self, id_veiculo):
+        return self.fechamentos.get(id_veiculo)
+
+
 class GestaoFechamentoView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
     template_name = 'operacional/gestao_fechamento.html'
     permission_required = 'operacional.acessar_operacional'
@@ -1722,6 +1724,7 @@ class GestaoFechamentoView(LoginRequiredMixin, PermissionRequiredMixin, Template
 
         print('teste', 100*'*')
         rows = []
+        indice = None
         if data_str:
             print(data_str)
             dt = None
@@ -1732,159 +1735,36 @@ class GestaoFechamentoView(LoginRequiredMixin, PermissionRequiredMixin, Template
                 except Exception:
                     continue
             if dt:
-                # Totais por placa via vencimentos (Receber)
-                start_dt = dt
-                print(start_dt)
-                end_dt = dt + timedelta(days=1)
-                print(end_dt)
-                recv_qs = VencContasReceber.objects.filter(data_vencimento__gte=start_dt, data_vencimento__lt=end_dt)
-                if placa_f:
-                    veic_ids = list(Veiculo.objects.select_related('placa').filter(placa__placa__iexact=placa_f).values_list('id_veiculo', flat=True))
-                    if veic_ids:
-                        recv_qs = recv_qs.filter(contas_receber__placa__in=veic_ids)
-                if agregado_f:
-                    veic_ids_ag = list(Veiculo.objects.select_related('placa').filter(placa__nm_agregado__icontains=agregado_f).values_list('id_veiculo', flat=True))
-                    if veic_ids_ag:
-                        recv_qs = recv_qs.filter(contas_receber__placa__in=veic_ids_ag)
-                # Agrupar por placa (tentar caminho triplo e, se vazio, caminho duplo)
-                recv_by_plate = list(
-                    recv_qs
-                    .values('contas_receber__placa__placa')
-                    .annotate(total=models.Sum('valor'))
-                )
-                recv_map = {r['contas_receber__placa__placa']: float(r['total'] or 0) for r in recv_by_plate}
-                # Fallback por iteração com select_related (robusto para caminhos de FK)
-                if not recv_map:
-                    recv_map = {}
-                    recv_iter = VencContasReceber.objects.select_related('contas_receber', 'contas_receber__placa').filter(data_vencimento__gte=start_dt, data_vencimento__lt=end_dt)
-                    for v in recv_iter:
-                        try:
-                            plate_txt = (getattr(getattr(v.contas_receber, 'placa', None), 'placa', None) or '').strip()
-                        except Exception:
-                            plate_txt = ''
-                        if not plate_txt:
-                            continue
-                        if placa_f and plate_txt.lower() != placa_f.lower():
-                            continue
-                        recv_map[plate_txt] = float(recv_map.get(plate_txt, 0.0) + float(v.valor or 0.0))
-                # Fallback adicional: somar cabeçalhos CR pela mesma data_fechamento
-                cr_hdr = ContasReceber.objects.filter(data_fechamento=dt)
-                if placa_f:
-                    veic_ids = list(Veiculo.objects.select_related('placa').filter(placa__placa__iexact=placa_f).values_list('id_veiculo', flat=True))
-                    if veic_ids:
-                        cr_hdr = cr_hdr.filter(placa__in=veic_ids)
-                cr_hdr_by_plate = (
-                    cr_hdr
-                    .values('placa__placa__placa')
-                    .annotate(total=models.Sum('valor'))
-                )
-                for r in cr_hdr_by_plate:
-                    key = r['placa__placa__placa']
-                    # Usar cabeçalho apenas se não houver vencimentos para a placa (evita dupla contagem)
-                    if key not in recv_map or recv_map.get(key, 0.0) == 0.0:
-                        recv_map[key] = float(r['total'] or 0)
-
-                # Totais por placa via vencimentos (Pagar)
-                pagar_qs = VencContasPagar.objects.filter(data_vencimento__gte=start_dt, data_vencimento__lt=end_dt)
-                if placa_f:
-                    veic_ids = list(Veiculo.objects.select_related('placa').filter(placa__placa__iexact=placa_f).values_list('id_veiculo', flat=True))
-                    if veic_ids:
-                        pagar_qs = pagar_qs.filter(contas_pagar__placa__in=veic_ids)
-                if agregado_f:
-                    veic_ids_ag = list(Veiculo.objects.select_related('placa').filter(placa__nm_agregado__icontains=agregado_f).values_list('id_veiculo', flat=True))
-                    if veic_ids_ag:
-                        pagar_qs = pagar_qs.filter(contas_pagar__placa__in=veic_ids_ag)
-                pagar_by_plate = list(
-                    pagar_qs
-                    .values('contas_pagar__placa__placa')
-                    .annotate(total=models.Sum('valor'))
-                )
-                pagar_map = {r['contas_pagar__placa__placa']: float(r['total'] or 0) for r in pagar_by_plate}
-                # Fallback por iteração com select_related
-                if not pagar_map:
-                    pagar_map = {}
-                    pagar_iter = VencContasPagar.objects.select_related('contas_pagar', 'contas_pagar__placa').filter(data_vencimento__gte=start_dt, data_vencimento__lt=end_dt)
-                    for v in pagar_iter:
-                        try:
-                            plate_txt = (getattr(getattr(v.contas_pagar, 'placa', None), 'placa', None) or '').strip()
-                        except Exception:
-                            plate_txt = ''
-                        if not plate_txt:
-                            continue
-                        if placa_f and plate_txt.lower() != placa_f.lower():
-                            continue
-                        pagar_map[plate_txt] = float(pagar_map.get(plate_txt, 0.0) + float(v.valor or 0.0))
-                # Fallback adicional: somar cabeçalhos CP pela mesma data_fechamento
-                if ContasAPagarModel is not None:
-                    cp_hdr = ContasAPagarModel.objects.filter(data_fechamento=dt)
-                    if placa_f:
-                        veic_ids = list(Veiculo.objects.select_related('placa').filter(placa__placa__iexact=placa_f).values_list('id_veiculo', flat=True))
-                        if veic_ids:
-                            cp_hdr = cp_hdr.filter(placa__in=veic_ids)
-                    cp_hdr_by_plate = (
-                        cp_hdr
-                        .values('placa__placa__placa')
-                        .annotate(total=models.Sum('valor'))
-                    )
-                    for r in cp_hdr_by_plate:
-                        key = r['placa__placa__placa']
-                        # Usar cabeçalho apenas se não houver vencimentos para a placa (evita dupla contagem)
-                        if key not in pagar_map or pagar_map.get(key, 0.0) == 0.0:
-                            pagar_map[key] = float(r['total'] or 0)
-
-                # Lançamentos por placa na data (Receitas somam, Despesas subtraem)
-                lanc_qs = Lancamento.objects.select_related('veiculo', 'veiculo__placa').filter(data=dt)
-                if placa_f:
-                    veic_ids = list(Veiculo.objects.select_related('placa').filter(placa__placa__iexact=placa_f).values_list('id_veiculo', flat=True))
-                    if veic_ids:
-                        lanc_qs = lanc_qs.filter(veiculo__id_veiculo__in=veic_ids)
-                if agregado_f:
-                    veic_ids_ag = list(Veiculo.objects.select_related('placa').filter(placa__nm_agregado__icontains=agregado_f).values_list('id_veiculo', flat=True))
-                    if veic_ids_ag:
-                        lanc_qs = lanc_qs.filter(veiculo__id_veiculo__in=veic_ids_ag)
-                lanc_map = {}
-                for l in lanc_qs:
-                    try:
-                        ag = getattr(l.veiculo, 'placa', None)
-                        plate_txt = str(ag.placa) if ag and getattr(ag, 'placa', None) else ''
-                    except Exception:
-                        plate_txt = ''
-                    if not plate_txt:
+                indice = _IndicePlacas(dt)
+                veic_ids = indice.ids_placa(placa_f) if placa_f else []
+                veic_ids_ag = indice.ids_agregado(agregado_f) if agregado_f else []
+                # Totais por placa (Receber, Pagar e Lançamentos): snapshot materializado do dia
+                # (ope_fechamento_snapshot) ou, se o dia ainda não foi gerado, uma única consulta consolidada
+                filtros = [set(ids) for ids in (veic_ids, veic_ids_ag) if ids]
+                filtro_ids = sorted(set.intersection(*filtros)) if filtros else None
+                linhas = snapshot.linhas_do_dia(dt, filtro_ids)
+                if linhas is None:
+                    linhas = []
+                    for tot in totais_fechamento(dt, filtro_ids):
+                        veic = indice.veiculo(tot['placa'])
+                        fech = indice.fechamento(veic[0]) if veic else None
+                        linhas.append(dict(tot, fechamento_id=fech['id'] if fech else None, cod_ag=str((fech or {}).get('cod_ag') or '')))
+                for tot in linhas:
+                    plate = tot['placa']
+                    if placa_f and str(plate).strip().lower() != placa_f.lower():
+                        continue
+                    ag_nome_val = tot['agregado']
+                    if agregado_f and (ag_nome_val or '').lower().find(agregado_f.lower()) == -1:
+                        # placa não pertence ao agregado filtrado
                         continue
-                    nat = (getattr(l, 'natureza', '') or '').strip().upper()
-                    sign = 1.0 if nat in ('R', 'RECEITA', 'CREDITO', 'CREDIT') else -1.0
-                    lanc_map[plate_txt] = float(lanc_map.get(plate_txt, 0.0) + sign * float(getattr(l, 'valor', 0) or 0.0))
-
-                # Conjunto de placas envolvidas
-                all_plates = set(recv_map.keys()) | set(pagar_map.keys()) | set(lanc_map.keys())
-                if placa_f:
-                    all_plates = {p for p in all_plates if str(p).strip().lower() == placa_f.lower()}
-
-                for plate in sorted(all_plates):
-                    total_receber = float(recv_map.get(plate, 0.0))
-                    total_pagar = float(pagar_map.get(plate, 0.0))
-                    total_lanc = float(lanc_map.get(plate, 0.0))
+                    total_receber = tot['total_receber']
+                    total_pagar = tot['total_pagar']
+                    total_lanc = tot['lancamentos']
                     # Regra: TOTAL = Contas a Pagar - Contas a Receber + Lançamentos(± por natureza)
-                    total_final = total_pagar - total_receber + total_lanc
-                    # localizar fechamento (id e cod_ag) para a placa/data
-                    fech_id = None
-                    cod_ag_val = ''
-                    ag_nome_val = ''
-                    try:
-                        veic_row = Veiculo.objects.select_related('placa').filter(placa__placa__iexact=plate).first()
-                        if veic_row:
-                            ag_nome_val = str(getattr(getattr(veic_row, 'placa', None), 'nm_agregado', '') or '')
-                            if agregado_f and (ag_nome_val or '').lower().find(agregado_f.lower()) == -1:
-                                # placa não pertence ao agregado filtrado
-                                continue
-                            fech_dt_start = datetime.combine(dt, datetime.min.time())
-                            fech_dt_end = fech_dt_start + timedelta(days=1)
-                            fech = Fechamento.objects.filter(placa=veic_row, data_fechamento__gte=fech_dt_start, data_fechamento__lt=fech_dt_end).first()
-                            if fech:
-                                fech_id = fech.id
-                                cod_ag_val = str(getattr(fech, 'cod_ag', '') or '')
-                    except Exception:
-                        pass
+                    total_final = tot['total_final']
+                    # fechamento (id e cod_ag) da placa/data
+                    fech_id = tot['fechamento_id']
+                    cod_ag_val = tot['cod_ag']
                     rows.append({
                         'placa': plate,
                         'agregado': ag_nome_val,
@@ -1896,24 +1776,14 @@ class GestaoFechamentoView(LoginRequiredMixin, PermissionRequiredMixin, Template
                         'cod_ag': cod_ag_val,
                     })
 
-        # Placas disponíveis (todas cadastradas)
+        # Placas/agregados disponíveis (todos cadastrados), do mesmo índice
         try:
-            placas_disponiveis = list(
-                Veiculo.objects.select_related('placa')
-                .values_list('placa__placa', flat=True)
-                .distinct()
-                .order_by('placa__placa')
-            )
+            if indice is None:
+                indice = _IndicePlacas()
+            placas_disponiveis = list(indice.placas)
+            agregados_disponiveis = sorted(indice.agregados, key=lambda a: (a is None, a or ''))
         except Exception:
             placas_disponiveis = []
-        try:
-            agregados_disponiveis = list(
-                Veiculo.objects.select_related('placa')
-                .values_list('placa__nm_agregado', flat=True)
-                .distinct()
-                .order_by('placa__nm_agregado')
-            )
-        except Exception:
             agregados_disponiveis = []
 
         context.update({
@@ -2001,6 +1871,7 @@ def gestao_fechamento_criar(request):
         VencContasPagar.objects.filter(id__in=list(cp_qs.values_list('id', flat=True))).update(fechamento=fech)
         # Vincular Lançamentos do dia
         Lancamento.objects.filter(veiculo=veic, data=dt).update(fechamento=fech)
+        snapshot.agendar_fechamento(fech)
     return JsonResponse({'success': True, 'created': created, 'fechamento_id': fech.id})
 
 @permission_required('operacional.acessar_operacional', raise_exception=True)
@@ -2052,6 +1923,7 @@ def gestao_fechamento_excluir(request):
         ).update(fechamento=None)
         # Excluir o fechamento
         fech.delete()
+        snapshot.agendar_fechamento(fech)
     return JsonResponse({'success': True})
 
 @login_required
@@ -2104,6 +1976,7 @@ def gestao_fechamento_enviar_ag(request):
     try:
         cab.cod_ag = ag_code
         cab.save(update_fields=['cod_ag'])
+        snapshot.agendar_fechamento(cab)
     except Exception as e:
         return JsonResponse({'success': False, 'error': f'Falha ao marcar envio: {e}'}, status=500)
     return JsonResponse({'success': True, 'cod_ag': ag_code})
@@ -2194,6 +2067,7 @@ def gestao_fechamento_enviar_ag_grupo(request):
                 if not cur:
                     f.cod_ag = group_code
                     f.save(update_fields=['cod_ag'])
+                    snapshot.agendar_fechamento(f)
     except Exception as e:
         return JsonResponse({'success': False, 'error': f'Falha ao marcar envio em grupo: {e}'}, status=500)
     return JsonResponse({'success': True, 'cod_ag': group_code})
@@ -2300,7 +2174,8 @@ def gestao_fechamento_detalhes(request):
         lanc_rows.append({
             'data': l.data.strftime('%d/%m/%Y') if l.data else '',
             'categoria': getattr(l.categoria, 'nome', ''),
-            'valor': float(l.valor or 0),
+            'natureza': l.natureza or '',
+            'valor': valor_lancamento(l.natureza, l.valor),
             'placa': placa_txt,
             'obs': l.obs or '',
             'periodo': getattr(l, 'periodo', '') or '',
@@ -2359,6 +2234,11 @@ def gestao_fechamento_detalhes(request):
                 'periodo': it.periodo or '',
                 'parcela': it.parcela or 1,
             })
+    # Totais pela mesma consolidação da grade (vencimentos pela data de fechamento do cabeçalho)
+    try:
+        totais = resumo_totais(totais_fechamento(dt, veic_ids, base='fechamento'))
+    except Exception:
+        totais = None
     return JsonResponse({
         'success': True,
         'cr_venc': cr_rows,
@@ -2366,6 +2246,7 @@ def gestao_fechamento_detalhes(request):
         'lanc': lanc_rows,
         'cr_itens': cr_itens_rows,
         'cp_itens': cp_itens_rows,
+        'totais': totais,
     })
 
 @login_required
@@ -2486,6 +2367,7 @@ def contas_a_pagar_excluir(request, cap_id: int):
     # Bloqueio por vínculo com fechamento
     if VencContasPagar.objects.filter(contas_pagar=cab, fechamento__isnull=False).exists():
         return JsonResponse({'success': False, 'error': 'Não é possível excluir: existem vencimentos vinculados a fechamento.'}, status=400)
+    dias_snapshot = snapshot.dias_contas(cab)
     # Excluir em transação
     with transaction.atomic():
         # apagar vencimentos explicitamente (por clareza), itens e depois o cabeçalho (FKs são CASCADE)
@@ -2505,6 +2387,7 @@ def contas_a_pagar_excluir(request, cap_id: int):
         if fk_field_name:
             ItensContasAPagarModel.objects.filter(**{fk_field_name: cab}).delete()
         cab.delete()
+        snapshot.agendar_contas(cab, dias_snapshot)
     return JsonResponse({'success': True, 'message': 'Contas a Pagar excluído com sucesso.'})
 @login_required
 @permission_required('operacional.acessar_operacional', raise_exception=True)
@@ -2572,6 +2455,7 @@ def contas_a_pagar_excluir_item(request, item_id: int):
     # bloquear se houver vencimentos com fechamento
     if VencContasPagar.objects.filter(contas_pagar=cab, fechamento__isnull=False).exists():
         return JsonResponse({'success': False, 'error': 'Não é permitido excluir. Já existem vencimentos vinculados a fechamento.'}, status=400)
+    dias_snapshot = snapshot.dias_contas(cab)
     # excluir item, recalcular header e vencimentos
     with transaction.atomic():
         it.delete()
@@ -2601,6 +2485,7 @@ def contas_a_pagar_excluir_item(request, item_id: int):
                 pass
             cap_id = cab.id
             cab.delete()
+            snapshot.agendar_contas(cab, dias_snapshot)
             return JsonResponse({
                 'success': True,
                 'message': 'Item excluído e cabeçalho removido (sem itens restantes).',
@@ -2619,36 +2504,8 @@ def contas_a_pagar_excluir_item(request, item_id: int):
         cab.atualizado_por = request.user
         cab.save(update_fields=['valor', 'atualizado_por', 'dt_atualizacao'])
         # recalcular vencimentos
-        VencContasPagar.objects.filter(contas_pagar=cab).delete()
-        period_days = {'S': 7, 'Q': 14, 'M': 28}
-        by_due_date = {}
-        for it2 in items_qs:
-            n_parc = int(getattr(it2, 'parcela', 1) or 1)
-            per = str(getattr(it2, 'periodo', 'S') or 'S').upper()
-            delta = period_days.get(per, 7)
-            saldo_item = float(getattr(it2, 'saldo', 0) or 0.0)
-            if n_parc <= 0:
-                n_parc = 1
-            if n_parc == 1:
-                shares = [round(saldo_item, 2)]
-            else:
-                base = round(saldo_item / n_parc, 2)
-                shares = [base] * (n_parc - 1)
-                last = round(saldo_item - sum(shares), 2)
-                shares.append(last)
-            for idx in range(n_parc):
-                due = cab.data_fechamento + timedelta(days=delta * idx)
-                by_due_date[due] = float(by_due_date.get(due, 0.0) + shares[idx])
-        seq = 1
-        for due_date in sorted(by_due_date.keys()):
-            VencContasPagar.objects.create(
-                contas_pagar=cab,
-                fechamento=None,
-                seq_vencimento=seq,
-                data_vencimento=due_date,
-                valor=round(by_due_date[due_date], 2),
-            )
-            seq += 1
+        vencimentos.regenerar(cab, vencimentos.cronograma_itens(cab.data_fechamento, items_qs, 'saldo'))
+        snapshot.agendar_contas(cab, dias_snapshot)
     # preparar retorno com totais atualizados para atualização imediata da UI
     qtd_itens = 0
     try:
@@ -2679,155 +2536,27 @@ class CartaFreteListView(LoginRequiredMixin, PermissionRequiredMixin, TemplateVi
         df = (self.request.GET.get('data_fim') or '').strip()
 
         # Bloqueia consulta completa sem período: exige data início e fim
+        grupos = []
+        totais = {'valor': 0.0, 'adiantamento': 0.0, 'outros': 0.0, 'saldo': 0.0}
         if not di or not df:
             messages.info(self.request, 'Informe Data Início e Data Fim para consultar a Carta Frete.')
-            context.update({
-                'rows': [],
-                'rows_values': [],
-                'cols': [],
-                'grupos': [],
-                'placa_filtro': placa,
-                'status_filtro': status_f,
-                'data_inicio': di,
-                'data_fim': df,
-                'total_valor': 0.0,
-                'total_adiantamento': 0.0,
-                'total_outros': 0.0,
-                'total_saldo': 0.0,
-            })
-            return context
-
-        rows = []
-        cols = []
-        rows_values = []
-        grupos = []
-        total_valor = total_adiant = total_outros = total_saldo = 0.0
-
-        try:
-            where = []
-            params = []
-            if placa:
-                where.append('PLACA = %s')
-                params.append(placa)
-            if di:
-                where.append('CAST(DATA AS DATE) >= %s')
-                params.append(di)
-            if df:
-                where.append('CAST(DATA AS DATE) <= %s')
-                params.append(df)
-            # Não filtramos por STATUS aqui, pois o filtro desejado é pela coluna de situação (aberto/fechado),
-            # que pode ter nomes variados na view. Faremos o filtro após ler as colunas.
-
-            sql = ["SELECT * FROM VW_CARTA_FRETE"]
-            if where:
-                sql.append('WHERE ' + ' AND '.join(where))
-            sql.append('ORDER BY DATA ASC')
-            with connection.cursor() as cursor:
-                cursor.execute('\n'.join(sql), params)
-                cols = [c[0] for c in cursor.description]
-                for r in cursor.fetchall():
-                    d = dict(zip(cols, r))
-                    rows.append(d)
-
-            # localizar nomes das colunas
-            def pick_col(target_names):
-                lower_map = {c.lower(): c for c in cols}
-                for name in target_names:
-                    if name in lower_map:
-                        return lower_map[name]
-                for c in cols:
-                    cl = c.lower()
-                    for name in target_names:
-                        if name in cl:
-                            return c
-                return None
-
-            col_valor = pick_col(['valor', 'vl', 'vl_total'])
-            col_adiant = pick_col(['adiantamento', 'adiant', 'vl_adiantamento'])
-            col_outros = pick_col(['outros', 'vl_outros'])
-            col_saldo = pick_col(['saldo', 'vl_saldo'])
-            col_placa = pick_col(['placa', 'nrplaca', 'placa_principal'])
-            col_situacao = pick_col(['situacao', 'situação'])
-
-            # Aplicar filtro por situacao (aberto/fechado) se solicitado
-            if status_f and col_situacao:
-                wanted = (status_f or '').strip().upper()
-                rows = [d for d in rows if str(d.get(col_situacao) or '').strip().upper() == wanted]
-
-            by_placa = {}
-            for d in rows:
-                if col_valor: total_valor += float(d.get(col_valor) or 0)
-                if col_adiant: total_adiant += float(d.get(col_adiant) or 0)
-                if col_outros: total_outros += float(d.get(col_outros) or 0)
-                if col_saldo: total_saldo += float(d.get(col_saldo) or 0)
-                # agrupar por placa
-                placa_key = str(d.get(col_placa) or '').strip() if col_placa else '—'
-                g = by_placa.get(placa_key) or {'placa': placa_key, 'qtd': 0, 'valor': 0.0, 'adiantamento': 0.0, 'outros': 0.0, 'saldo': 0.0, 'has_open': False, 'has_closed': False}
-                g['qtd'] += 1
-                if col_valor: g['valor'] += float(d.get(col_valor) or 0)
-                if col_adiant: g['adiantamento'] += float(d.get(col_adiant) or 0)
-                if col_outros: g['outros'] += float(d.get(col_outros) or 0)
-                if col_saldo: g['saldo'] += float(d.get(col_saldo) or 0)
-                # status por linha, se houver coluna de situação
-                if col_situacao:
-                    sit_val = str(d.get(col_situacao) or '').strip()
-                    sit_norm = sit_val.upper()
-                    sit_norm_ascii = (
-                        sit_val
-                        .encode('ascii', 'ignore')
-                        .decode('ascii')
-                        .upper()
-                    )
-                    is_closed = (
-                        ('FECH' in sit_norm) or ('FECH' in sit_norm_ascii) or
-                        ('ENCERR' in sit_norm_ascii) or ('CLOS' in sit_norm) or
-                        sit_norm in ('FECHADO', 'F', 'CLOSED', 'C', '1', 'TRUE')
-                    )
-                    is_open = (
-                        ('ABER' in sit_norm) or ('OPEN' in sit_norm) or
-                        sit_norm in ('ABERTO', 'A', 'OPEN', 'O', '0', 'FALSE')
-                    )
-                    if is_closed:
-                        g['has_closed'] = True
-                    if is_open:
-                        g['has_open'] = True
-                by_placa[placa_key] = g
-            # construir matriz de valores na mesma ordem de cols para o template
-            rows_values = [[(row.get(c) if row.get(c) is not None else '') for c in cols] for row in rows]
-            grupos = []
-            for v in by_placa.values():
-                status_txt = ''
-                if v.get('has_open'):
-                    status_txt = 'ABERTO'
-                elif v.get('has_closed'):
-                    status_txt = 'FECHADO'
-                grupos.append({
-                    'placa': v['placa'],
-                    'qtd': v['qtd'],
-                    'valor': v['valor'],
-                    'adiantamento': v['adiantamento'],
-                    'outros': v['outros'],
-                    'saldo': v['saldo'],
-                    'status': status_txt,
-                })
-            grupos = sorted(grupos, key=lambda x: x['placa'])
-
-        except Exception as e:
-            messages.error(self.request, f'Erro ao carregar Carta Frete: {e}')
+        else:
+            try:
+                # totais e grupos por placa calculados no banco (sem trazer as linhas)
+                grupos, totais = frete.resumo(placa, di, df, status_f)
+            except Exception as e:
+                messages.error(self.request, f'Erro ao carregar Carta Frete: {e}')
 
         context.update({
-            'rows': rows,
-            'rows_values': rows_values,
-            'cols': cols,
             'grupos': grupos,
             'placa_filtro': placa,
             'status_filtro': status_f,
             'data_inicio': di,
             'data_fim': df,
-            'total_valor': total_valor,
-            'total_adiantamento': total_adiant,
-            'total_outros': total_outros,
-            'total_saldo': total_saldo,
+            'total_valor': totais['valor'],
+            'total_adiantamento': totais['adiantamento'],
+            'total_outros': totais['outros'],
+            'total_saldo': totais['saldo'],
         })
         return context
 
@@ -2948,6 +2677,7 @@ def mover_item_fechamento(request, item_id: int):
                     valor_total=0.0,
                     usuario=request.user,
                 )
+                snapshot.agendar_fechamento(cab_dest)
 
             # Atualizar totais de origem e destino
             valor_item = float(item.total or 0)
@@ -2985,6 +2715,7 @@ def excluir_fechamento(request, fechamento_id: int):
     with transaction.atomic():
         ItensFechamento.objects.filter(fechamento=cab).delete()
         cab.delete()
+        snapshot.agendar_fechamento(cab)
     return JsonResponse({'success': True, 'message': 'Fechamento excluído com sucesso.'})
 
 @login_required
@@ -3007,16 +2738,19 @@ def alterar_data_fechamento(request, fechamento_id: int):
     # Bloqueia alteração se já possuir cod_ag preenchido
     if getattr(cab, 'cod_ag', None) and str(cab.cod_ag).strip() != '':
         return JsonResponse({'success': False, 'error': 'Alteração bloqueada: fechamento já possui Cod AG.'}, status=403)
+    data_anterior = cab.data_fechamento
     cab.data_fechamento = dt
     cab.save(update_fields=['data_fechamento'])
+    snapshot.agendar([data_anterior, dt], [cab.placa_id])
     return JsonResponse({'success': True, 'message': 'Data de fechamento atualizada.'})
 
 @login_required
 @permission_required('operacional.acessar_operacional', raise_exception=True)
 @require_GET
 def carta_frete(request):
-    """Retorna dados agregados da view VW_CARTA_FRETE para exibir em modal.
-    Filtros obrigatórios: data_inicio, data_fim (yyyy-mm-dd). Opcional: placa.
+    """Retorna os itens da view VW_CARTA_FRETE para exibir em modal.
+    Filtros obrigatórios: data_inicio, data_fim (yyyy-mm-dd). Opcional: placa, status.
+    Formato compacto: cols (nomes) + rows (listas na mesma ordem) + chaves (empresa|codigo por linha).
     """
     placa = (request.GET.get('placa') or '').strip()
     di = (request.GET.get('data_inicio') or '').strip()
@@ -3024,93 +2758,88 @@ def carta_frete(request):
     status_f = (request.GET.get('status') or '').strip()
     if not di or not df:
         return JsonResponse({'success': False, 'error': 'Informe Data Início e Data Fim para consultar.'}, status=400)
-    rows = []
-    # totais específicos
-    total_valor = 0.0
-    total_adiant = 0.0
-    total_outros = 0.0
-    total_saldo = 0.0
-    colnames = {'valor': None, 'adiantamento': None, 'outros': None, 'saldo': None}
     try:
-        where = []
-        params = []
-        if placa:
-            where.append("PLACA = %s")
-            params.append(placa)
-        if di:
-            where.append("CAST(DATA AS DATE) >= %s")
-            params.append(di)
-        if df:
-            where.append("CAST(DATA AS DATE) <= %s")
-            params.append(df)
-        sql = ["SELECT * FROM VW_CARTA_FRETE"]
-        if where:
-            sql.append("WHERE "+" AND ".join(where))
-        with connection.cursor() as cursor:
-            cursor.execute("\n".join(sql), params)
-            cols = [c[0] for c in cursor.description]
-            for r in cursor.fetchall():
-                obj = dict(zip(cols, r))
-                rows.append(obj)
-        # detectar colunas por nome (case-insensitive)
-        def pick_col(target_names):
-            # tenta match exato first
-            lower_map = {c.lower(): c for c in cols}
-            for name in target_names:
-                if name in lower_map:
-                    return lower_map[name]
-            # tenta por contains
-            for c in cols:
-                cl = c.lower()
-                for name in target_names:
-                    if name in cl:
-                        return c
-            return None
-
-        col_valor = pick_col(['valor', 'vl', 'vl_total'])
-        col_adiant = pick_col(['adiantamento', 'adiant', 'vl_adiantamento'])
-        col_outros = pick_col(['outros', 'vl_outros'])
-        col_saldo = pick_col(['saldo', 'vl_saldo'])
-        # aplicar filtro por coluna 'situacao', se houver parâmetro status
-        col_situacao = pick_col(['situacao', 'situação'])
-        if status_f and col_situacao:
-            wanted = (status_f or '').strip().upper()
-            rows = [row for row in rows if str(row.get(col_situacao) or '').strip().upper() == wanted]
-
-        colnames = {
-            'valor': col_valor,
-            'adiantamento': col_adiant,
-            'outros': col_outros,
-            'saldo': col_saldo,
-        }
-        # somar valores
-        for row in rows:
-            try:
-                if col_valor:
-                    total_valor += float(row.get(col_valor) or 0)
-                if col_adiant:
-                    total_adiant += float(row.get(col_adiant) or 0)
-                if col_outros:
-                    total_outros += float(row.get(col_outros) or 0)
-                if col_saldo:
-                    total_saldo += float(row.get(col_saldo) or 0)
-            except Exception:
-                continue
+        cmap = mapa_colunas(VW_CARTA_FRETE)
+        cols = frete.colunas_modal()
+        rows = list(frete.iter_linhas(cols, placa, di, df, status_f))
+        # chave estável de cada linha (empresa|codigo), usada na seleção para gerar Contas a Pagar
+        i_emp = cols.index(cmap['empresa']) if cmap['empresa'] in cols else None
+        i_cod = cols.index(cmap['codigo']) if cmap['codigo'] in cols else None
+        chaves = [
+            frete.chave(r[i_emp] if i_emp is not None else '', r[i_cod] if i_cod is not None else '')
+            for r in rows
+        ]
+        _, totais = frete.resumo(placa, di, df, status_f)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
     return JsonResponse({
         'success': True,
+        'cols': cols,
         'rows': rows,
-        'totais': {
-            'valor': total_valor,
-            'adiantamento': total_adiant,
-            'outros': total_outros,
-            'saldo': total_saldo,
-        },
-        'colnames': colnames,
+        'chaves': chaves,
+        'totais': totais,
+        'colnames': {v: cmap[v] for v in frete.VALORES},
     })
 
 
+def _ajustar_item_cap(item):
+    """
+    Ajusta o item de Contas a Pagar aos tamanhos das colunas antes do insert em lote
+    (um valor fora do limite derrubaria o bulk_create inteiro com DataError).
+    Textos longos são cortados; código vazio ou maior que a coluna (chave única) não
+    tem como ser gravado e o item é recusado (retorna False).
+    """
+    for f in ItensContasAPagarModel._meta.concrete_fields:
+        if not isinstance(f, models.CharField) or not f.max_length:
+            continue
+        valor = getattr(item, f.attname)
+        if valor is None or len(valor) <= f.max_length:
+            continue
+        if f.unique:
+            return False
+        setattr(item, f.attname, valor[:f.max_length])
+    return bool(item.codigo)
+
+
+def _inserir_itens_cap(itens, fk_field_name, cab):
+    """
+    Insere os itens de Contas a Pagar em lote (bulk_create) e retorna os que foram gravados.
+    Duplicidades já foram filtradas por `codigo__in`; conflito aqui só acontece se outra
+    requisição gravou o mesmo código no meio tempo. Nesse caso:
+    - bancos com ignore_conflicts: o próprio bulk_create ignora; gravados = códigos que
+      aparecem depois do insert e não existiam antes
+    - demais (SQL Server): refaz item a item, com savepoint apenas nesse caminho
+    Qualquer outro erro do banco no lote (DataError etc.) também cai no item a item,
+    que descarta só a linha com problema.
+    """
+    if not itens:
+        return []
+    codigos = [o.codigo for o in itens]
+    try:
+        with transaction.atomic():
+            if connection.features.supports_ignore_conflicts:
+                antes = set(ItensContasAPagarModel.objects.filter(codigo__in=codigos).values_list('codigo', flat=True))
+                ItensContasAPagarModel.objects.bulk_create(itens, ignore_conflicts=True)
+                filtro = {'codigo__in': codigos}
+                if fk_field_name:
+                    filtro[fk_field_name] = cab
+                depois = set(ItensContasAPagarModel.objects.filter(**filtro).values_list('codigo', flat=True))
+                return [o for o in itens if o.codigo in depois - antes]
+            ItensContasAPagarModel.objects.bulk_create(itens)
+        return itens
+    except DatabaseError:
+        pass
+    gravados = []
+    for o in itens:
+        o.pk = None
+        try:
+            with transaction.atomic():
+                o.save(force_insert=True)
+            gravados.append(o)
+        except DatabaseError:
+            continue
+    return gravados
+
 @login_required
 @permission_required('operacional.acessar_operacional', raise_exception=True)
 @csrf_exempt
@@ -3119,7 +2848,8 @@ def gerar_contas_a_pagar(request):
     """
     Gera um registro em Contas a Pagar (cabeçalho) e insere itens a partir dos dados da view VW_CARTA_FRETE,
     conforme seleção feita no frontend.
-    Espera JSON: { placa, data_fechamento (yyyy-mm-dd), data_inicio?, data_fim?, status?, indices: [int] }
+    Espera JSON: { placa, data_fechamento (yyyy-mm-dd), chaves: ['empresa|codigo', ...], periodos?, parcelas? }
+    (periodos/parcelas indexados pela mesma chave)
     """
     if ContasAPagarModel is None or ItensContasAPagarModel is None:
         return JsonResponse({'success': False, 'error': 'Modelos de Contas a Pagar não disponíveis.'}, status=500)
@@ -3130,10 +2860,7 @@ def gerar_contas_a_pagar(request):
 
     placa = (payload.get('placa') or '').strip()
     data_fech = (payload.get('data_fechamento') or '').strip()
-    di = (payload.get('data_inicio') or '').strip()
-    df = (payload.get('data_fim') or '').strip()
-    status_f = (payload.get('status') or '').strip()
-    indices = payload.get('indices') or []
+    chaves = payload.get('chaves') or []
     periodos_override = payload.get('periodos', {}) or {}
     parcelas_override = payload.get('parcelas', {}) or {}
     # Opção de valor fixo
@@ -3142,90 +2869,34 @@ def gerar_contas_a_pagar(request):
         valor_fixo = float(payload.get('valor_fixo') or 0)
     except Exception:
         valor_fixo = 0.0
-    if not placa or not data_fech or not isinstance(indices, list) or not indices:
+    if not placa or not data_fech or not isinstance(chaves, list) or not chaves:
         return JsonResponse({'success': False, 'error': 'Parâmetros obrigatórios ausentes'}, status=400)
     try:
         dt_fech = datetime.strptime(data_fech, '%Y-%m-%d').date()
     except Exception:
         return JsonResponse({'success': False, 'error': 'Data de fechamento inválida (yyyy-mm-dd).'}, status=400)
 
-    # Montar consulta igual à página
-    where = []
-    params = []
-    where.append('PLACA = %s')
-    params.append(placa)
-    if di:
-        where.append('CAST(DATA AS DATE) >= %s')
-        params.append(di)
-    if df:
-        where.append('CAST(DATA AS DATE) <= %s')
-        params.append(df)
-    sql = ["SELECT * FROM VW_CARTA_FRETE"]
-    if where:
-        sql.append('WHERE ' + ' AND '.join(where))
-    sql.append('ORDER BY DATA ASC')
+    chaves = list(dict.fromkeys(str(c) for c in chaves))
+    codigos = sorted({c.split('|', 1)[-1] for c in chaves} - {''})
+    if not codigos:
+        return JsonResponse({'success': False, 'error': 'Nenhum item válido selecionado.'}, status=400)
 
-    rows = []
-    cols = []
-    with connection.cursor() as cursor:
-        cursor.execute('\n'.join(sql), params)
-        cols = [c[0] for c in cursor.description]
-        for r in cursor.fetchall():
-            rows.append(dict(zip(cols, r)))
-    # Aplicar filtro por situacao (aberto/fechado) após leitura para manter alinhado com os índices do modal
-    def pick_col(target_names):
-        lower_map = {c.lower(): c for c in cols}
-        for name in target_names:
-            if name in lower_map:
-                return lower_map[name]
-        for c in cols:
-            cl = c.lower()
-            for name in target_names:
-                if name in cl:
-                    return c
-        return None
-    col_situacao = pick_col(['situacao', 'situação'])
-    if status_f and col_situacao:
-        wanted = (status_f or '').strip().upper()
-        rows = [d for d in rows if str(d.get(col_situacao) or '').strip().upper() == wanted]
+    # Buscar somente as linhas (e colunas) selecionadas
+    try:
+        rows = frete.selecionadas(placa, codigos)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
     if not rows:
         return JsonResponse({'success': False, 'error': 'Nenhum dado encontrado para os filtros informados.'}, status=404)
 
-    # Selecionar itens pela lista de índices
-    sel = []
-    for i in indices:
-        try:
-            idx = int(i)
-            sel.append((idx, rows[idx]))
-        except Exception:
-            continue
+    # Casar pela chave completa (empresa|codigo), na ordem da seleção
+    por_chave = {}
+    for d in rows:
+        por_chave.setdefault(frete.chave(d['empresa'], d['codigo']), d)
+    sel = [(chave, por_chave[chave]) for chave in chaves if chave in por_chave]
     if not sel:
         return JsonResponse({'success': False, 'error': 'Nenhum item válido selecionado.'}, status=400)
 
-    # Mapear colunas prováveis
-    def pick_col(target_names):
-        lower_map = {c.lower(): c for c in cols}
-        for name in target_names:
-            if name in lower_map:
-                return lower_map[name]
-        for c in cols:
-            cl = c.lower()
-            for name in target_names:
-                if name in cl:
-                    return c
-        return None
-
-    col_valor = pick_col(['valor', 'vl', 'vl_total'])
-    col_adiant = pick_col(['adiantamento', 'adiant', 'vl_adiantamento'])
-    col_outros = pick_col(['outros', 'vl_outros'])
-    col_saldo = pick_col(['saldo', 'vl_saldo'])
-    col_codigo = pick_col(['codigo', 'cd', 'cod'])
-    col_empresa = pick_col(['empresa'])
-    col_data = pick_col(['data', 'dt'])
-    col_status = pick_col(['status'])
-    col_trecho = pick_col(['trecho'])
-    col_act = pick_col(['act', 'descricao', 'observacao'])
-
     # Obter FK de veículo pela placa
     # Buscar pelo campo da chave da relacionada (Agregado.placa)
     veiculo = Veiculo.objects.select_related('placa').filter(placa__placa__iexact=placa).first()
@@ -3243,6 +2914,7 @@ def gerar_contas_a_pagar(request):
                 'atualizado_por': request.user,
             },
         )
+        dias_snapshot = snapshot.dias_contas(cab)
         # Atualizar flags/valor fixo no cabeçalho caso o modelo possua os campos
         # Isolado em savepoint para evitar sujar a transação se a coluna ainda não existir no DB
         try:
@@ -3288,21 +2960,27 @@ def gerar_contas_a_pagar(request):
                 if candidate in [ff.name for ff in ItensContasAPagarModel._meta.get_fields()]:
                     fk_field_name = candidate
                     break
-        # Montar conjunto de chaves existentes para evitar duplicados
-        existing_keys = set()
-        if fk_field_name:
-            qs_exist = ItensContasAPagarModel.objects.filter(**{fk_field_name: cab}).values('empresa', 'codigo', 'placa', 'data')
-            for it in qs_exist:
-                key = f"{(it.get('empresa') or '').strip()}|{(it.get('codigo') or '').strip()}|{(it.get('placa') or '').strip()}|{it.get('data')}"
-                existing_keys.add(key)
-        created = 0
-        total_added = 0.0
-        skipped_dupes = 0
-        for idx_original, d in sel:
+        # Campos numéricos
+        def num(x):
+            try:
+                v = float(x or 0)
+            except Exception:
+                return 0.0
+            return v if math.isfinite(v) else 0.0
+
+        def inteiro(x):
+            try:
+                return int(x or 1)
+            except Exception:
+                return 1
+        # Montar os itens em memória (sem gravar ainda)
+        candidatos = []
+        invalidos = 0
+        for chave, d in sel:
             # Parse data do item
             data_item = None
             try:
-                v = d.get(col_data)
+                v = d['data']
                 if hasattr(v, 'date'):
                     data_item = v
                 elif isinstance(v, str) and v:
@@ -3316,50 +2994,46 @@ def gerar_contas_a_pagar(request):
                     data_item = dt_fech
             except Exception:
                 data_item = dt_fech
-            # Campos numéricos
-            def num(x):
-                try:
-                    return float(x or 0)
-                except Exception:
-                    return 0.0
-            # Checar duplicidade por (empresa, codigo, placa, data)
-            empresa_val = (str(d.get(col_empresa) or '') if col_empresa else '')
-            codigo_val = (str(d.get(col_codigo) or '') if col_codigo else '')
-            dup_key = f"{empresa_val.strip()}|{placa.strip()}|{codigo_val.strip()}|{(data_item or dt_fech)}"
-            if dup_key in existing_keys:
-                continue
-            # Montar kwargs dinamicamente e identificar o campo FK correto para Contas a Pagar
+            # colunas ausentes na view vêm como None
             item_kwargs = {
-                'empresa': empresa_val,
-                'codigo': codigo_val,
+                'empresa': str(d['empresa'] or ''),
+                'codigo': str(d['codigo'] or ''),
                 'placa': placa,
                 'data': (data_item or dt_fech),
-                'act': (str(d.get(col_act) or '') if col_act else ''),
-                'status': (str(d.get(col_status) or '') if col_status else ''),
-                'trecho': (str(d.get(col_trecho) or '') if col_trecho else ''),
-                'valor': (num(d.get(col_valor)) if col_valor else 0.0),
-                'adiantamento': (num(d.get(col_adiant)) if col_adiant else 0.0),
-                'outros': (num(d.get(col_outros)) if col_outros else 0.0),
-                'saldo': (num(d.get(col_saldo)) if col_saldo else 0.0),
-                'periodo': str(periodos_override.get(str(idx_original)) or periodos_override.get(idx_original) or 'S'),
-                'parcela': int(parcelas_override.get(str(idx_original)) or parcelas_override.get(idx_original) or 1),
+                'act': str(d['act'] or ''),
+                'status': str(d['status'] or ''),
+                'trecho': str(d['trecho'] or ''),
+                'valor': num(d['valor']),
+                'adiantamento': num(d['adiantamento']),
+                'outros': num(d['outros']),
+                'saldo': num(d['saldo']),
+                'periodo': str(periodos_override.get(chave) or 'S'),
+                'parcela': inteiro(parcelas_override.get(chave)),
             }
             if fk_field_name:
                 item_kwargs[fk_field_name] = cab
-            # Isolar inserção de item em savepoint para não quebrar transação externa
-            try:
-                with transaction.atomic():
-                    ItensContasAPagarModel.objects.create(**item_kwargs)
-                    existing_keys.add(dup_key)
-                    created += 1
-                    total_added += float(item_kwargs.get('saldo') or 0.0)
-            except IntegrityError:
-                # Provável duplicidade pelo campo unique (ex.: codigo)
-                skipped_dupes += 1
-                continue
-            except Exception:
-                # Qualquer erro na criação deste item: desfaz apenas este savepoint e segue
+            item = ItensContasAPagarModel(**item_kwargs)
+            if _ajustar_item_cap(item):
+                candidatos.append(item)
+            else:
+                invalidos += 1
+        # Duplicidade pelo campo unique (codigo): uma consulta para todos os selecionados
+        codigos_sel = [o.codigo for o in candidatos]
+        ja_gravados = set(
+            ItensContasAPagarModel.objects.filter(codigo__in=codigos_sel).values_list('codigo', flat=True)
+        ) if codigos_sel else set()
+        novos = []
+        for o in candidatos:
+            if o.codigo in ja_gravados:
                 continue
+            ja_gravados.add(o.codigo)  # repetido na própria seleção
+            novos.append(o)
+        skipped_dupes = len(candidatos) - len(novos)
+        gravados = _inserir_itens_cap(novos, fk_field_name, cab)
+        # recusados pelo banco: conflito concorrente ou valor inválido
+        invalidos += len(novos) - len(gravados)
+        created = len(gravados)
+        total_added = sum(float(o.saldo or 0.0) for o in gravados)
         # Atualizar valor do cabeçalho
         # Definir valor do cabeçalho conforme regra de valor fixo
         if fl_vlfixo and valor_fixo > 0:
@@ -3384,53 +3058,24 @@ def gerar_contas_a_pagar(request):
         # Recalcular vencimentos em savepoint para evitar quebrar a transação externa
         try:
             with transaction.atomic():
-                # Mapa de incremento por período
-                period_days = {'S': 7, 'Q': 14, 'M': 28}
-                # Agrupar valores por data de vencimento
-                by_due_date = {}
-                # Buscar todos itens do cabeçalho
-                items_qs = ItensContasAPagarModel.objects.filter(**({fk_field_name: cab} if fk_field_name else {}))
                 if fl_vlfixo and valor_fixo > 0:
                     # Valor fixo: um único vencimento na data de fechamento
-                    by_due_date = {cab.data_fechamento: round(valor_fixo, 2)}
+                    por_data = {cab.data_fechamento: round(valor_fixo, 2)}
                 else:
-                    for it in items_qs:
-                        n_parc = int(getattr(it, 'parcela', 1) or 1)
-                        per = str(getattr(it, 'periodo', 'S') or 'S').upper()
-                        delta = period_days.get(per, 7)
-                        saldo_item = float(getattr(it, 'saldo', 0) or 0.0)
-                        if n_parc <= 0:
-                            n_parc = 1
-                        # dividir saldo igualmente entre parcelas com ajuste na última
-                        if n_parc == 1:
-                            shares = [round(saldo_item, 2)]
-                        else:
-                            base = round(saldo_item / n_parc, 2)
-                            shares = [base] * (n_parc - 1)
-                            last = round(saldo_item - sum(shares), 2)
-                            shares.append(last)
-                        for idx in range(n_parc):
-                            due = cab.data_fechamento + timedelta(days=delta * idx)
-                            by_due_date[due] = float(by_due_date.get(due, 0.0) + shares[idx])
-
-                # Apagar vencimentos atuais do cabeçalho e recriar ordenados por data
-                VencContasPagar.objects.filter(contas_pagar=cab).delete()
-                seq = 1
-                for due_date in sorted(by_due_date.keys()):
-                    VencContasPagar.objects.create(
-                        contas_pagar=cab,
-                        fechamento=None,
-                        seq_vencimento=seq,
-                        data_vencimento=due_date,
-                        valor=round(by_due_date[due_date], 2),
-                    )
-                    seq += 1
+                    # Buscar todos itens do cabeçalho e agrupar por data de vencimento
+                    items_qs = ItensContasAPagarModel.objects.filter(**({fk_field_name: cab} if fk_field_name else {}))
+                    por_data = vencimentos.cronograma_itens(cab.data_fechamento, items_qs, 'saldo')
+                # Aplicar só a diferença em relação aos vencimentos atuais (numerados por data)
+                vencimentos.regenerar(cab, por_data)
         except Exception:
             # Falha no recálculo de vencimentos: desfaz apenas este bloco
             pass
+        snapshot.agendar_contas(cab, dias_snapshot)
     msg = f'Contas a Pagar atualizado: {created} itens incluídos'
     if skipped_dupes:
         msg += f' ({skipped_dupes} já existentes ignorados)'
+    if invalidos:
+        msg += f' ({invalidos} não gravados: inválidos ou incluídos por outro usuário)'
     return JsonResponse({'success': True, 'message': msg + '.', 'id': cab.id})
 
     def _agrupar_fechamentos(self, qs):
@@ -3525,6 +3170,10 @@ def check_fechamento(request):
     return JsonResponse({'success': True, 'exists': header_exists})
 
 
+# Campos regravados quando o item da tela já existe no Contas a Receber (upsert do fechar_caixa)
+ITENS_CR_CAMPOS_UPSERT = ['cdServico', 'nmServico', 'tipo', 'nmItem', 'qtde', 'unidade', 'valor_unitario', 'percentual', 'valor', 'total', 'periodo', 'parcela']
+ITENS_CR_BATCH_SIZE = int(os.getenv('ITENS_CR_BATCH_SIZE', '500'))
+
 @login_required
 @permission_required('operacional.acessar_operacional', raise_exception=True)
 @csrf_exempt
@@ -3615,8 +3264,12 @@ def fechar_caixa(request):
                 'atualizado_por': request.user,
             }
         )
+        dias_snapshot = snapshot.dias_contas(cab)
         # mapa para atualizar itens já existentes (evitar duplicatas e permitir upsert)
+        # novos/alterados são acumulados e gravados em lote no fim (bulk_create/bulk_update)
         existing_map = {}
+        novos_itens = []
+        alterados_itens = {}
         for it in ItensContasReceber.objects.filter(contas_receber=cab):
             try:
                 k = f"{getattr(it,'ordemServico',0)}|{getattr(it,'cdItem',0)}|{(it.data.date() if getattr(it,'data',None) else '')}"
@@ -3697,9 +3350,9 @@ def fechar_caixa(request):
                 it.total = cobrar_val
                 it.periodo = (d.get('periodo') or periodo)
                 it.parcela = int(d.get('parcela') or parcela or 1)
-                it.save(update_fields=['cdServico','nmServico','tipo','nmItem','qtde','unidade','valor_unitario','percentual','valor','total','periodo','parcela','dt_atualizacao'])
+                alterados_itens[it.id] = it
             else:
-                ItensContasReceber.objects.create(
+                novos_itens.append(ItensContasReceber(
                     contas_receber=cab,
                     ordemServico=os_val,
                     cdServico=(cd_serv_key or cd_item_key),
@@ -3716,9 +3369,18 @@ def fechar_caixa(request):
                     total=cobrar_val,
                     periodo=(d.get('periodo') or periodo),
                     parcela=int(d.get('parcela') or parcela or 1),
-                )
+                ))
                 created += 1
 
+        if alterados_itens:
+            ItensContasReceber.objects.bulk_update(
+                list(alterados_itens.values()),
+                ITENS_CR_CAMPOS_UPSERT,
+                batch_size=ITENS_CR_BATCH_SIZE,
+            )
+        if novos_itens:
+            ItensContasReceber.objects.bulk_create(novos_itens, batch_size=ITENS_CR_BATCH_SIZE)
+
         # Atualizar valor total do cabeçalho
         total_cab = ItensContasReceber.objects.filter(contas_receber=cab).aggregate(s=models.Sum('total'))['s'] or 0.0
         cab.valor = float(total_cab)
@@ -3728,270 +3390,79 @@ def fechar_caixa(request):
         # Recalcular VencContasReceber
         try:
             with transaction.atomic():
-                period_days = {'S': 7, 'Q': 14, 'M': 28}
-                by_due_date = {}
-                items_qs = ItensContasReceber.objects.filter(contas_receber=cab)
-                for it in items_qs:
-                    n_parc = int(getattr(it, 'parcela', 1) or 1)
-                    per = str(getattr(it, 'periodo', 'S') or 'S').upper()
-                    delta = period_days.get(per, 7)
-                    valor_item = float(getattr(it, 'total', 0) or 0.0)
-                    if n_parc <= 0:
-                        n_parc = 1
-                    if n_parc == 1:
-                        shares = [round(valor_item, 2)]
-                    else:
-                        base = round(valor_item / n_parc, 2)
-                        shares = [base] * (n_parc - 1)
-                        last = round(valor_item - sum(shares), 2)
-                        shares.append(last)
-                    for idx in range(n_parc):
-                        due = cab.data_fechamento + timedelta(days=delta * idx)
-                        by_due_date[due] = float(by_due_date.get(due, 0.0) + shares[idx])
-                # recriar
-                VencContasReceber.objects.filter(contas_receber=cab).delete()
-                seq = 1
-                for due_date in sorted(by_due_date.keys()):
-                    VencContasReceber.objects.create(
-                        contas_receber=cab,
-                        fechamento=None,
-                        seq_vencimento=seq,
-                        data_vencimento=due_date,
-                        valor=round(by_due_date[due_date], 2),
-                    )
-                    seq += 1
+                vencimentos.regenerar(cab, vencimentos.cronograma_itens(
+                    cab.data_fechamento, ItensContasReceber.objects.filter(contas_receber=cab), 'total'))
         except Exception:
             pass
+        snapshot.agendar_contas(cab, dias_snapshot)
 
     return JsonResponse({'success': True, 'created': created, 'message': f'Contas a Receber atualizado com {created} itens. Total R$ {soma_total:.2f}.'})
 
 @login_required
 @permission_required('operacional.acessar_operacional', raise_exception=True)
-@require_GET
+@require_POST
 def prestacao_contas_pdf(request):
     """
-    Gera PDF de Prestação de Contas no servidor.
-    Parâmetros:
-      - data_fechamento: yyyy-mm-dd
-      - placa: pode repetir múltiplas vezes (?placa=AAA&placa=BBB)
-    Retorna application/pdf para download (arquivo único com todas as placas).
+    Enfileira a geração do PDF de Prestação de Contas (arquivo único com todas as placas).
+    Espera JSON: { data_fechamento: yyyy-mm-dd, placas: [..] }
+    Retorna o id da tarefa; o worker `processar_tarefas_pdf` gera o arquivo e o
+    download sai de prestacao_contas_pdf_download quando o status for 'concluido'.
     """
-    if pisa is None:
-        return JsonResponse({'success': False, 'error': 'Biblioteca xhtml2pdf não instalada no servidor.'}, status=500)
-    data_str = (request.GET.get('data_fechamento') or '').strip()
-    placas = request.GET.getlist('placa') or []
+    try:
+        payload = json.loads(request.body.decode('utf-8') or '{}')
+    except Exception:
+        return JsonResponse({'success': False, 'error': 'JSON inválido'}, status=400)
+    data_str = (payload.get('data_fechamento') or '').strip()
+    placas = [str(p).strip() for p in (payload.get('placas') or []) if str(p).strip()]
     if not data_str or not placas:
         return JsonResponse({'success': False, 'error': 'Informe data_fechamento e ao menos uma placa.'}, status=400)
-    # Reusa a lógica de gestao_fechamento_detalhes para cada placa
-    docs = []
-    for placa in placas:
-        try:
-            # construir contexto por placa
-            req = request  # reutiliza timezone/locales
-            # Copia essencial da função gestao_fechamento_detalhes
-            dt = None
-            for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
-                try:
-                    dt = datetime.strptime(data_str, fmt).date()
-                    break
-                except Exception:
-                    continue
-            if dt is None:
-                continue
-            start_dt = dt
-            end_dt = dt + timedelta(days=1)
-            # Vencimentos CR/CP por data de fechamento (regra ajustada)
-            cr_qs = VencContasReceber.objects.select_related('contas_receber', 'contas_receber__placa').filter(contas_receber__data_fechamento=dt)
-            veic_qs = Veiculo.objects.select_related('placa').filter(placa__placa__iexact=placa)
-            veic_ids = list(veic_qs.values_list('id_veiculo', flat=True))
-            if veic_ids:
-                cr_qs = cr_qs.filter(contas_receber__placa__in=veic_ids)
-            cr_rows = []
-            for v in cr_qs:
-                cr_rows.append({
-                    'seq': v.seq_vencimento,
-                    'data': v.data_vencimento.strftime('%d/%m/%Y') if v.data_vencimento else '',
-                    'valor': float(v.valor or 0),
-                })
-            cp_qs = VencContasPagar.objects.select_related('contas_pagar', 'contas_pagar__placa').filter(contas_pagar__data_fechamento=dt)
-            if veic_ids:
-                cp_qs = cp_qs.filter(contas_pagar__placa__in=veic_ids)
-            cp_rows = []
-            for v in cp_qs:
-                cp_rows.append({
-                    'seq': v.seq_vencimento,
-                    'data': v.data_vencimento.strftime('%d/%m/%Y') if v.data_vencimento else '',
-                    'valor': float(v.valor or 0),
-                })
-            # Lançamentos
-            lanc_qs = Lancamento.objects.select_related('veiculo', 'veiculo__placa').filter(data=dt)
-            if veic_ids:
-                lanc_qs = lanc_qs.filter(veiculo__id_veiculo__in=veic_ids)
-            lanc_rows = []
-            for l in lanc_qs:
-                lanc_rows.append({
-                    'data': l.data.strftime('%d/%m/%Y') if l.data else '',
-                    'categoria': getattr(l.categoria, 'nome', ''),
-                    'valor': float(l.valor or 0),
-                    'obs': l.obs or '',
-                    'periodo': getattr(l, 'periodo', '') or '',
-                    'parcela': getattr(l, 'parcela', 1) or 1,
-                })
-            # Itens CR/CP
-            cr_itens_rows = []
-            cp_itens_rows = []
-            cr_cabs = ContasReceber.objects.filter(data_fechamento=dt)
-            if veic_ids:
-                cr_cabs = cr_cabs.filter(placa__id_veiculo__in=veic_ids)
-            cr_ids = list(cr_cabs.values_list('id', flat=True))
-            if cr_ids:
-                for it in ItensContasReceber.objects.select_related().filter(contas_receber_id__in=cr_ids).order_by('data', 'ordemServico'):
-                    cr_itens_rows.append({
-                        'os': it.ordemServico,
-                        'servico': it.nmServico,
-                        'data': it.data.strftime('%d/%m/%Y') if it.data else '',
-                        'item': it.nmItem,
-                        'qtde': float(it.qtde or 0),
-                        'un': it.unidade or '',
-                        'valor': float(it.valor or 0),
-                        'percentual': float(it.percentual or 0),
-                        'valor_unit': float(it.valor_unitario or 0),
-                        'total': float(it.total or 0),
-                        'periodo': getattr(it, 'periodo', '') or '',
-                        'parcela': getattr(it, 'parcela', 1) or 1,
-                    })
-            cp_cabs = ContasAPagarModel.objects.filter(data_fechamento=dt)
-            if veic_ids:
-                cp_cabs = cp_cabs.filter(placa__id_veiculo__in=veic_ids)
-            cp_ids = list(cp_cabs.values_list('id', flat=True))
-            if cp_ids and ItensContasAPagarModel:
-                for it in ItensContasAPagarModel.objects.select_related().filter(**{'contas_pagar_id__in': cp_ids}).order_by('data', 'codigo'):
-                    cp_itens_rows.append({
-                        'empresa': it.empresa or '',
-                        'codigo': it.codigo or '',
-                        'placa': it.placa or '',
-                        'data': it.data.strftime('%d/%m/%Y') if it.data else '',
-                        'act': it.act or '',
-                        'status': it.status or '',
-                        'trecho': it.trecho or '',
-                        'valor': float(it.valor or 0),
-                        'adiantamento': float(it.adiantamento or 0),
-                        'outros': float(it.outros or 0),
-                        'saldo': float(it.saldo or 0),
-                        'periodo': it.periodo or '',
-                        'parcela': it.parcela or 1,
-                    })
-            # Totais (ótica do agregado, como no front):
-            sCR = sum([float(x.get('valor', 0) or 0) for x in cr_rows])  # a pagar (agregado)
-            sCP = sum([float(x.get('valor', 0) or 0) for x in cp_rows])  # a receber (agregado)
-            sLN = sum([float(x.get('valor', 0) or 0) for x in lanc_rows])
-            total_geral = (sCP - sCR + sLN)
-            # Agregado (nome)
-            ag_nome = ''
-            try:
-                veic = veic_qs.first()
-                ag_nome = getattr(getattr(veic, 'placa', None), 'nm_agregado', '') or ''
-            except Exception:
-                ag_nome = ''
-            docs.append({
-                'placa': placa,
-                'agregado': ag_nome,
-                'data': data_str,
-                'cr_itens': cr_itens_rows,
-                'cp_itens': cp_itens_rows,
-                'cr_venc': cr_rows,
-                'cp_venc': cp_rows,
-                'lanc': lanc_rows,
-                'totais': {
-                    'sCR': sCR, 'sCP': sCP, 'sLN': sLN, 'totalGeral': total_geral
-                }
-            })
-        except Exception:
-            continue
-    if not docs:
-        return JsonResponse({'success': False, 'error': 'Sem dados para gerar.'}, status=404)
-    context = {
-        'docs': docs,
-        'logo_url': staticfiles_storage.url('img/logo.png'),
-        'logo_src': (getattr(staticfiles_storage, 'base_url', None) or '/static/') + 'img/logo.png',
-        'logo_data_uri': None,
-        'logo_abs_path': None,
-        'logo_file_uri': None,
-        'hoje': date.today().strftime('%d/%m/%Y'),
+    tarefa = fila_pdf.enfileirar(data_str, placas, request.user)
+    return JsonResponse(_status_tarefa_pdf(tarefa), status=202)
+
+
+def _status_tarefa_pdf(tarefa):
+    dados = {
+        'success': tarefa.status != 'erro',
+        'tarefa_id': tarefa.id,
+        'status': tarefa.status,
+        'status_url': reverse('operacional:prestacao_contas_pdf_status', args=[tarefa.id]),
     }
-    # Converter logo para RGB (sem transparência) para evitar máscara escura no PDF
-    try:
-        logo_path = staticfiles_storage.path('img/logo.png')
-        with Image.open(logo_path) as im:
-            if im.mode in ('RGBA', 'LA'):
-                bg = Image.new('RGB', im.size, (255, 255, 255))
-                alpha = im.split()[-1]
-                bg.paste(im, mask=alpha)
-                im_rgb = bg
-            else:
-                im_rgb = im.convert('RGB')
-            # Salvar como JPEG temporário (sem canal alpha) para evitar máscara
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-            tmp.close()
-            im_rgb.save(tmp.name, format='JPEG', quality=95)
-            context['logo_abs_path'] = tmp.name
-            try:
-                context['logo_file_uri'] = Path(tmp.name).as_uri()
-            except Exception:
-                context['logo_file_uri'] = None
-            # Além disso, disponibilizar como data URI (JPEG) para engines que preferem inline
-            buf = BytesIO()
-            im_rgb.save(buf, format='JPEG', quality=95)
-            b64 = base64.b64encode(buf.getvalue()).decode('ascii')
-            context['logo_data_uri'] = f'data:image/jpeg;base64,{b64}'
-    except Exception:
-        pass
-    html = render_to_string('operacional/prestacao_contas_pdf.html', context)
-    result = BytesIO()
-    def link_callback(uri, rel):
-        try:
-            base_url = getattr(staticfiles_storage, 'base_url', None) or '/static/'
-            # map /static/... to filesystem path
-            if uri.startswith(base_url):
-                rel_path = uri.replace(base_url, '')
-                return staticfiles_storage.path(rel_path)
-            # file:/// scheme
-            if uri.startswith('file://'):
-                return uri.replace('file://', '')
-            # absolute path on filesystem
-            if os.path.isabs(uri) and os.path.exists(uri):
-                return uri
-            return uri
-        except Exception:
-            return uri
-    pisa.CreatePDF(html, dest=result, link_callback=link_callback, encoding='utf-8')
-    pdf = result.getvalue()
-    if not pdf:
-        return JsonResponse({'success': False, 'error': 'Falha ao montar PDF.'}, status=500)
-    # Definir nome do arquivo
-    def _sanitize(t: str) -> str:
-        try:
-            import re, unicodedata
-            t = unicodedata.normalize('NFD', str(t))
-            t = ''.join(ch for ch in t if unicodedata.category(ch) != 'Mn')
-            t = re.sub(r'[^A-Za-z0-9_\\-]+', '_', t)
-            t = re.sub(r'_+', '_', t).strip('_')
-            return t
-        except Exception:
-            return str(t).replace(' ', '_')
-    fname = f'prestacao_{data_str}.pdf'
-    try:
-        if len(placas) == 1 and docs:
-            placa_fname = _sanitize(docs[0].get('placa') or placas[0] or '')
-            ag_fname = _sanitize(docs[0].get('agregado') or '')
-            parts = [p for p in [placa_fname, ag_fname, data_str] if p]
-            if parts:
-                fname = '_'.join(parts) + '.pdf'
-    except Exception:
-        pass
-    resp = HttpResponse(pdf, content_type='application/pdf')
-    resp['Content-Disposition'] = f'attachment; filename="{fname}"'
-    return resp
+    if tarefa.status == 'concluido':
+        dados['download_url'] = reverse('operacional:prestacao_contas_pdf_download', args=[tarefa.id])
+    if tarefa.status == 'erro':
+        dados['error'] = tarefa.erro or 'Falha ao gerar PDF.'
+    return dados
+
+
+def _tarefa_pdf_do_usuario(request, tarefa_id):
+    """Tarefa de PDF de quem a pediu (staff vê todas); None para as demais, como se não existisse."""
+    qs = TarefaPdf.objects.filter(id=tarefa_id)
+    if not request.user.is_staff:
+        qs = qs.filter(usuario=request.user)
+    return qs.first()
+
+
+@login_required
+@permission_required('operacional.acessar_operacional', raise_exception=True)
+@require_GET
+def prestacao_contas_pdf_status(request, tarefa_id: int):
+    tarefa = _tarefa_pdf_do_usuario(request, tarefa_id)
+    if tarefa is None:
+        return JsonResponse({'success': False, 'error': 'Tarefa não encontrada'}, status=404)
+    return JsonResponse(_status_tarefa_pdf(tarefa))
+
+
+@login_required
+@permission_required('operacional.acessar_operacional', raise_exception=True)
+@require_GET
+def prestacao_contas_pdf_download(request, tarefa_id: int):
+    tarefa = _tarefa_pdf_do_usuario(request, tarefa_id)
+    if tarefa is None:
+        return JsonResponse({'success': False, 'error': 'Tarefa não encontrada'}, status=404)
+    path = fila_pdf.caminho(tarefa)
+    if not path:
+        return JsonResponse({'success': False, 'error': 'PDF ainda não disponível.', 'status': tarefa.status}, status=409)
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=tarefa.nome_arquivo or os.path.basename(path), content_type='application/pdf')
 
 class LancamentosListView(LoginRequiredMixin, PermissionRequiredMixin, ListView):
     """
@@ -4109,6 +3580,7 @@ def criar_lancamento(request):
             lancamento = form.save(commit=False)
             lancamento.usuario = request.user
             lancamento.save()
+            snapshot.agendar([lancamento.data], [lancamento.veiculo_id])
             
             return JsonResponse({
                 'success': True,
@@ -4148,11 +3620,13 @@ def editar_lancamento(request, lancamento_id):
     
     try:
         lancamento = get_object_or_404(Lancamento, id=lancamento_id)
+        anterior = (lancamento.data, lancamento.veiculo_id)
         data = json.loads(request.body)
         form = LancamentoForm(data, instance=lancamento)
         
         if form.is_valid():
             lancamento = form.save()
+            snapshot.agendar([anterior[0], lancamento.data], [anterior[1], lancamento.veiculo_id])
             
             return JsonResponse({
                 'success': True,
@@ -4193,6 +3667,7 @@ def excluir_lancamento(request, lancamento_id):
     try:
         lancamento = get_object_or_404(Lancamento, id=lancamento_id)
         lancamento.delete()
+        snapshot.agendar([lancamento.data], [lancamento.veiculo_id])
         
         return JsonResponse({
             'success': True,
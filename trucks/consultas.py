@@ -0,0 +1,85 @@
+"""
+Montagem das consultas da vw_consolidado (e tabelas de jornada relacionadas).
+
+Gera SQL parametrizado (placeholders "?" do pyodbc) para que o SQL Server
+reaproveite o plano entre placas/datas diferentes, e filtra período com
+faixa aberta (data >= ? AND data < ?) em vez de convert(date, data),
+permitindo index seek na coluna data.
+
+    sql, params = ConsultaJornada().periodo(di, df).placa('ABC1234').sql()
+    dados = cf.getAll(sql, params)
+"""
+from datetime import date, datetime, timedelta
+
+
+FORMATOS_DATA = ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S')
+
+
+def para_data(valor):
+    """Aceita date/datetime ou string (YYYY-MM-DD ou DD/MM/YYYY) e devolve date."""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = str(valor).strip()
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Data inválida: {valor}')
+
+
+class ConsultaJornada:
+    def __init__(self, colunas='*', tabela='vw_consolidado', distinct=False):
+        if isinstance(colunas, (list, tuple)):
+            colunas = ', '.join(colunas)
+        self.colunas = colunas
+        self.tabela = tabela
+        self.distinct = distinct
+        self.condicoes = []
+        self.params = []
+        self.ordem = None
+
+    def where(self, condicao, *params):
+        self.condicoes.append(condicao)
+        self.params.extend(params)
+        return self
+
+    def periodo(self, inicio, fim, coluna='data'):
+        """Intervalo fechado de dias [inicio, fim], como o antigo BETWEEN com convert(date, ...)."""
+        if inicio:
+            self.where(f'{coluna} >= ?', para_data(inicio))
+        if fim:
+            self.where(f'{coluna} < ?', para_data(fim) + timedelta(days=1))
+        return self
+
+    def dia(self, valor, coluna='data'):
+        return self.periodo(valor, valor, coluna)
+
+    def igual(self, coluna, valor):
+        return self.where(f'{coluna} = ?', valor)
+
+    def placa(self, placa, coluna='placa'):
+        return self.igual(coluna, str(placa or '').strip())
+
+    def motorista(self, padrao, coluna='motoristaRAS'):
+        if padrao:
+            self.where(f'{coluna} LIKE ?', padrao)
+        return self
+
+    def order_by(self, ordem):
+        self.ordem = ordem
+        return self
+
+    def sql(self):
+        partes = ['SELECT DISTINCT' if self.distinct else 'SELECT', self.colunas, 'FROM', self.tabela]
+        if self.condicoes:
+            partes.append('WHERE ' + ' AND '.join(self.condicoes))
+        if self.ordem:
+            partes.append('ORDER BY ' + self.ordem)
+        return ' '.join(partes), list(self.params)
+
+
+def consulta_distintos(coluna, tabela='vw_consolidado'):
+    return ConsultaJornada(coluna, tabela, distinct=True).sql()
@@ -0,0 +1,186 @@
+"""
+Cálculo vetorizado dos tempos de jornada (vw_consolidado).
+
+Substitui o procHoras/convertSegundo/horasFormatada que percorriam linha a
+linha convertendo as strings 'HH:MM:SS'. Aqui as nove colunas de tempo são
+convertidas de uma vez para segundos (int64) e somadas com numpy/pandas.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+
+# Colunas de tempo da vw_consolidado, na ordem dos totais exibidos na tela.
+# O índice é a posição da coluna no "select *" (usado quando não há nomes).
+COLUNAS_TEMPO = [
+    ('tJornada', 'Jornada', 8),
+    ('paradoLigado', 'ligadoParado', 9),
+    ('veiMovimento', 'veiMovi', 10),
+    ('horarioAlmoco', 'horaAlmoco', 11),
+    ('tempoEspera', 'tempoEspera', 12),
+    ('tempoDescanso', 'tempoDescanso', 13),
+    ('tempoNoturno', 'tempoNoturno', 16),
+    ('extrasDiurnas', 'TempoExtra', 17),
+    ('extraNoturno', 'tempoNoturnoExtra', 18),
+]
+
+CHAVES_TOTAIS = [chave for chave, _, _ in COLUNAS_TEMPO]
+
+
+def _como_dataframe(tabela):
+    if isinstance(tabela, pd.DataFrame):
+        return tabela
+    linhas = [tuple(r) for r in tabela]
+    return pd.DataFrame.from_records(linhas) if linhas else pd.DataFrame()
+
+
+def _coluna(df, nome, indice):
+    if nome in df.columns:
+        return df[nome]
+    if indice < len(df.columns):
+        return df.iloc[:, indice]
+    return pd.Series(index=df.index, dtype=object)
+
+
+def para_segundos(serie):
+    """Converte uma série de 'HH:MM:SS' (ou None) para segundos int64."""
+    if len(serie) == 0:
+        return np.zeros(0, dtype=np.int64)
+    partes = serie.fillna('00:00:00').astype(str).str.split(':', n=2, expand=True)
+    partes = partes.reindex(columns=range(3))
+    valores = partes.apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy()
+    return (valores[:, 0] * 3600 + valores[:, 1] * 60 + valores[:, 2]).astype(np.int64)
+
+
+def segundos_jornada(tabela):
+    """
+    Retorna um DataFrame com as nove colunas de tempo em segundos
+    (colunas = CHAVES_TOTAIS), alinhado ao índice da tabela original.
+    """
+    df = _como_dataframe(tabela)
+    dados = {
+        chave: para_segundos(_coluna(df, nome, indice))
+        for chave, nome, indice in COLUNAS_TEMPO
+    }
+    return pd.DataFrame(dados, index=df.index, columns=CHAVES_TOTAIS)
+
+
+def formatar_horas(segundos):
+    """Segundos -> 'H:MM:SS' (horas sem zero à esquerda, como na tela)."""
+    segundos = int(segundos)
+    return f"{segundos // 3600}:{(segundos // 60) % 60:02d}:{segundos % 60:02d}"
+
+
+def totais_jornada(tabela):
+    """Dict chave -> total formatado (chaves iguais às do contexto do template)."""
+    somas = segundos_jornada(tabela).sum()
+    return {chave: formatar_horas(somas[chave]) for chave in CHAVES_TOTAIS}
+
+
+def procHoras(tabela):
+    """Compatível com o procHoras antigo: lista com os nove totais formatados."""
+    totais = totais_jornada(tabela)
+    return [totais[chave] for chave in CHAVES_TOTAIS]
+
+
+def totais_por_grupo(tabela, por='placa', freq=None, coluna_data='data', formatar=True):
+    """
+    Totais de tempo agrupados por placa ou motorista (coluna `por`).
+
+    `freq` agrupa também por período da coluna de data, ex.:
+        totais_por_grupo(df, 'motoristaRAS', freq='W')  # horas extras por motorista por semana
+    """
+    df = _como_dataframe(tabela)
+    segundos = segundos_jornada(df)
+    chaves = [df[por]]
+    if freq:
+        datas = pd.to_datetime(df[coluna_data], errors='coerce')
+        chaves.append(datas.dt.to_period(freq).rename('periodo'))
+    grupos = segundos.groupby(chaves, dropna=False).sum()
+    if formatar:
+        grupos = grupos.apply(lambda col: col.map(formatar_horas))
+    return grupos.reset_index()
+
+
+MOTORISTA_NAO_IDENTIFICADO = 'NÃO IDENTIFICADO'
+
+
+def _placa_numerica(placa):
+    try:
+        int(placa)
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def _acumular_estatisticas(df, placas, nao_identificadas, sem_motorista,
+                           coluna_placa='placa', coluna_motorista='motoristaRAS'):
+    if not len(df) or coluna_placa not in df.columns:
+        return
+    if coluna_motorista in df.columns:
+        motoristas = df[coluna_motorista].to_numpy()
+    else:
+        motoristas = [None] * len(df)
+
+    for placa, motorista in zip(df[coluna_placa].to_numpy(), motoristas):
+        if not placa:
+            continue
+        if placa not in placas:
+            placas.add(placa)
+            if _placa_numerica(placa):
+                nao_identificadas.add(placa)
+        if motorista == MOTORISTA_NAO_IDENTIFICADO:
+            sem_motorista.add(placa)
+
+
+def estatisticas_jornada(df, coluna_placa='placa', coluna_motorista='motoristaRAS'):
+    """
+    Estatísticas do controle de jornada em uma única passada:
+
+    - total_placas_distintas: placas distintas no resultado
+    - veiculos_nao_identificados: placas distintas numéricas (veículo sem placa cadastrada)
+    - placas_sem_motorista: placas distintas com motoristaRAS = 'NÃO IDENTIFICADO'
+
+    As colunas são resolvidas pelo nome (cursor.description), não por varredura.
+    """
+    placas = set()
+    nao_identificadas = set()
+    sem_motorista = set()
+    _acumular_estatisticas(df, placas, nao_identificadas, sem_motorista, coluna_placa, coluna_motorista)
+    return {
+        'total_placas_distintas': len(placas),
+        'veiculos_nao_identificados': len(nao_identificadas),
+        'placas_sem_motorista': len(sem_motorista),
+    }
+
+
+def jornada_em_blocos(colunas, blocos, nome='Jornada'):
+    """
+    Uma passada pelos blocos lidos do banco (cf.consulta_em_blocos): devolve
+    (linhas da tabela, totais, estatísticas) com os mesmos formatos de
+    totais_jornada/estatisticas_jornada.
+
+    Só um bloco por vez vira DataFrame (para os totais e as estatísticas); as
+    linhas vão direto para namedtuples, então a memória é a da lista da tela
+    mais um bloco, sem o DataFrame do resultado inteiro.
+    """
+    Linha = namedtuple(nome, [str(c) for c in colunas], rename=True)
+    linhas = []
+    somas = np.zeros(len(CHAVES_TOTAIS), dtype=np.int64)
+    placas = set()
+    nao_identificadas = set()
+    sem_motorista = set()
+    for rows in blocos:
+        registros = [tuple(r) for r in rows]
+        df = pd.DataFrame.from_records(registros, columns=colunas, coerce_float=False)
+        somas += segundos_jornada(df)[CHAVES_TOTAIS].sum().to_numpy(dtype=np.int64)
+        _acumular_estatisticas(df, placas, nao_identificadas, sem_motorista)
+        linhas.extend(Linha._make(r) for r in registros)
+    totais = {chave: formatar_horas(total) for chave, total in zip(CHAVES_TOTAIS, somas)}
+    stats = {
+        'total_placas_distintas': len(placas),
+        'veiculos_nao_identificados': len(nao_identificadas),
+        'placas_sem_motorista': len(sem_motorista),
+    }
+    return linhas, totais, stats
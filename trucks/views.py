@@ -25,6 +25,8 @@ from xlrd import open_workbook, xldate
 from datetime import datetime, timedelta
 import copral.connectionFactory as cf
 from .models import TrucksImportadosExcel
+from .jornada import jornada_em_blocos
+from .consultas import ConsultaJornada, consulta_distintos
 
 class GestaoVeiculosView(LoginRequiredMixin, TemplateView):
     """
@@ -161,10 +163,8 @@ def controleJornada(request):
     # Data final: sempre dia 20 do mês atual
     data_final_default = hoje.replace(day=20)
     
-    query_motorista = 'select distinct motoristaRAS from vw_consolidado'
-    query_placa = 'select distinct placa from vw_consolidado'
-    placas = cf.getAll(query_placa)
-    motoristas = cf.getAll(query_motorista)
+    placas = cf.getAll(*consulta_distintos('placa'))
+    motoristas = cf.getAll(*consulta_distintos('motoristaRAS'))
 
     # Preparar dados iniciais do formulário com datas padrão
     initial_data = {
@@ -181,150 +181,52 @@ def controleJornada(request):
             df = form.cleaned_data.get('data_final')
             slc = form.cleaned_data.get('selecao', 'todos')
 
-            # Formatar datas para SQL Server
-            da_str = da.strftime('%d/%m/%Y') if da else data_inicial_default.strftime('%d/%m/%Y')
-            df_str = df.strftime('%d/%m/%Y') if df else data_final_default.strftime('%d/%m/%Y')
+            # Consulta parametrizada com faixa de datas (data >= ? and data < ?)
+            consulta = ConsultaJornada().periodo(da or data_inicial_default, df or data_final_default)
 
-            sql = f"set dateformat dmy select * from vw_consolidado where convert(date, data) between '{da_str}' and '{df_str}'"
-            
-            if slc == 'todos':
-                query = f"{sql}"
-            elif slc == 'placa':
-                query = f"{sql} and placa = '{np.strip()}'"
+            if slc == 'placa':
+                consulta.placa(np)
             elif slc == 'motorista':
-                query = f"{sql} and motoristaRas like '{np}'"
+                consulta.motorista(np)
+            
+            query, params = consulta.sql()
             
             try:
-                result = cf.getAll(query)
-                print(query)
+                # uma passada pelos blocos (fetchmany): linhas da tela, totais e estatísticas
+                with cf.consulta_em_blocos(query, params) as (colunas, blocos):
+                    result, totais, stats = jornada_em_blocos(colunas, blocos)
                 
                 if len(result) == 0:
                     messages.info(request, "Ops... Nenhum registro encontrado :(")
-                
 
-                totais = procHoras(result)
-                
-                # Calcular estatísticas adicionais
-                total_placas_distintas = len(set([registro[0] for registro in result if registro[0]]))  # Placa (index 0)
-                
-                # Veículos não identificados: contagem DISTINTA de placas que são números inteiros
-                placas_nao_identificadas = set()
-                for registro in result:
-                    placa = registro[0] if registro[0] else ''
-                    if placa:  # Só processar se a placa existe
-                        try:
-                            # Se a placa pode ser convertida para int, é não identificado
-                            int(placa)
-                            placas_nao_identificadas.add(placa)  # Adiciona ao set (distintas)
-                        except (ValueError, TypeError):
-                            # Se não pode ser convertida para int, é identificado (string)
-                            pass
-                veiculos_nao_identificados = len(placas_nao_identificadas)
-                
-                # Placas distintas com motorista "NÃO IDENTIFICADO" - VERSÃO ROBUSTA
-                placas_nao_identificado = set()
-                
-                # Debug detalhado sempre
-                print(f"\n=== DEBUG VEÍCULOS SEM MOTORISTAS ===")
-                print(f"Query executada: {query}")
-                print(f"Total de registros retornados: {len(result)}")
-                
-                if not result:
-                    placas_sem_motorista = 0
-                    print("AVISO: Nenhum registro retornado da consulta")
-                else:
-                    # Mostrar estrutura dos dados sempre
-                    print(f"Estrutura do primeiro registro ({len(result[0])} campos):")
-                    for i, campo in enumerate(result[0]):
-                        print(f"  [{i}]: {repr(campo)} (tipo: {type(campo)})")
-                    
-                    # Estratégia dupla: busca específica + busca geral
-                    motorista_ras_index = None
-                    
-                    # ETAPA 1: Buscar explicitamente por motoristaRAS em todos os registros
-                    print("\nETAPA 1: Buscando campo motoristaRAS...")
-                    indices_com_nao_identificado = {}
-                    
-                    for idx in range(len(result[0])):
-                        count_nao_ident = 0
-                        for registro in result:
-                            if len(registro) > idx and registro[idx] == 'NÃO IDENTIFICADO':
-                                count_nao_ident += 1
-                        if count_nao_ident > 0:
-                            indices_com_nao_identificado[idx] = count_nao_ident
-                            print(f"  Índice {idx}: {count_nao_ident} ocorrências de 'NÃO IDENTIFICADO'")
-                    
-                    # Escolher o índice com mais ocorrências (provavelmente motoristaRAS)
-                    if indices_com_nao_identificado:
-                        motorista_ras_index = max(indices_com_nao_identificado.items(), key=lambda x: x[1])[0]
-                        print(f"  Selecionado índice {motorista_ras_index} (maior número de ocorrências: {indices_com_nao_identificado[motorista_ras_index]})")
-                    
-                    # ETAPA 2: Contar placas distintas
-                    if motorista_ras_index is not None:
-                        print(f"\nETAPA 2: Contando placas com motoristaRAS[{motorista_ras_index}] = 'NÃO IDENTIFICADO'...")
-                        
-                        # Contar e listar algumas placas para debug
-                        placas_encontradas = []
-                        for registro in result:
-                            placa = registro[0] if registro[0] else ''
-                            motorista_ras = registro[motorista_ras_index] if len(registro) > motorista_ras_index else ''
-                            
-                            if placa and motorista_ras == 'NÃO IDENTIFICADO':
-                                placas_nao_identificado.add(placa)
-                                if len(placas_encontradas) < 5:  # Mostrar apenas as primeiras 5
-                                    placas_encontradas.append(placa)
-                        
-                        placas_sem_motorista = len(placas_nao_identificado)
-                        print(f"  Placas encontradas (primeiras 5): {placas_encontradas}")
-                        print(f"  Total de placas DISTINTAS: {placas_sem_motorista}")
-                        
-                        # Validação cruzada com consulta SQL direta
-                        try:
-                            validacao_query = f"SELECT COUNT(DISTINCT placa) FROM vw_consolidado WHERE convert(date, data) BETWEEN '{da_str}' AND '{df_str}' AND motoristaRAS = 'NÃO IDENTIFICADO'"
-                            validacao_result = cf.getAll(validacao_query)
-                            if validacao_result and validacao_result[0]:
-                                valor_sql_direto = validacao_result[0][0]
-                                print(f"  VALIDAÇÃO SQL DIRETA: {valor_sql_direto}")
-                                if placas_sem_motorista != valor_sql_direto:
-                                    print(f"  ⚠️  INCONSISTÊNCIA: Python={placas_sem_motorista} vs SQL={valor_sql_direto}")
-                                else:
-                                    print(f"  ✅ CONSISTENTE: Python={placas_sem_motorista} = SQL={valor_sql_direto}")
-                        except Exception as e:
-                            print(f"  Erro na validação SQL: {e}")
-                            
-                    else:
-                        placas_sem_motorista = 0
-                        print("  ERRO: Não foi possível identificar o campo motoristaRAS")
-                        
-                        # Se não encontrou motoristaRAS, fazer busca geral
-                        print("\nETAPA 3: Busca geral por 'NÃO IDENTIFICADO' em todos os campos...")
-                        for registro in result:
-                            placa = registro[0] if registro[0] else ''
-                            for campo in registro:
-                                if campo == 'NÃO IDENTIFICADO':
-                                    placas_nao_identificado.add(placa)
-                                    break
-                        placas_sem_motorista = len(placas_nao_identificado)
-                        print(f"  Total com busca geral: {placas_sem_motorista}")
-                
-                print(f"RESULTADO FINAL: {placas_sem_motorista} veículos sem motoristas")
-                print("=== FIM DEBUG ===\n")
-                
+                if getattr(settings, 'JORNADA_PROFILING', False):
+                    # Diagnóstico opcional: confere a contagem com uma consulta direta no banco
+                    try:
+                        validacao = ConsultaJornada('COUNT(DISTINCT placa)').periodo(
+                            da or data_inicial_default, df or data_final_default
+                        ).igual('motoristaRAS', 'NÃO IDENTIFICADO')
+                        validacao_result = cf.getAll(*validacao.sql())
+                        valor_sql_direto = validacao_result[0][0] if validacao_result else 0
+                        logging.info(f"controleJornada: {len(result)} registros, colunas={colunas}, "
+                                     f"stats={stats}, validação SQL sem motorista={valor_sql_direto}")
+                    except Exception as e:
+                        logging.error(f"controleJornada: erro na validação SQL: {e}")
+
                 return render(request, 'trucks/controleJornada.html', {
                     'sqlConnect': result, 
                     'form': form,
-                    'tJornada': totais[0],
-                    'paradoLigado': totais[1],
-                    'veiMovimento': totais[2],
-                    'horarioAlmoco': totais[3],
-                    'tempoEspera': totais[4],
-                    'tempoDescanso': totais[5],
-                    'tempoNoturno': totais[6],
-                    'extrasDiurnas': totais[7],
-                    'extraNoturno': totais[8],
-                    'total_placas_distintas': total_placas_distintas,
-                    'veiculos_nao_identificados': veiculos_nao_identificados,
-                    'placas_sem_motorista': placas_sem_motorista,
+                    'tJornada': totais['tJornada'],
+                    'paradoLigado': totais['paradoLigado'],
+                    'veiMovimento': totais['veiMovimento'],
+                    'horarioAlmoco': totais['horarioAlmoco'],
+                    'tempoEspera': totais['tempoEspera'],
+                    'tempoDescanso': totais['tempoDescanso'],
+                    'tempoNoturno': totais['tempoNoturno'],
+                    'extrasDiurnas': totais['extrasDiurnas'],
+                    'extraNoturno': totais['extraNoturno'],
+                    'total_placas_distintas': stats['total_placas_distintas'],
+                    'veiculos_nao_identificados': stats['veiculos_nao_identificados'],
+                    'placas_sem_motorista': stats['placas_sem_motorista'],
                     'result_placa': placas,
                     'result_motorista': motoristas,
                 })
@@ -341,61 +243,6 @@ def controleJornada(request):
     })
 
 
-def procHoras(tabela):
-    """Função para processar horas dos dados de jornada"""
-    paradoLigado = 0
-    veiMovimento = 0
-    tempoNoturno = 0
-    horarioAlmoco = 0
-    extraNoturno = 0
-    tempoEspera = 0
-    tempoJornada = 0
-    extrasDiurnas = 0
-    tempoDescaso = 0
-
-    for i in tabela:
-        tempoJornada = tempoJornada + int(convertSegundo(i[8]))
-        paradoLigado = paradoLigado + int(convertSegundo(i[9]))
-        veiMovimento = veiMovimento + int(convertSegundo(i[10]))
-        horarioAlmoco = horarioAlmoco + int(convertSegundo(i[11]))
-        tempoEspera = tempoEspera + int(convertSegundo(i[12]))
-        tempoDescaso = tempoDescaso + int(convertSegundo(i[13]))
-        tempoNoturno = tempoNoturno + int(convertSegundo(i[16]))
-        extrasDiurnas = extrasDiurnas + int(convertSegundo(i[17]))
-        extraNoturno = extraNoturno + int(convertSegundo(i[18]))
-    
-    listFormatada = horasFormatada(
-        [tempoJornada, paradoLigado, veiMovimento, horarioAlmoco, tempoEspera, tempoDescaso, tempoNoturno,
-         extrasDiurnas, extraNoturno])
-
-    return listFormatada
-
-
-def convertSegundo(str):
-    """Converte string de hora para segundos"""
-    str2 = str
-    if str == None:
-        str2 = '00:00:00'
-    horasSegundos = int(str2[0:2]) * 3600
-    minutosSegundos = int(str2[3:5]) * 60
-    segundos = int(str2[6:9])
-
-    total = horasSegundos + minutosSegundos + segundos
-    return total
-
-
-def horasFormatada(*args):
-    """Formata segundos de volta para formato de horas"""
-    list = []
-    for i in range(9):
-        horas = str(int(args[0][i] / 3600))
-        minutos = ('0' + str(int((args[0][i] / 60) % 60)))[-2:3]
-        segundos = ('0' + str((args[0][i] % 3600) % 60))[-2:3]
-        tempo = f"{horas}:{minutos}:{segundos}"
-        list.append(tempo)
-        i = i + 1
-    return list
-
 class ControleJornadaView(LoginRequiredMixin, PermissionRequiredMixin, TemplateView):
     """
     View para controle de jornadas de motoristas.
@@ -971,9 +818,10 @@ class ImportacaoExcelView(LoginRequiredMixin, PermissionRequiredMixin, TemplateV
             # Inserir no banco usando connectionFactory
             if listCorpo:
                 sql = 'insert into trucks_ImportadosExcel values(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)'
-                cf.insertLote(sql, listCorpo)
+                resumo = cf.insertBulk(sql, listCorpo)
                 
-                logging.info(f'Processado arquivo {nome_original}: {len(listCorpo)} registros inseridos')
+                logging.info(f'Processado arquivo {nome_original}: {len(listCorpo)} registros inseridos '
+                             f'({resumo["linhas_por_segundo"]} linhas/s)')
                 return len(listCorpo)
             else:
                 logging.warning(f'Arquivo {nome_original} não contém dados válidos')